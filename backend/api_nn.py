@@ -0,0 +1,78 @@
+# backend/api_nn.py
+#API légère sans torch pour les déploiements qui ne servent que /neural-net : moteur numpy (numpy_model.py)
+#le .npz se génère avec torch une seule fois : python numpy_model.py --pt modele_predic_2.pt --npz modele_predic_2.npz
+#lancement : uvicorn api_nn:app --host 0.0.0.0 --port 8000 (image : Dockerfile.nn, monsters_rta.json monté au lancement)
+import logging
+import os
+import time
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+import metriques
+import numpy_model
+from nn_cache import CacheEvaluations
+import livre_ouvertures
+import registre_monstres
+from contexte_nn import DraftState, contexte_neural_net
+
+metriques.configurer_logs()
+logger = logging.getLogger("api_nn")
+
+app = FastAPI(title="SWARM-LLM Python API (neural-net)")
+app.middleware("http")(metriques.middleware_http)
+profileur = metriques.demarrer_profileur()
+
+MODELE_NPZ = os.environ.get("MODELE_NPZ", "modele_predic_2.npz")
+DOSSIER_CACHE = os.environ.get("DOSSIER_CACHE", "cache")
+LIVRE_OUVERTURES = os.environ.get("LIVRE_OUVERTURES", os.path.join(DOSSIER_CACHE, "livre_ouvertures.npy"))
+REGISTRE_CACHE = os.environ.get("REGISTRE_CACHE", os.path.join(DOSSIER_CACHE, "registre_monstres.npz"))
+etat_modeles = {"mlp": {"etat": "attente", "erreur": None, "duree_s": None}}
+metriques.registre.collecteur(lambda: metriques.stats_modele(globals().get("model")))
+
+
+@app.on_event("startup")
+def load_model():
+    global model
+    global model_infos
+    global registre
+    debut = time.perf_counter()
+    model, model_infos = numpy_model.charger_npz(MODELE_NPZ)
+    model.cache = CacheEvaluations(taille_max=100_000)
+    registre = registre_monstres.charger("monsters_rta.json", model_infos["dict_mapp_index"], REGISTRE_CACHE)
+    model_infos["registre"] = registre
+    if LIVRE_OUVERTURES:
+        livre_ouvertures.preparer(model, MODELE_NPZ, LIVRE_OUVERTURES)
+    etat_modeles["mlp"].update(etat="pret", duree_s=round(time.perf_counter() - debut, 3))
+    logger.info("Modèle numpy chargé en %s s", etat_modeles["mlp"]["duree_s"])
+
+
+@app.get("/health")
+def get_health():
+    return {"vivant": True, "pret": etat_modeles["mlp"]["etat"] == "pret", "modeles": etat_modeles}
+
+
+@app.post("/neural-net")
+def get_neural_net_context(draft_state: DraftState, format: str = "texte"):
+    return contexte_neural_net(numpy_model, model, model_infos, registre, draft_state, format)
+
+
+@app.get("/nn-cache")
+def get_nn_cache_stats():
+    return model.cache.stats()
+
+
+@app.get("/opening-book")
+def get_opening_book_stats():
+    livre = getattr(model, "livre", None)
+    return livre.stats() if livre is not None else {"etat": "absent ou construit pour un autre modèle"}
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metriques.registre.exposer(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profil")
+def get_profil(reinitialiser: bool = False):
+    if profileur is None:
+        raise HTTPException(status_code=404, detail="profileur désactivé (PROFILEUR_MS)")
+    return PlainTextResponse(profileur.folded(reinitialiser))
@@ -0,0 +1,292 @@
+# backend/bench.py
+#benchmark reproductible du backend : chaque branche de /neural-net (predict_*) et predict_nexts_monsters,
+#en direct et à travers l'app FastAPI (TestClient), sur des drafts générées avec une graine fixe
+#pour chaque scénario : p50 / p95 / p99 (ms) et allocations d'un appel (tracemalloc), résultats en json
+#usage : python bench.py [--sortie bench.json] [--baseline bench_baseline.json] [--maj-baseline]
+#                        [--repetitions 30] [--repetitions-llm 3] [--boxes 10 20 40 80] [--moteurs torch numpy]
+#                        [--modele modele_predic_2.pt] [--llm full_model_finetuned] [--sans-llm] [--sans-api]
+#hors ligne et sur CPU : sans modele_predic_2.pt, réseau de même forme initialisé au hasard sur les monstres de
+#monsters_rta.json (ou une liste par défaut) ; sans les poids du LLM, modèle aléatoire de même config (bench_llm.charger)
+#le cache des évaluations et le livre d'ouvertures sont désactivés : on mesure le calcul, pas les hits
+#tracemalloc ne voit pas l'allocateur de torch : les allocations du moteur numpy sont complètes, celles de torch partielles
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#avant d'importer main : pas de fenêtre de micro-batching ni de workers, une requête = une mesure
+os.environ.setdefault("FENETRE_BATCH_MS", "0")
+os.environ.setdefault("NB_WORKERS", "0")
+os.environ.setdefault("NIVEAU_LOG", "WARNING")
+
+import torch
+import main
+import my_model
+import numpy_model
+import registre_monstres
+from load_test import MONSTRES_DEFAUT, percentile
+
+TAILLES_BOX = [10, 20, 40, 80]
+#branche de contexte_neural_net -> (picks de A, picks de B) de chaque tour qui y mène
+PHASES_NN = {
+    "predict_one": [(0, 0)],
+    "predict_two_complete": [(0, 1), (1, 2), (2, 3)],
+    "predict_two_contrainte": [(3, 4)],
+    "predict_one_contrainte": [(4, 5)],
+    "predict_ban": [(5, 5)],
+    "predict_top_paires": [(1, 2)],     #mode conseil (playerBPossibleCounter sans 1)
+}
+PHASES_LLM = [(0, 0), (1, 2), (3, 4)]
+
+
+def charger_monstres(ids_modele=None):
+    #{id: monstre} comme main.charger_mlp ; sans monsters_rta.json, les monstres du réseau (ou une liste inventée
+    #d'au moins 200 monstres) avec des noms inventés
+    if os.path.exists("monsters_rta.json"):
+        with open("monsters_rta.json") as f:
+            return {monstre["id"]: monstre for monstre in json.load(f)}
+    ids = ids_modele or MONSTRES_DEFAUT + [90000 + i for i in range(200 - len(MONSTRES_DEFAUT))]
+    return {id: {"id": id, "name": f"monstre {id}"} for id in ids}
+
+
+def modele_remplacant(ids, layers=(512, 128, 64)):
+    #même architecture que modele_predic_2.pt, poids aléatoires (graine fixe), un index par monstre connu
+    torch.manual_seed(0)
+    input_dim = len(ids) + 1
+    model = main.SimpleDraftModel_sparse(input_dim, list(layers))
+    return {
+        "modele_nn": model.state_dict(),
+        "calibration_proba": (torch.tensor(1.), torch.tensor(0.)),
+        "dict_mapp_index": {0: 0, **{id: i + 1 for i, id in enumerate(ids)}},
+        "modele_name_and_param": (input_dim, list(layers)),
+    }
+
+
+def charger_mlp(chemin, monstres, moteurs):
+    #{moteur: (model, model_infos)} ; chemin None : remplaçant aléatoire sur les monstres
+    dossier = tempfile.mkdtemp(prefix="bench-")
+    if chemin is None:
+        chemin = os.path.join(dossier, "modele.pt")
+        torch.save(modele_remplacant(sorted(monstres)), chemin)
+    model_infos = torch.load(chemin, map_location="cpu")
+    input_dim,layers = model_infos["modele_name_and_param"]
+    model = main.SimpleDraftModel_sparse(input_dim,layers)
+    model.load_state_dict(model_infos["modele_nn"])
+    model.eval()
+    model.preparer()
+    modeles = {}
+    if "torch" in moteurs:
+        modeles["torch"] = (model, model_infos)
+    if "numpy" in moteurs:
+        chemin_npz = os.path.join(dossier, "modele.npz")
+        numpy_model.exporter(chemin, chemin_npz)
+        modeles["numpy"] = numpy_model.charger_npz(chemin_npz)
+    #registre des monstres posé dans model_infos comme au démarrage de main et api_nn
+    registre = registre_monstres.RegistreMonstres(registre_monstres.compiler(list(monstres.values()), model_infos["dict_mapp_index"]))
+    for _, infos in modeles.values():
+        infos["registre"] = registre
+    return modeles
+
+
+def charger_llm(dossier, registre):
+    from bench_llm import charger
+    from lll_fine_tuned import preparer_prefixe, TrieMonstres
+    origine = "reel" if any(f.endswith((".safetensors", ".bin")) for f in os.listdir(dossier)) else "remplacant"
+    llm, tokenizer = charger(dossier)
+    preparer_prefixe(llm, tokenizer)
+    return llm, tokenizer, TrieMonstres(tokenizer, registre=registre.tokeniser(tokenizer)), origine
+
+
+def generer_fixtures(ids, phases, tailles_box, graine=0):
+    #une DraftState (dict) par tour et par taille de box, picks et box tirés sans remise
+    rng = random.Random(graine)
+    fixtures = []
+    for nb_A, nb_B in phases:
+        for taille in tailles_box:
+            tires = rng.sample(ids, nb_A + nb_B)
+            reste = [m for m in ids if m not in tires]
+            fixtures.append({
+                "playerAPicks": tires[:nb_A],
+                "playerBPicks": tires[nb_A:],
+                "currentPhase": "banning" if nb_A == nb_B == 5 else "picking",
+                "playerAAvailableIds": rng.sample(reste, min(taille, len(reste))),
+                "playerBPossibleCounter": [1],
+            })
+    return fixtures
+
+
+def appel_nn(branche, model, model_infos, draft):
+    fonction = getattr(my_model, branche)
+    A, B, dispo = draft["playerAPicks"], draft["playerBPicks"], draft["playerAAvailableIds"]
+    if branche == "predict_ban":
+        return lambda: fonction(model, model_infos, A, B)
+    if branche == "predict_top_paires":
+        return lambda: fonction(model, model_infos, A, B, dispo, 5)
+    return lambda: fonction(model, model_infos, A, B, dispo)
+
+
+def mesurer(appel, repetitions, graine=None):
+    #latences en ms (après un appel d'échauffement), puis un appel sous tracemalloc pour les allocations
+    #graine : posée avant chaque appel (sampling du LLM) pour que chaque répétition fasse le même travail
+    def appeler():
+        if graine is not None:
+            torch.manual_seed(graine)
+            random.seed(graine)
+        return appel()
+
+    appeler()
+    latences = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        appeler()
+        latences.append((time.perf_counter() - debut) * 1000)
+    tracemalloc.start()
+    appeler()
+    taille, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"n": repetitions, "p50_ms": percentile(latences, 50), "p95_ms": percentile(latences, 95),
+            "p99_ms": percentile(latences, 99), "moyenne_ms": sum(latences) / len(latences),
+            "alloc_pic_ko": pic / 1024, "alloc_restant_ko": taille / 1024}
+
+
+def installer_dans_app(modeles, llm):
+    #remplace le chargement au démarrage de main par les modèles du benchmark (mêmes objets qu'en direct)
+    def installer():
+        model, model_infos = modeles
+        model.cache = None
+        main.versions.installer("mlp", {"model": model, "model_infos": model_infos, "registre": model_infos["registre"],
+                                        "table_synergies": None})
+        if llm is not None:
+            main.versions.installer("llm", {"llm": llm[0], "tokenizer": llm[1], "trie": llm[2]})
+        for nom, etat in main.etat_modeles.items():
+            if nom == "mlp" or llm is not None:
+                etat.update(etat="pret")
+    hooks = main.app.router.on_startup
+    hooks[hooks.index(main.load_model)] = installer
+
+
+def comparer(resultats, baseline, seuil):
+    #ratio des p50 par scénario, les régressions sont celles au-dessus de 1 + seuil
+    regressions = []
+    print(f"{'scénario':55} {'base p50':>10} {'p50':>10} {'ratio':>7}")
+    for nom, mesure in resultats.items():
+        if nom not in baseline:
+            continue
+        ratio = mesure["p50_ms"] / max(baseline[nom]["p50_ms"], 1e-9)
+        marque = ""
+        if ratio > 1 + seuil:
+            regressions.append(nom)
+            marque = "  <- régression"
+        elif ratio < 1 - seuil:
+            marque = "  <- plus rapide"
+        print(f"{nom:55} {baseline[nom]['p50_ms']:10.2f} {mesure['p50_ms']:10.2f} {ratio:7.2f}{marque}")
+    return regressions
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sortie", default="bench.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--maj-baseline", action="store_true", help="écrit les résultats comme nouvelle baseline")
+    parser.add_argument("--seuil", type=float, default=0.10, help="écart de p50 toléré avant de signaler une régression")
+    parser.add_argument("--echec-si-regression", action="store_true", help="code de sortie 1 si une régression est trouvée")
+    parser.add_argument("--repetitions", type=int, default=30)
+    parser.add_argument("--repetitions-llm", type=int, default=3)
+    parser.add_argument("--boxes", type=int, nargs="+", default=TAILLES_BOX)
+    parser.add_argument("--moteurs", nargs="+", default=["torch", "numpy"], choices=["torch", "numpy"])
+    parser.add_argument("--modele", default="modele_predic_2.pt")
+    parser.add_argument("--llm", default="full_model_finetuned")
+    parser.add_argument("--sans-llm", action="store_true")
+    parser.add_argument("--sans-api", action="store_true")
+    parser.add_argument("--threads", type=int, default=0, help="threads torch (0 : défaut de torch)")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    origine_mlp = "reel" if os.path.exists(args.modele) else "remplacant"
+    ids_modele = None
+    if origine_mlp == "reel":
+        ids_modele = [id for id, index in torch.load(args.modele, map_location="cpu")["dict_mapp_index"].items() if index != 0]
+    monstres = charger_monstres(ids_modele)
+    modeles = charger_mlp(args.modele if origine_mlp == "reel" else None, monstres, args.moteurs)
+    #seulement les monstres connus du réseau, comme le pool RTA de /draft-search
+    model_infos = next(iter(modeles.values()))[1]
+    ids = sorted(id for id in monstres if model_infos["dict_mapp_index"].get(id, 0) != 0)
+    llm = None
+    if not args.sans_llm and os.path.isdir(args.llm):
+        llm = charger_llm(args.llm, model_infos["registre"])
+    elif not args.sans_llm:
+        print(f"Dossier du LLM {args.llm} absent, scénarios LLM ignorés", file=sys.stderr)
+
+    resultats = {}
+
+    def noter(nom, mesure):
+        resultats[nom] = mesure
+        print(f"{nom:55} p50 {mesure['p50_ms']:8.2f} ms  p99 {mesure['p99_ms']:8.2f} ms  pic {mesure['alloc_pic_ko']:9.1f} Ko",
+              file=sys.stderr)
+
+    fixtures_nn = {branche: generer_fixtures(ids, phases, args.boxes) for branche, phases in PHASES_NN.items()}
+    for moteur, (model, infos) in modeles.items():
+        for branche, fixtures in fixtures_nn.items():
+            for draft in fixtures:
+                nom = f"nn/{moteur}/{branche}/{len(draft['playerAPicks'])}-{len(draft['playerBPicks'])}/box{len(draft['playerAAvailableIds'])}"
+                noter(nom, mesurer(appel_nn(branche, model, infos, draft), args.repetitions))
+
+    fixtures_llm = generer_fixtures(ids, PHASES_LLM, args.boxes)
+    if llm is not None:
+        from lll_fine_tuned import predict_nexts_monsters
+        for i, draft in enumerate(fixtures_llm):
+            requete = (draft["playerAPicks"], draft["playerBPicks"], draft["playerAAvailableIds"])
+            nom = f"llm/{len(requete[0])}-{len(requete[1])}/box{len(requete[2])}"
+            noter(nom, mesurer(lambda: predict_nexts_monsters(llm[0], llm[1], *requete, trie=llm[2]), args.repetitions_llm, i))
+
+    if not args.sans_api:
+        from fastapi.testclient import TestClient
+        moteur = "torch" if "torch" in modeles else "numpy"
+        installer_dans_app(modeles[moteur], llm)
+        with TestClient(main.app) as client:
+            for branche, fixtures in fixtures_nn.items():
+                for draft in fixtures:
+                    if branche == "predict_top_paires":
+                        draft = dict(draft, playerBPossibleCounter=[0])
+                    nom = f"api/neural-net/{moteur}/{branche}/{len(draft['playerAPicks'])}-{len(draft['playerBPicks'])}/box{len(draft['playerAAvailableIds'])}"
+                    noter(nom, mesurer(lambda: client.post("/neural-net", json=draft).raise_for_status(), args.repetitions))
+            if llm is not None:
+                for i, draft in enumerate(fixtures_llm):
+                    nom = f"api/llm-predict/{len(draft['playerAPicks'])}-{len(draft['playerBPicks'])}/box{len(draft['playerAAvailableIds'])}"
+                    noter(nom, mesurer(lambda: client.post("/llm-predict", json=draft).raise_for_status(), args.repetitions_llm, i))
+
+    sortie = {
+        "meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "torch": torch.__version__,
+                 "threads_torch": torch.get_num_threads(), "machine": platform.machine(), "processeur": platform.processor(),
+                 "mlp": origine_mlp, "llm": llm[3] if llm is not None else None, "repetitions": args.repetitions,
+                 "fenetre_batch_ms": os.environ["FENETRE_BATCH_MS"]},
+        "resultats": resultats,
+    }
+    with open(args.sortie, "w") as f:
+        json.dump(sortie, f, indent=1)
+    print(f"Résultats écrits dans {args.sortie}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.maj_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("mlp") != origine_mlp or baseline["meta"].get("llm") != sortie["meta"]["llm"]:
+            print("Attention : la baseline a été mesurée avec d'autres poids (réels / remplaçants)")
+        regressions = comparer(resultats, baseline["resultats"], args.seuil)
+        print(f"{len(regressions)} régression(s) au-delà de {args.seuil:.0%}")
+    if args.maj_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(sortie, f, indent=1)
+        print(f"Baseline mise à jour : {args.baseline}")
+    if regressions and args.echec_si_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,58 @@
+# backend/bench_llm.py
+#benchmark du décodage de predict_nexts_monsters : temps par token avec et sans KV cache
+#usage : python bench_llm.py [--modele full_model_finetuned] [--repetitions 5]
+#si les poids ne sont pas dans le dossier, on prend un modèle de même config initialisé au hasard
+import argparse
+import os
+import time
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM
+from lll_fine_tuned import predict_nexts_monsters, preparer_prefixe
+
+DRAFTS = [
+    ([], [], [23711, 16811, 28312, 23712, 17411, 26113]),
+    ([23711], [16811, 28312], [23712, 17411, 26113, 21811, 28613, 16111]),
+    ([23711, 23712, 17411], [16811, 28312, 26113, 21811], [28613, 16111, 16613, 21115, 30512]),
+]
+
+
+def charger(dossier):
+    tokenizer = AutoTokenizer.from_pretrained(dossier)
+    if any(f.endswith((".safetensors", ".bin")) for f in os.listdir(dossier)):
+        model = AutoModelForCausalLM.from_pretrained(dossier)
+    else:
+        print("Poids absents dans " + dossier + ", modèle aléatoire de même config")
+        torch.manual_seed(0)
+        model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(dossier))
+    model.eval()
+    return model, tokenizer
+
+
+def mesurer(model, tokenizer, kv_cache, repetitions):
+    #temps moyen par passe du modèle (= par token généré) sur toutes les drafts
+    passes = [0]
+    hook = model.register_forward_hook(lambda *args: passes.__setitem__(0, passes[0] + 1))
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        for pickA, pickB, dispo in DRAFTS:
+            predict_nexts_monsters(model, tokenizer, pickA, pickB, dispo, kv_cache=kv_cache)
+    duree = time.perf_counter() - debut
+    hook.remove()
+    return duree / passes[0] * 1000, duree / (repetitions * len(DRAFTS)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modele", default="full_model_finetuned")
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+    model, tokenizer = charger(args.modele)
+    preparer_prefixe(model, tokenizer)
+    for kv_cache in (False, True):
+        mesurer(model, tokenizer, kv_cache, 1)  #échauffement
+        par_token, par_requete = mesurer(model, tokenizer, kv_cache, args.repetitions)
+        print(f"kv_cache={kv_cache!s:5}  {par_token:7.2f} ms/token  {par_requete:8.1f} ms/requête")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# backend/contexte_nn.py
+#réponse texte de /neural-net, sans torch : partagée par main.py (moteur torch) et api_nn.py (moteur numpy)
+from pydantic import BaseModel
+from pydantic import Field
+from typing import List
+from fastapi import Response
+from fastapi.responses import JSONResponse
+import logging
+from metriques import DUREE_BRANCHES
+
+logger = logging.getLogger(__name__)
+
+
+class DraftState(BaseModel):
+    playerAPicks: List[int]
+    playerBPicks: List[int]
+    playerABans: List[int] = Field(default_factory=list)
+    playerBBans: List[int] = Field(default_factory=list)
+    currentPhase: str
+    playerAAvailableIds: List[int]
+    playerBPossibleCounter : List[int]
+
+
+def contexte_neural_net(moteur,model,model_infos,registre,draft_state,format="texte"):
+    #moteur : module qui fournit les predict_* (my_model, ou numpy_model pour api_nn.py)
+    #registre : registre_monstres.RegistreMonstres, pour les noms
+    #format="json" : le mode conseil renvoie aussi les paires (ids, noms, probas) en plus du texte
+    context = (f"Contexte généré pour picks {draft_state.playerAPicks} vs {draft_state.playerBPicks}\n"
+    f"le joueur A à comme choix : {draft_state.playerAAvailableIds} et le joueur B à comme counter possible : {draft_state.playerBPossibleCounter}" 
+    )
+    logger.debug(context)
+    #on utilise le model : 
+    if (1 in draft_state.playerBPossibleCounter): 
+        #on utilse le nn pour avoir les prochains picks
+        if len(draft_state.playerAPicks)==0 and len(draft_state.playerBPicks)==0:
+            with DUREE_BRANCHES.mesurer(branche="predict_one"):
+                id,proba = moteur.predict_one(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
+            string_response = f"Le réseau de Neurone recommande le monstre {registre.nom(id)} pour une propabilité de victoire de {proba:.4f}%"
+            return Response(content=string_response, media_type="text/plain")
+        elif (len(draft_state.playerBPicks)==2 and len(draft_state.playerAPicks)==1) or(len(draft_state.playerBPicks)==1 and len(draft_state.playerAPicks)==0) or (len(draft_state.playerBPicks)==3 and len(draft_state.playerAPicks)==2):
+            with DUREE_BRANCHES.mesurer(branche="predict_two_complete"):
+                id1,id2,proba = moteur.predict_two_complete(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
+            string_response = f"Le réseau de Neurone recommande le monstre {registre.nom(id1)} et {registre.nom(id2)} pour une propabilité de victoire de {proba:.4f}%"
+            return Response(content=string_response, media_type="text/plain")
+
+        elif len(draft_state.playerAPicks)==5 and len(draft_state.playerBPicks)==5: 
+            #phase de ban 
+            with DUREE_BRANCHES.mesurer(branche="predict_ban"):
+                id,proba = moteur.predict_ban(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks)
+            string_response = f"Le réseau de Neurone recommande de bannir  {registre.nom(id)}  pour une propabilité de victoire dans le pire cas {proba:.4f}%"
+            return Response(content=string_response, media_type="text/plain")
+
+        elif len(draft_state.playerAPicks)==4 and len(draft_state.playerBPicks)==5:
+            with DUREE_BRANCHES.mesurer(branche="predict_one_contrainte"):
+                id,proba = moteur.predict_one_contrainte(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
+            string_response = f"Le réseau de Neurone recommande le monstre {registre.nom(id)} pour une propabilité de victoire de {proba:.4f}%"
+            return Response(content=string_response, media_type="text/plain")
+
+        elif len(draft_state.playerAPicks)==3 and len(draft_state.playerBPicks)==4:
+            with DUREE_BRANCHES.mesurer(branche="predict_two_contrainte"):
+                id1,id2,proba = moteur.predict_two_contrainte(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
+            string_response = f"Le réseau de Neurone recommande le monstre {registre.nom(id1)} et {registre.nom(id2)} pour une propabilité de victoire de {proba:.4f}%"
+            return Response(content=string_response, media_type="text/plain")
+        else :
+            DUREE_BRANCHES.observer(0., branche="non_supporte")
+            logger.warning("Le mode n'est pas supporté draftstate : %s", draft_state)
+    else : 
+        #mode conseil pour le llm online : toutes les paires dispo sont évaluées en une passe, on garde les num_returned meilleures
+        num_returned = 5
+        with DUREE_BRANCHES.mesurer(branche="predict_top_paires"):
+            top = moteur.predict_top_paires(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds,num_returned)
+        # construire la chaîne finale avec les scores affichés par ordre croissant
+        lines = ["Info neural network sur le choix des monstres pour JA : "] 
+        for a, b, sortie in reversed(top):
+            lines.append(f'Si JA pick : {registre.nom(a)} et {registre.nom(b)}, proba win : {sortie:.4f} ')
+        context_str = "\n".join(lines)
+        if format == "json":
+            #même texte pour le prompt, plus les paires structurées (meilleure en premier)
+            paires = [{"ids": [a, b], "names": [registre.nom(a), registre.nom(b)], "proba": sortie} for a, b, sortie in top]
+            return JSONResponse({"texte": context_str, "paires": paires})
+        return Response(content=context_str, media_type="text/plain")
@@ -0,0 +1,214 @@
+# backend/draft_search.py
+#recherche sur toute la draft RTA : on déroule le vrai ordre des picks (1-2-2-2-2-1 puis les bans)
+#avec un alpha-beta (A maximise, B minimise) dont les feuilles sont évaluées par le réseau calibré de my_model
+import time
+from itertools import combinations
+from my_model import indices_monstres, pad_indices, probas_batch, predict_ban, SANS_UN
+
+ORDRE_PICKS = [1, 2, 2, 2, 2, 1]  #nombre de picks par tour, le premier joueur commence
+
+
+class TempsEcoule(Exception):
+    pass
+
+
+def prochain_tour(nb_A, nb_B, premier="A"):
+    #renvoie (joueur, nombre de picks) pour le prochain tour, None quand les picks sont finis (phase de ban)
+    #et None aussi si l'état ne correspond pas à l'ordre RTA avec ce premier joueur
+    second = "B" if premier == "A" else "A"
+    compte = {"A": 0, "B": 0}
+    for i, nb in enumerate(ORDRE_PICKS):
+        joueur = premier if i % 2 == 0 else second
+        if compte["A"] == nb_A and compte["B"] == nb_B:
+            return joueur, nb
+        compte[joueur] += nb
+    return None
+
+
+def premier_joueur(nb_A, nb_B):
+    #le premier joueur se déduit des comptes, sauf au tout début où on suppose que A commence
+    if prochain_tour(nb_A, nb_B, "A") is not None or nb_A == nb_B == 0:
+        return "A"
+    return "B"
+
+
+def canonique(joueur_A, joueur_B):
+    #clé de la table de transposition : l'ordre des picks dans une équipe ne change rien au réseau
+    return tuple(sorted(joueur_A)), tuple(sorted(joueur_B))
+
+
+class RechercheDraft:
+    def __init__(self, model, model_infos, dispo_A, dispo_B, premier="A",
+                 profondeur=2, largeur=6, budget_ms=200):
+        #dispo_A : box du joueur A, dispo_B : monstres que B peut jouer (pool RTA)
+        #profondeur : nombre de tours regardés, largeur : nombre de coups gardés par noeud (beam)
+        #budget_ms : temps max, on approfondit itérativement et on garde la dernière profondeur finie
+        #(ou, si la profondeur 1 n'a pas fini, le meilleur coup de la racine trouvé avant la fin du temps)
+        self.model = model
+        self.model_infos = model_infos
+        self.dispo = {"A": list(dict.fromkeys(dispo_A)), "B": list(dict.fromkeys(dispo_B))}
+        self.premier = premier
+        self.profondeur = profondeur
+        self.largeur = largeur
+        self.budget_ms = budget_ms
+        self.feuilles = {}      #état canonique -> proba calibrée
+        self.table = {}         #(état canonique, profondeur) -> (valeur, type de borne, meilleur coup)
+        self.noeuds = 0
+        self.hits = 0
+        self.fin = None
+        self.iteration = 0      #profondeur en cours : un noeud à cette profondeur est la racine
+        self.partiel = None     #(valeur, coup) : meilleur coup de la racine trouvé pendant l'itération en cours
+
+    def valeurs(self, etats):
+        #évalue en une passe des états qui ont tous les mêmes tailles d'équipes
+        #une équipe de 5 est évaluée sur ses 5 versions à 4 (ban) : A bannit chez B (max), B bannit chez A (min)
+        resultats = [self.feuilles.get(etat) for etat in etats]
+        a_calculer = list(dict.fromkeys(etat for etat, r in zip(etats, resultats) if r is None))
+        self.hits += len(etats) - len(a_calculer)
+        if a_calculer:
+            nb_A, nb_B = len(a_calculer[0][0]), len(a_calculer[0][1])
+            s = len(a_calculer)
+            idx_A = indices_monstres(self.model_infos, [m for A, _ in a_calculer for m in A]).view(s, nb_A)
+            idx_B = indices_monstres(self.model_infos, [m for _, B in a_calculer for m in B]).view(s, nb_B)
+            idx_A = idx_A[:, SANS_UN] if nb_A == 5 else pad_indices(self.model_infos, idx_A, 4).unsqueeze(1)
+            idx_B = idx_B[:, SANS_UN] if nb_B == 5 else pad_indices(self.model_infos, idx_B, 4).unsqueeze(1)
+            na, nb = idx_A.shape[1], idx_B.shape[1]
+            idx_A = idx_A.unsqueeze(1).expand(s, nb, na, 4).reshape(-1, 4)
+            idx_B = idx_B.unsqueeze(2).expand(s, nb, na, 4).reshape(-1, 4)
+            probas = probas_batch(self.model, self.model_infos, idx_A, idx_B).view(s, nb, na)
+            for etat, p in zip(a_calculer, probas.amin(dim=2).amax(dim=1).tolist()):
+                self.feuilles[etat] = p
+            resultats = [self.feuilles[etat] for etat in etats]
+        return resultats
+
+    def verifier_temps(self):
+        #le temps n'est vérifié qu'entre deux passes du réseau : une passe commencée va jusqu'au bout
+        if time.perf_counter() > self.fin:
+            raise TempsEcoule()
+
+    def jouer(self, etat, joueur, monstres):
+        A, B = etat
+        if joueur == "A":
+            return canonique(A + tuple(monstres), B)
+        return canonique(A, B + tuple(monstres))
+
+    def coups(self, etat, joueur, nb, racine=False):
+        #coups candidats triés du meilleur au pire pour le joueur, limités à la largeur du beam
+        #pour un tour à 2 picks on classe d'abord les picks seuls puis on ne combine que les meilleurs
+        #à la racine, les deux meilleurs picks seuls servent de coup partiel si le temps finit avant les paires
+        pris = set(etat[0]) | set(etat[1])
+        pool = [m for m in self.dispo[joueur] if m not in pris]
+        if len(pool) < nb:
+            return []
+        signe = 1 if joueur == "A" else -1
+        simples = [(m,) for m in pool]
+        valeurs = self.valeurs([self.jouer(etat, joueur, c) for c in simples])
+        classes = sorted(zip(simples, valeurs), key=lambda cv: -signe*cv[1])
+        if nb == 2:
+            if racine and self.partiel is None:
+                self.partiel = (classes[0][1], classes[0][0] + classes[1][0])
+            self.verifier_temps()
+            meilleurs = [c[0] for c, _ in classes[:2*self.largeur]]
+            paires = list(combinations(meilleurs, 2))
+            valeurs = self.valeurs([self.jouer(etat, joueur, c) for c in paires])
+            classes = sorted(zip(paires, valeurs), key=lambda cv: -signe*cv[1])
+        return classes[:self.largeur]
+
+    def alphabeta(self, etat, profondeur, alpha, beta):
+        self.noeuds += 1
+        #la racine classe toujours ses coups (une passe) : même avec un budget minuscule, on renvoie un coup
+        racine = profondeur == self.iteration
+        if not racine:
+            self.verifier_temps()
+        tour = prochain_tour(len(etat[0]), len(etat[1]), self.premier)
+        if tour is None or profondeur == 0:
+            return self.valeurs([etat])[0], None
+        cle = (etat, profondeur)
+        if cle in self.table:
+            valeur, borne, coup = self.table[cle]
+            if borne == "exacte" or (borne == "min" and valeur >= beta) or (borne == "max" and valeur <= alpha):
+                self.hits += 1
+                return valeur, coup
+        alpha_depart, beta_depart = alpha, beta
+        joueur, nb = tour
+        candidats = self.coups(etat, joueur, nb, racine)
+        if not candidats:
+            return self.valeurs([etat])[0], None
+        meilleur, meilleur_coup = None, None
+        for coup, valeur_feuille in candidats:
+            if profondeur == 1:
+                valeur = valeur_feuille
+            else:
+                valeur, _ = self.alphabeta(self.jouer(etat, joueur, coup), profondeur - 1, alpha, beta)
+            if joueur == "A":
+                if meilleur is None or valeur > meilleur:
+                    meilleur, meilleur_coup = valeur, coup
+                alpha = max(alpha, valeur)
+            else:
+                if meilleur is None or valeur < meilleur:
+                    meilleur, meilleur_coup = valeur, coup
+                beta = min(beta, valeur)
+            if racine:
+                self.partiel = (meilleur, meilleur_coup)
+            if alpha >= beta:
+                break
+        if meilleur <= alpha_depart:
+            borne = "max"
+        elif meilleur >= beta_depart:
+            borne = "min"
+        else:
+            borne = "exacte"
+        self.table[cle] = (meilleur, borne, meilleur_coup)
+        return meilleur, meilleur_coup
+
+    def ligne(self, etat, profondeur):
+        #ligne principale reconstruite depuis la table de transposition
+        ligne = []
+        while profondeur > 0 and (etat, profondeur) in self.table:
+            coup = self.table[(etat, profondeur)][2]
+            tour = prochain_tour(len(etat[0]), len(etat[1]), self.premier)
+            if coup is None or tour is None:
+                break
+            ligne.append({"joueur": tour[0], "picks": list(coup)})
+            etat = self.jouer(etat, tour[0], coup)
+            profondeur -= 1
+        return ligne
+
+    def rechercher(self, joueur_A, joueur_B):
+        #approfondissement itératif sous budget_ms : chaque profondeur finie remplace la précédente ;
+        #si le temps finit pendant la profondeur 1, on renvoie le meilleur coup de la racine vu jusque-là
+        debut = time.perf_counter()
+        self.fin = debut + self.budget_ms / 1000
+        etat = canonique(joueur_A, joueur_B)
+        resultat = {"picks": [], "proba": self.valeurs([etat])[0], "profondeur": 0, "ligne": []}
+        interrompu = False
+        for profondeur in range(1, self.profondeur + 1):
+            self.iteration, self.partiel = profondeur, None
+            try:
+                valeur, coup = self.alphabeta(etat, profondeur, float("-inf"), float("inf"))
+            except TempsEcoule:
+                interrompu = True
+                tour = prochain_tour(len(etat[0]), len(etat[1]), self.premier)
+                if profondeur == 1 and self.partiel is not None and tour is not None:
+                    valeur, coup = self.partiel
+                    resultat = {"joueur": tour[0], "picks": list(coup), "proba": valeur, "profondeur": 0,
+                                "ligne": [{"joueur": tour[0], "picks": list(coup)}]}
+                break
+            if coup is None:
+                break
+            ligne = self.ligne(etat, profondeur)
+            resultat = {"joueur": ligne[0]["joueur"], "picks": list(coup), "proba": valeur, "profondeur": profondeur, "ligne": ligne}
+        resultat.update({"interrompu": interrompu, "noeuds": self.noeuds, "hits": self.hits, "table": len(self.table) + len(self.feuilles),
+                         "temps_ms": (time.perf_counter() - debut) * 1000})
+        return resultat
+
+
+def rechercher_draft(model, model_infos, joueur_A, joueur_B, dispo_A, dispo_B,
+                     profondeur=2, largeur=6, budget_ms=200):
+    #point d'entrée : prochain coup de A (picks, ou ban quand les deux équipes sont complètes)
+    if len(joueur_A) == 5 and len(joueur_B) == 5:
+        id_ban, proba = predict_ban(model, model_infos, joueur_A, joueur_B)
+        return {"ban": id_ban, "proba": proba, "profondeur": 0, "ligne": []}
+    premier = premier_joueur(len(joueur_A), len(joueur_B))
+    recherche = RechercheDraft(model, model_infos, dispo_A, dispo_B, premier, profondeur, largeur, budget_ms)
+    return recherche.rechercher(list(joueur_A), list(joueur_B))
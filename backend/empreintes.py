@@ -0,0 +1,37 @@
+# backend/empreintes.py
+#empreintes (sha256) des sources des caches compilés et des fichiers des modèles : un cache (livre d'ouvertures,
+#synergies, registre des monstres) n'est réutilisé que si les empreintes gardées dans son .json sont les mêmes,
+#et le rechargement à chaud (versions_modeles.py) ne charge une version que quand l'empreinte de ses fichiers change
+import hashlib
+import json
+import os
+
+
+def hash_fichier(chemin):
+    h = hashlib.sha256()
+    with open(chemin, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+def hash_mapping(mapping):
+    #dict_mapp_index du réseau (id -> index du one-hot)
+    return hashlib.sha256(json.dumps(sorted(mapping.items())).encode()).hexdigest()
+
+
+def empreinte_fichiers(*chemins):
+    #hash du contenu (fichiers de quelques Mo : poids du MLP, json)
+    return hashlib.sha256("".join(hash_fichier(chemin) for chemin in chemins).encode()).hexdigest()
+
+
+def empreinte_dossier(dossier):
+    #chemin, taille et date de chaque fichier : relire des Go de poids à chaque vérification coûterait trop cher
+    h = hashlib.sha256()
+    for racine, dossiers, fichiers in os.walk(dossier):
+        dossiers.sort()
+        for fichier in sorted(fichiers):
+            chemin = os.path.join(racine, fichier)
+            infos = os.stat(chemin)
+            h.update(f"{os.path.relpath(chemin, dossier)}:{infos.st_size}:{infos.st_mtime_ns}\n".encode())
+    return h.hexdigest()
@@ -0,0 +1,208 @@
+# backend/eval_drafts.py
+#évaluation hors ligne d'un export de drafts (JSONL, un draft par ligne) avec les modèles du backend
+#le fichier est lu par blocs, chaque bloc passe en une seule passe du réseau dans un pool de process,
+#les résultats sont écrits au fil de l'eau dans l'ordre (mémoire constante même sur des millions de lignes)
+#usage : python eval_drafts.py drafts.jsonl resultats.jsonl [--modele modele_predic_2.pt|.npz] [--processus 4]
+#                              [--taille-bloc 4096] [--llm full_model_finetuned] [--reprendre]
+#l'export de l'app (drafts/export-anonymous) se convertit avec : jq -c '.drafts[]' export.json > drafts.jsonl
+#champs lus : playerAPicks, playerBPicks, playerABans, playerBBans (optionnels), playerAAvailableIds (pour --llm),
+#draftId et winner recopiés dans la sortie ; proba = proba de victoire de A sur les équipes finales (après bans)
+#--reprendre repart du point de reprise (sortie + ".checkpoint") écrit après chaque bloc
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+
+def charger_moteur(chemin):
+    #(moteur, model, model_infos) : moteur numpy pour un .npz, torch pour le .pt
+    if chemin.endswith(".npz"):
+        import numpy_model as moteur
+        model, model_infos = moteur.charger_npz(chemin)
+        return moteur, model, model_infos
+    import torch
+    import my_model as moteur
+    from main import SimpleDraftModel_sparse
+    model_infos = torch.load(chemin, map_location="cpu")
+    input_dim,layers = model_infos["modele_name_and_param"]
+    model = SimpleDraftModel_sparse(input_dim,layers)
+    model.load_state_dict(model_infos["modele_nn"])
+    model.eval()
+    model.preparer()
+    return moteur, model, model_infos
+
+
+#état de chaque process du pool, rempli par initialiser
+worker = {}
+
+
+def initialiser(chemin_modele, dossier_llm):
+    worker["moteur"], worker["model"], worker["model_infos"] = charger_moteur(chemin_modele)
+    if "torch" in sys.modules:
+        #un thread torch par process, le parallélisme vient du pool
+        sys.modules["torch"].set_num_threads(1)
+    if dossier_llm:
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        from lll_fine_tuned import preparer_prefixe, TrieMonstres
+        worker["llm"] = AutoModelForCausalLM.from_pretrained(dossier_llm, low_cpu_mem_usage=True)
+        worker["tokenizer"] = AutoTokenizer.from_pretrained(dossier_llm)
+        preparer_prefixe(worker["llm"], worker["tokenizer"])
+        ids = [id for id, index in worker["model_infos"]["dict_mapp_index"].items() if index != 0]
+        worker["trie"] = TrieMonstres(worker["tokenizer"], ids)
+
+
+def equipe_finale(picks, bans_adverses):
+    return [m for m in picks if m not in set(bans_adverses)]
+
+
+def verifier_ids(ids):
+    #indices_monstres attend des int (int64) : un id mal formé fait passer la ligne en erreur, pas tout le bloc
+    for id in ids:
+        if type(id) is not int or not -2**63 <= id < 2**63:
+            raise TypeError(f"id de monstre invalide : {id!r}")
+    return ids
+
+
+def evaluer_bloc(bloc):
+    #bloc : liste de (numéro de ligne, texte) -> liste de lignes json à écrire
+    moteur, model, model_infos = worker["moteur"], worker["model"], worker["model_infos"]
+    resultats = []
+    drafts = []
+    for numero, texte in bloc:
+        try:
+            draft = json.loads(texte)
+            A = verifier_ids(equipe_finale(draft["playerAPicks"], draft.get("playerBBans") or []))
+            B = verifier_ids(equipe_finale(draft["playerBPicks"], draft.get("playerABans") or []))
+        except (ValueError, KeyError, TypeError) as erreur:
+            resultats.append({"ligne": numero, "erreur": repr(erreur)})
+            continue
+        resultat = {"ligne": numero}
+        for champ in ("draftId", "winner"):
+            if champ in draft:
+                resultat[champ] = draft[champ]
+        resultats.append(resultat)
+        drafts.append((resultat, draft, A, B))
+
+    if drafts:
+        #une seule passe du réseau pour tout le bloc, mêmes entrées que predict (pad_list à 4)
+        idx_A = moteur.indices_monstres(model_infos, [m for _, _, A, _ in drafts for m in moteur.pad_list(A, 4)]).reshape(-1, 4)
+        idx_B = moteur.indices_monstres(model_infos, [m for _, _, _, B in drafts for m in moteur.pad_list(B, 4)]).reshape(-1, 4)
+        for (resultat, _, _, _), proba in zip(drafts, moteur.probas_batch(model, model_infos, idx_A, idx_B).tolist()):
+            resultat["proba"] = proba
+
+    if "llm" in worker:
+        from lll_fine_tuned import predict_nexts_monsters_batch
+        avec_dispo = [(resultat, draft) for resultat, draft, _, _ in drafts if draft.get("playerAAvailableIds")]
+        for i in range(0, len(avec_dispo), 16):
+            lot = avec_dispo[i:i+16]
+            requetes = [(d["playerAPicks"], d["playerBPicks"], d["playerAAvailableIds"]) for _, d in lot]
+            with contextlib.redirect_stdout(io.StringIO()):
+                picks = predict_nexts_monsters_batch(worker["llm"], worker["tokenizer"], requetes, trie=worker["trie"])
+            #une draft dont les picks ne tiennent pas dans playerAAvailableIds : erreur sur sa ligne, comme le json invalide
+            for (resultat, _), p in zip(lot, picks):
+                if isinstance(p, Exception):
+                    resultat["erreur"] = repr(p)
+                else:
+                    resultat["llm"] = p
+    return [json.dumps(r) for r in resultats]
+
+
+def lire_blocs(chemin, offset, premiere_ligne, taille_bloc):
+    #renvoie (bloc, offset après le bloc), en binaire pour que l'offset soit une vraie position dans le fichier
+    with open(chemin, "rb") as f:
+        f.seek(offset)
+        numero = premiere_ligne
+        bloc = []
+        for ligne in iter(f.readline, b""):
+            if ligne.strip():
+                bloc.append((numero, ligne.decode()))
+            numero += 1
+            if len(bloc) >= taille_bloc:
+                yield bloc, f.tell(), numero
+                bloc = []
+        if bloc:
+            yield bloc, f.tell(), numero
+
+
+def lire_checkpoint(chemin):
+    try:
+        with open(chemin) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ecrire_checkpoint(chemin, etat):
+    with open(chemin + ".tmp", "w") as f:
+        json.dump(etat, f)
+    os.replace(chemin + ".tmp", chemin)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entree")
+    parser.add_argument("sortie")
+    parser.add_argument("--modele", default="modele_predic_2.pt")
+    parser.add_argument("--processus", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--taille-bloc", type=int, default=4096)
+    parser.add_argument("--llm", default=None, help="dossier du LLM pour ajouter predict_nexts_monsters")
+    parser.add_argument("--reprendre", action="store_true")
+    args = parser.parse_args()
+
+    chemin_checkpoint = args.sortie + ".checkpoint"
+    etat = {"offset": 0, "ligne": 0, "taille_sortie": 0, "evaluees": 0}
+    if args.reprendre:
+        etat = lire_checkpoint(chemin_checkpoint) or etat
+        print(f"Reprise à la ligne {etat['ligne']} (offset {etat['offset']})", file=sys.stderr)
+    #la sortie est ramenée à la taille du dernier point de reprise : un bloc écrit sans checkpoint est refait
+    with open(args.sortie, "ab") as f:
+        f.truncate(etat["taille_sortie"])
+
+    debut = time.perf_counter()
+    evaluees = 0
+    brier, justes, avec_vainqueur = 0., 0, 0
+    with multiprocessing.Pool(args.processus, initialiser, (args.modele, args.llm)) as pool, open(args.sortie, "a") as sortie:
+        en_cours = deque()     #au plus 2 blocs par process en vol : la lecture ne prend pas d'avance sur l'écriture
+        blocs = lire_blocs(args.entree, etat["offset"], etat["ligne"], args.taille_bloc)
+        fini = False
+        while en_cours or not fini:
+            while not fini and len(en_cours) < 2 * args.processus:
+                suivant = next(blocs, None)
+                if suivant is None:
+                    fini = True
+                    break
+                bloc, offset, ligne = suivant
+                en_cours.append((pool.apply_async(evaluer_bloc, (bloc,)), offset, ligne))
+            if not en_cours:
+                break
+            tache, offset, ligne = en_cours.popleft()
+            lignes = tache.get()
+            for texte in lignes:
+                resultat = json.loads(texte)
+                if resultat.get("winner") in ("A", "B") and "proba" in resultat:
+                    victoire = resultat["winner"] == "A"
+                    brier += (resultat["proba"] - victoire) ** 2
+                    justes += (resultat["proba"] > 0.5) == victoire
+                    avec_vainqueur += 1
+            sortie.write("".join(texte + "\n" for texte in lignes))
+            sortie.flush()
+            evaluees += len(lignes)
+            etat = {"offset": offset, "ligne": ligne, "taille_sortie": sortie.tell(), "evaluees": etat["evaluees"] + len(lignes)}
+            ecrire_checkpoint(chemin_checkpoint, etat)
+            duree = time.perf_counter() - debut
+            print(f"{etat['evaluees']} lignes, {evaluees / duree:.0f} lignes/s", file=sys.stderr)
+
+    duree = time.perf_counter() - debut
+    print(f"Terminé : {evaluees} lignes en {duree:.1f} s ({evaluees / duree if duree else 0:.0f} lignes/s)", file=sys.stderr)
+    if avec_vainqueur:
+        print(f"Sur {avec_vainqueur} drafts avec vainqueur : Brier {brier / avec_vainqueur:.4f}, "
+              f"précision {justes / avec_vainqueur:.1%}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
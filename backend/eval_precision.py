@@ -0,0 +1,92 @@
+# backend/eval_precision.py
+#évaluation hors ligne des précisions du LLM (fp32, bf16, int8) pour /llm-predict
+#rejoue des drafts dans predict_nexts_monsters et donne pour chaque mode : accord avec les picks du fp32,
+#latence par requête et mémoire résidente
+#usage : python eval_precision.py [--modele full_model_finetuned] [--drafts drafts.jsonl] [--nb 50] [--modes fp32 bf16 int8]
+#--drafts : un DraftState json par ligne (playerAPicks, playerBPicks, playerAAvailableIds), sinon drafts générés
+#chaque mode tourne dans son propre process pour que la mémoire mesurée soit la sienne
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import torch
+from bench_llm import charger
+from lll_fine_tuned import PRECISIONS, appliquer_precision, preparer_prefixe, predict_nexts_monsters, TrieMonstres
+from load_test import charger_monstres, generer_drafts
+
+
+def memoire_mo():
+    #mémoire résidente actuelle du process (VmRSS)
+    with open("/proc/self/status") as f:
+        for ligne in f:
+            if ligne.startswith("VmRSS:"):
+                return int(ligne.split()[1]) / 1024
+    return 0.
+
+
+def charger_drafts(chemin, nb):
+    if chemin is None:
+        return generer_drafts(charger_monstres(), nb)
+    with open(chemin) as f:
+        return [json.loads(ligne) for ligne in f if ligne.strip()][:nb]
+
+
+def evaluer_mode(args):
+    #process fils : un seul mode, picks de chaque draft en json sur la sortie standard
+    drafts = charger_drafts(args.drafts, args.nb)
+    model, tokenizer = charger(args.modele)
+    model = appliquer_precision(model, args.mode)
+    preparer_prefixe(model, tokenizer)
+    requetes = [(d["playerAPicks"], d["playerBPicks"], d["playerAAvailableIds"]) for d in drafts]
+    trie = TrieMonstres(tokenizer, [m for _, _, dispo in requetes for m in dispo])
+    picks = []
+    duree = 0.
+    with contextlib.redirect_stdout(io.StringIO()):
+        predict_nexts_monsters(model, tokenizer, *requetes[0], trie=trie)  #échauffement
+        for i, requete in enumerate(requetes):
+            #même graine pour chaque draft dans tous les modes : seul l'écart de précision change le sampling
+            torch.manual_seed(i)
+            random.seed(i)
+            debut = time.perf_counter()
+            picks.append(predict_nexts_monsters(model, tokenizer, *requete, trie=trie))
+            duree += time.perf_counter() - debut
+    print(json.dumps({"mode": args.mode, "picks": picks, "latence_ms": duree / len(requetes) * 1000,
+                      "memoire_mo": memoire_mo()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modele", default="full_model_finetuned")
+    parser.add_argument("--drafts", default=None)
+    parser.add_argument("--nb", type=int, default=50)
+    parser.add_argument("--modes", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--mode", default=None, choices=PRECISIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode is not None:
+        evaluer_mode(args)
+        return
+
+    resultats = {}
+    for mode in ["fp32"] + [m for m in args.modes if m != "fp32"]:
+        commande = [sys.executable, __file__, "--mode", mode, "--modele", args.modele, "--nb", str(args.nb)]
+        if args.drafts is not None:
+            commande += ["--drafts", args.drafts]
+        #le complément au hasard de choisir_picks tire dans un set : même PYTHONHASHSEED pour tous les modes
+        env = dict(os.environ, PYTHONHASHSEED="0")
+        sortie = subprocess.run(commande, capture_output=True, text=True, check=True, env=env).stdout
+        resultats[mode] = json.loads(sortie.strip().splitlines()[-1])
+
+    reference = resultats["fp32"]["picks"]
+    print("mode   accord fp32   latence (ms/requête)   mémoire (Mo)")
+    for mode, r in resultats.items():
+        accord = sum(sorted(p) == sorted(q) for p, q in zip(r["picks"], reference)) / len(reference)
+        print(f"{mode:5}  {accord:10.1%}   {r['latence_ms']:20.1f}   {r['memoire_mo']:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# backend/livre_ouvertures.py
+#livre d'ouvertures : les premiers états de la draft (premier pick de A, premier pick de B, première paire de A)
+#reviennent sans arrêt, leurs recommandations sont précalculées hors ligne dans une table binaire triée
+#lue en mmap (np.load mmap_mode="r") : aucun parsing au démarrage, recherche dichotomique sur la clé
+#chaque état garde les k meilleures recommandations sur tout le pool du réseau, on sert la première dont
+#les monstres sont dans la box du joueur (même résultat que predict_one / predict_two_complete), sinon calcul en live
+#le livre se construit hors ligne (image docker, ou ce script), jamais dans le serveur : au démarrage, ou au rechargement
+#d'un modèle, il n'est chargé que si le hash du fichier du modèle correspond, sinon tout passe par le calcul live
+#(nouveau modèle : construire son livre avant de remplacer le .pt, le hash est celui du contenu)
+#usage : python livre_ouvertures.py [--modele modele_predic_2.pt|.npz] [--sortie cache/livre_ouvertures.npy] [--pool 6] [--k 20]
+import argparse
+import copy
+import json
+import logging
+import os
+import time
+from itertools import combinations
+import numpy as np
+from empreintes import hash_fichier
+
+BITS = 10           #bits par monstre dans la clé (indices du one-hot < 1024)
+PLACES = 3          #monstres max par joueur dans une clé
+logger = logging.getLogger(__name__)
+
+PAIRE = 1 << 63     #bit de la clé : recommandation d'une paire (sinon d'un seul monstre)
+BLOC = 8192         #paires évaluées par passe pendant la construction (~200k paires par état)
+
+
+def cle_etat(model_infos, joueur_A, joueur_B, paire):
+    #clé canonique : indices triés de chaque joueur sur PLACES x BITS bits, None si l'état ne peut pas être dans le livre
+    mapping = model_infos["dict_mapp_index"]
+    if len(joueur_A) > PLACES or len(joueur_B) > PLACES:
+        return None
+    cle = PAIRE if paire else 0
+    for decalage, joueur in ((0, joueur_A), (PLACES * BITS, joueur_B)):
+        idx = sorted(mapping.get(id, 0) for id in joueur)
+        if 0 in idx:
+            return None
+        for i, index in enumerate(idx):
+            cle |= index << (decalage + i * BITS)
+    return cle
+
+
+def type_table(k):
+    #une ligne par état : clé, k recommandations (id1, id2 ; id2 = 0 pour un seul monstre) par proba décroissante
+    return np.dtype([("cle", "<u8"), ("ids", "<i4", (k, 2)), ("probas", "<f4", (k,))])
+
+
+class LivreOuvertures:
+    def __init__(self, chemin, meta):
+        self.table = np.load(chemin, mmap_mode="r")
+        self.cles = self.table["cle"]
+        self.meta = meta
+        self.hits = 0
+        self.misses = 0
+
+    def chercher(self, model_infos, joueur_A, joueur_B, dispo, paire):
+        #meilleure recommandation du livre parmi dispo, None si l'état n'y est pas ou si le calcul live peut différer
+        cle = cle_etat(model_infos, joueur_A, joueur_B, paire)
+        mapping = model_infos["dict_mapp_index"]
+        dispo_set = set(dispo)
+        #un monstre inconnu du réseau, un doublon ou un monstre déjà pris : le live les évalue, pas le livre
+        if (cle is None or len(dispo_set) != len(dispo) or dispo_set & set(joueur_A + joueur_B)
+                or any(mapping.get(id, 0) == 0 for id in dispo)):
+            self.misses += 1
+            return None
+        i = int(np.searchsorted(self.cles, cle))
+        if i < len(self.cles) and self.cles[i] == cle:
+            ligne = self.table[i]
+            for (id1, id2), proba in zip(ligne["ids"].tolist(), ligne["probas"].tolist()):
+                if id1 == 0:
+                    break
+                if id1 in dispo_set and (not paire or id2 in dispo_set):
+                    self.hits += 1
+                    return (id1, id2, proba) if paire else (id1, proba)
+        self.misses += 1
+        return None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(self.meta, etats=len(self.cles), hits=self.hits, misses=self.misses,
+                    hit_rate=self.hits / total if total else 0.)
+
+
+def recommandation_livre(model, model_infos, joueur_A, joueur_B, dispo, paire):
+    #utilisé par les predict_* des deux moteurs, comme model.cache
+    livre = getattr(model, "livre", None)
+    if livre is None:
+        return None
+    return livre.chercher(model_infos, joueur_A, joueur_B, dispo, paire)
+
+
+def meilleurs(probas, k):
+    probas = np.asarray(probas, dtype=np.float32)
+    k = min(k, len(probas))
+    top = np.argpartition(-probas, k-1)[:k]
+    return top[np.argsort(-probas[top], kind="stable")], probas
+
+
+def construire(moteur, model, model_infos, chemin, hash_modele, pool=6, k=20):
+    #moteur : my_model ou numpy_model (fournit predict et probas_avec_paires)
+    #états : (0,0) premier pick, (0,[b]) A joue en second, ([a],[b1,b2]) première paire de A,
+    #avec a, b, b1, b2 parmi les `pool` monstres les mieux classés au premier pick
+    debut = time.perf_counter()
+    model = copy.copy(model)
+    model.cache = None      #on ne remplit pas le cache du serveur avec des centaines de milliers de lignes
+    model.livre = None
+    candidats = [id for id, index in model_infos["dict_mapp_index"].items() if index != 0]
+
+    #premier pick : même calcul que predict_one (A = [m] avec padding, B vide)
+    top_premier, probas_premier = meilleurs([moteur.predict(model, model_infos, [m], []) for m in candidats], len(candidats))
+    ouvertures = [candidats[i] for i in top_premier[:pool]]
+    etats = [([], [b]) for b in ouvertures]
+    etats += [([a], list(bs)) for a in ouvertures for bs in combinations([m for m in ouvertures if m != a], 2)]
+
+    table = np.zeros(1 + len(etats), dtype=type_table(k))
+    top = top_premier[:k]
+    table[0]["cle"] = cle_etat(model_infos, [], [], False)
+    table[0]["ids"][:len(top), 0] = [candidats[i] for i in top]
+    table[0]["probas"][:len(top)] = probas_premier[top]
+    for ligne, (joueur_A, joueur_B) in zip(table[1:], etats):
+        #même calcul que predict_two_complete (A a au plus 2 picks : paires non ordonnées), par blocs de paires
+        dispo = [m for m in candidats if m not in joueur_A and m not in joueur_B]
+        all_pairs = list(combinations(range(len(dispo)), 2))
+        probas = np.concatenate([np.asarray(moteur.probas_avec_paires(model, model_infos, joueur_A, joueur_B, dispo, all_pairs[i:i+BLOC]))
+                                 for i in range(0, len(all_pairs), BLOC)])
+        top, probas = meilleurs(probas, k)
+        ligne["cle"] = cle_etat(model_infos, joueur_A, joueur_B, True)
+        ligne["ids"][:len(top)] = [(dispo[all_pairs[i][0]], dispo[all_pairs[i][1]]) for i in top]
+        ligne["probas"][:len(top)] = probas[top]
+
+    table.sort(order="cle")
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    temporaire = chemin + ".tmp.npy"
+    np.save(temporaire, table)
+    os.replace(temporaire, chemin)
+    meta = {"hash_modele": hash_modele, "k": k, "pool": pool, "duree_s": round(time.perf_counter() - debut, 1)}
+    with open(chemin + ".json", "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def charger(chemin, hash_modele):
+    #None si le livre n'existe pas ou s'il a été construit avec un autre modèle
+    try:
+        with open(chemin + ".json") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("hash_modele") != hash_modele or not os.path.exists(chemin):
+        return None
+    return LivreOuvertures(chemin, meta)
+
+
+def preparer(model, chemin_modele, chemin):
+    #au chargement du modèle : livre construit pour ce modèle -> model.livre, sinon calcul live
+    livre = charger(chemin, hash_fichier(chemin_modele))
+    model.livre = livre
+    if livre is not None:
+        logger.info("Livre d'ouvertures chargé (%s états)", len(livre.cles))
+    else:
+        logger.warning("Livre d'ouvertures absent ou construit pour un autre modèle (%s), calcul live ; "
+                       "à construire avec : python livre_ouvertures.py --modele %s --sortie %s", chemin, chemin_modele, chemin)
+    return livre
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modele", default="modele_predic_2.pt")
+    parser.add_argument("--sortie", default=os.path.join(os.environ.get("DOSSIER_CACHE", "cache"), "livre_ouvertures.npy"))
+    parser.add_argument("--pool", type=int, default=6)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+    if args.modele.endswith(".npz"):
+        import numpy_model as moteur
+        model, model_infos = moteur.charger_npz(args.modele)
+    else:
+        import torch
+        import my_model as moteur
+        from main import SimpleDraftModel_sparse
+        model_infos = torch.load(args.modele, map_location="cpu")
+        input_dim,layers = model_infos["modele_name_and_param"]
+        model = SimpleDraftModel_sparse(input_dim,layers)
+        model.load_state_dict(model_infos["modele_nn"])
+        model.eval()
+        model.preparer()
+    meta = construire(moteur, model, model_infos, args.sortie, hash_fichier(args.modele), args.pool, args.k)
+    print(f"Livre d'ouvertures écrit dans {args.sortie} : {meta}")
@@ -1,16 +1,165 @@
 # backend/my_model.py
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch.nn.functional as F
 import torch
 import random
+import copy
+import functools
+import logging
+import math
+import time
+from metriques import PAS_LLM, TOKENS_LLM, DUREE_LLM, RECOMMANDATIONS_LLM
 
-def predict_nexts_monsters (model,tokenizer,pickA,pickB,availableMonster):
+logger = logging.getLogger(__name__)
 
-    #on va prédire les prochains picks de A en fonction de ce qui a déjà été fait dans pickA et pickB
-    #Si availableMonster n'est pas la liste vite ou None, on renvoie que des monstres dans cette liste
-    sampling = True #permet de choisir si on fait du sampling ou non 
-    temperature = 0.1 #température pour le sampling
-    debut_str = "Current draft state: Player A picks: "
+DEBUT_PROMPT = "Current draft state: Player A picks: "
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def appliquer_precision(model,precision="fp32"):
+    #précision d'inférence du LLM sur CPU : fp32 (d'origine), bf16, ou int8 dynamique sur les couches Linear
+    #à appeler avant preparer_prefixe : le KV cache du préfixe doit être calculé dans la même précision
+    #eval_precision.py compare les picks de chaque mode à ceux du fp32
+    if precision not in PRECISIONS:
+        raise ValueError(f"précision inconnue : {precision} (possibles : {', '.join(PRECISIONS)})")
+    if precision == "bf16":
+        model = model.to(torch.bfloat16)
+    elif precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.eval()
+    return model
+
+
+def preparer_prefixe(model,tokenizer):
+    #à appeler une fois au démarrage : on garde le KV cache du début constant du prompt
+    #l'espace final fusionne avec le " M" du premier pick, on s'arrête donc juste avant
+    ids_prefixe = tokenizer(DEBUT_PROMPT.rstrip(), return_tensors="pt")["input_ids"]
+    model.eval()
+    with torch.no_grad():
+        outputs = model(input_ids=ids_prefixe, use_cache=True)
+    model.cache_prefixe = (ids_prefixe[0].tolist(), outputs.past_key_values)
+
+
+def debut_decodage(model,input_ids,kv_session=None):
+    #renvoie (past_key_values, tokens qui restent à passer dans le modèle)
+    #si le prompt commence par le préfixe déjà calculé on repart d'une copie de son KV cache
+    #kv_session {"ids", "cache"} : KV cache du prompt précédent d'une session de draft (sessions_draft.py),
+    #repris sur place au plus long préfixe commun de tokens (au moins un token reste à passer pour avoir les logits)
+    ids = input_ids[0].tolist()
+    if kv_session is not None and kv_session["cache"] is not None:
+        commun = 0
+        for a, b in zip(kv_session["ids"], ids[:-1]):
+            if a != b:
+                break
+            commun += 1
+        if commun > 0:
+            tronquer(kv_session["cache"], commun)
+            kv_session["ids"] = ids[:commun]
+            return kv_session["cache"], input_ids[:, commun:]
+    past, reste = None, input_ids
+    if getattr(model, "cache_prefixe", None) is not None:
+        ids_prefixe, cache = model.cache_prefixe
+        k = len(ids_prefixe)
+        if input_ids.shape[1] > k and ids[:k] == ids_prefixe:
+            past, reste = copy.deepcopy(cache), input_ids[:, k:]
+    if kv_session is not None:
+        kv_session["ids"], kv_session["cache"] = ids[:input_ids.shape[1] - reste.shape[1]], past
+    return past, reste
+
+
+def tronquer(cache,longueur):
+    #ramène un DynamicCache à ses `longueur` premiers tokens (crop négatif = nombre de tokens à retirer)
+    if cache.get_seq_length() > longueur:
+        cache.crop(longueur - cache.get_seq_length())
+
+
+def fin_decodage(kv_session,past,ids_prompt):
+    #après la génération : le cache de la session ne garde que le prompt, les tokens générés en sont retirés
+    if kv_session is not None and past is not None:
+        tronquer(past, len(ids_prompt))
+        kv_session["ids"], kv_session["cache"] = list(ids_prompt), past
+
+
+def taille_cache(cache):
+    #octets des clés et valeurs d'un DynamicCache (budget mémoire des sessions)
+    if cache is None:
+        return 0
+    return sum(t.numel() * t.element_size() for couche in cache.layers for t in (couche.keys, couche.values)
+               if isinstance(t, torch.Tensor))
+
+
+@functools.lru_cache(maxsize=4)
+def tokens_M(tokenizer):
+    #pour chaque token du vocabulaire : son texte contient-il un "M" (début d'un pick)
+    vocab = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+    return ["M" in texte for texte in vocab]
+
+
+@functools.lru_cache(maxsize=4)
+def suite_M(tokenizer):
+    #tokens de " M" (début d'un pick)
+    return tokenizer.encode(" M", add_special_tokens=False)
+
+
+class TrieMonstres:
+    #trie des tokens de tous les ids de monstres ("23711" -> ["237", "11"]), construit une fois au démarrage
+    #pendant la génération forcée, le noeud courant et le bitmap des monstres dispo donnent directement
+    #les tokens autorisés, sans aucun appel au tokenizer dans la boucle
+    #registre (registre_monstres.RegistreMonstres) : le trie reprend ses ids, ses tokens déjà calculés et ses positions,
+    #disponibles passe alors par sa table dense id -> position
+    #les ids sont des int partout (picks rendus, disponibles), comme dans les DraftState
+    def __init__(self,tokenizer,ids_monstres=None,registre=None):
+        self.registre = registre
+        if registre is not None:
+            if registre.tokens is None:
+                registre.tokeniser(tokenizer)
+            self.ids = registre.ids.tolist()
+            suites = registre.tokens
+        else:
+            self.ids = list(dict.fromkeys(ids_monstres))
+            self.position = {id: i for i, id in enumerate(self.ids)}
+            suites = [tokenizer.encode(str(id), add_special_tokens=False) for id in self.ids]
+        self.enfants = [{}]     #noeud -> {token: noeud enfant}
+        self.monstre = [None]   #noeud -> position du monstre qui finit ici
+        for i, suite in enumerate(suites):
+            noeud = 0
+            for token in suite:
+                if token not in self.enfants[noeud]:
+                    self.enfants[noeud][token] = len(self.enfants)
+                    self.enfants.append({})
+                    self.monstre.append(None)
+                noeud = self.enfants[noeud][token]
+            #si les tokens d'un id étaient le préfixe d'un autre, le pick s'arrêterait sur le plus court
+            self.monstre[noeud] = i
+        #pour chaque noeud : tokens des enfants et monstres atteignables par chaque enfant (c, nb_monstres)
+        sous_arbre = [None] * len(self.enfants)
+        for noeud in reversed(range(len(self.enfants))):  #les enfants sont toujours créés après leur parent
+            atteint = torch.zeros(len(self.ids), dtype=torch.bool)
+            if self.monstre[noeud] is not None:
+                atteint[self.monstre[noeud]] = True
+            for enfant in self.enfants[noeud].values():
+                atteint |= sous_arbre[enfant]
+            sous_arbre[noeud] = atteint
+        self.tokens = [torch.tensor(list(e.keys()), dtype=torch.long) for e in self.enfants]
+        self.atteignables = [torch.stack([sous_arbre[n] for n in e.values()]) if e else None for e in self.enfants]
+        self.tokens_M = tokens_M(tokenizer)
+
+    def disponibles(self,ids):
+        if self.registre is not None:
+            #seulement les monstres du json, comme le trie construit sur list(monsters)
+            return torch.from_numpy(self.registre.disponibles(ids) & self.registre.json)
+        dispo = torch.zeros(len(self.ids), dtype=torch.bool)
+        positions = [self.position[id] for id in ids if id in self.position]
+        dispo[positions] = True
+        return dispo
+
+    def autorises(self,noeud,dispo):
+        if self.atteignables[noeud] is None:
+            return self.tokens[noeud][:0]
+        return self.tokens[noeud][(self.atteignables[noeud] & dispo).any(dim=1)]
+
+
+def construire_prompt(pickA,pickB):
+    debut_str = DEBUT_PROMPT
     middle = "; Player B picks: " 
     end = "\nPredict next picks for Player A:"
     A_ids = pickA
@@ -24,7 +173,102 @@ def predict_nexts_monsters (model,tokenizer,pickA,pickB,availableMonster):
         strB+="M"+str(id)+" "
     strB = strB[:-1]
 
-    promt_final = debut_str+strA+middle+strB+end
+    return debut_str+strA+middle+strB+end
+
+
+def pas_decodage(trie,logits,noeud,dispo,sampling=True,temperature=0.1):
+    #un pas de génération pour une ligne (logits de taille (1,vocab)), renvoie (token, noeud suivant)
+    #token None : fin de la génération (token de fin, ou plus aucun monstre possible)
+    logits = logits.float()  #le modèle peut tourner en bf16
+    if noeud is None:
+        new_token_ids = torch.argmax(logits, dim=-1).item()
+        if new_token_ids==0 : 
+            #on est sur le token de fin, on stop
+            return None, None
+        if trie.tokens_M[new_token_ids]:
+            #si on voit un M on passe en génération forcée dans le trie
+            return new_token_ids, 0
+        return new_token_ids, None
+
+    # On force le token suivant du pick : seuls les enfants du noeud qui mènent à un monstre dispo
+    ls_ok = trie.autorises(noeud, dispo)
+    if len(ls_ok)==0:
+        #plus aucun monstre possible
+        return None, None
+    mask = torch.full_like(logits, float('-inf'))  # tout à -inf
+    mask[0, ls_ok] = logits[0, ls_ok]  # ne garder que les autorisés
+    if sampling and noeud==0 : 
+        # Sampling sur le premier token du pick
+        new_token_ids = torch.multinomial(torch.softmax(mask/temperature, dim=-1), num_samples=1).item()
+    else : 
+        new_token_ids = torch.argmax(mask, dim=-1).item()
+    noeud = trie.enfants[noeud][new_token_ids]
+    if trie.monstre[noeud] is not None:
+        #on vient de finir une inférence, donc on supprime le monstre de la liste possible
+        dispo[trie.monstre[noeud]] = False
+        noeud = None
+    return new_token_ids, noeud
+
+
+def decoder_picks(model,tokenizer,promt_final,trie,dispo,kv_cache=True,sampling=True,temperature=0.1,kv_session=None):
+    #boucle de génération contrainte, sous forme de générateur :
+    #("pick", id) dès que les tokens forcés d'un monstre sont complets, puis ("texte", texte généré complet) à la fin
+    #kv_session : KV cache d'une session de draft, repris puis remis au prompt courant (voir debut_decodage)
+    inputs = tokenizer(promt_final, return_tensors="pt")
+
+    current_input_ids = inputs["input_ids"]
+    max_gen_len = 30  # longueur max de génération
+
+    #décodage incrémental : à chaque pas on ne passe que le dernier token et on réutilise le KV cache
+    past, ids_a_traiter = debut_decodage(model, current_input_ids, kv_session) if kv_cache else (None, current_input_ids)
+    ids_prompt = current_input_ids[0].tolist()
+
+    noeud = None  # None : génération libre, sinon position dans le trie du pick en cours
+    duree = 0.
+    pas = 0
+    for pas in range(1, max_gen_len + 1):
+        debut = time.perf_counter()
+        with torch.no_grad():
+            if kv_cache:
+                outputs = model(input_ids=ids_a_traiter, past_key_values=past, use_cache=True)
+                past = outputs.past_key_values
+            else:
+                outputs = model(input_ids=current_input_ids)
+            logits = outputs.logits[:, -1, :]
+
+        noeud_avant = noeud
+        new_token_ids, noeud = pas_decodage(trie, logits, noeud, dispo, sampling, temperature)
+        #sans le temps passé chez l'appelant entre deux picks (stream)
+        duree += time.perf_counter() - debut
+        if new_token_ids is None:
+            break
+        TOKENS_LLM.inc(chemin="simple")
+        if noeud_avant is not None and noeud is None:
+            #le token vient de terminer un monstre du trie
+            yield "pick", trie.ids[trie.monstre[trie.enfants[noeud_avant][new_token_ids]]]
+
+        current_input_ids = torch.cat(
+            [current_input_ids, torch.tensor([[new_token_ids]])],
+            dim=1
+        )
+        ids_a_traiter = current_input_ids[:, -1:]
+    DUREE_LLM.inc(duree, chemin="simple")
+    PAS_LLM.observer(pas, chemin="simple")
+    if kv_cache:
+        fin_decodage(kv_session, past, ids_prompt)
+    yield "texte", tokenizer.decode(current_input_ids[0])
+
+
+def predict_nexts_monsters (model,tokenizer,pickA,pickB,availableMonster,kv_cache=True,trie=None,kv_session=None):
+
+    #on va prédire les prochains picks de A en fonction de ce qui a déjà été fait dans pickA et pickB
+    #Si availableMonster n'est pas la liste vite ou None, on renvoie que des monstres dans cette liste
+    sampling = True #permet de choisir si on fait du sampling ou non 
+    temperature = 0.1 #température pour le sampling
+    #kv_cache=False recalcule toute la séquence à chaque token (ancien comportement, sert au benchmark)
+    #trie : TrieMonstres construit au démarrage sur tous les monstres, sinon on en construit un pour la requête
+    #kv_session : KV cache du prompt d'une session de draft, seuls les tokens qui ont changé sont recalculés
+    promt_final = construire_prompt(pickA,pickB)
 
     if ((availableMonster is None) or len(availableMonster)==0) : 
         inputs = tokenizer(promt_final, return_tensors="pt")
@@ -36,119 +280,321 @@ def predict_nexts_monsters (model,tokenizer,pickA,pickB,availableMonster):
         )
         generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
         ls_monster = generated_text.split("Predict next picks for Player A:")[1].strip().replace("M","").split(' ')
+        #morceaux de texte qui ne sont pas des ids de monstres ignorés
+        ls_monster = [int(id) for id in ls_monster if id.isdigit()]
     else : 
-        
-        # Tokenisation des picks
-        pick_token_available_ids = {
-            pick: tokenizer.encode(pick, add_special_tokens=False)
-            for pick in availableMonster
-        }
-        inputs = tokenizer(promt_final, return_tensors="pt")
-        current_input_ids = inputs["input_ids"]
+        if trie is None:
+            trie = TrieMonstres(tokenizer, availableMonster)
+        #bitmap des monstres encore possibles pour cette requête, un monstre sort quand il a été généré
+        dispo = trie.disponibles(availableMonster)
+        #les picks sont ceux que le trie a décodés (ids int), le texte n'est pas re-parsé
+        ls_monster = []
+        for evenement, valeur in decoder_picks(model, tokenizer, promt_final, trie, dispo, kv_cache, sampling, temperature, kv_session):
+            if evenement == "pick":
+                ls_monster.append(valeur)
+            else:
+                logger.debug("%s", valeur)
 
+    return choisir_picks(ls_monster,pickA,pickB,availableMonster)
 
 
+def predict_nexts_monsters_stream(model,tokenizer,pickA,pickB,availableMonster,trie=None):
+    #même recommandation que predict_nexts_monsters, mais en générateur pour /llm-predict/stream :
+    #("pick", id) pour chaque monstre dès qu'il est décodé (au plus le nombre de picks attendus), puis
+    #("fin", (picks, hasard)) : les picks envoyés, complétés au hasard par choisir_picks pour les places manquantes,
+    #et ceux de ces picks tirés au hasard ; la fin part des picks du trie, pas du texte re-parsé
+    if (availableMonster is None) or len(availableMonster)==0:
+        #génération libre sans contraintes : pas de picks intermédiaires
+        yield "fin", (predict_nexts_monsters(model, tokenizer, pickA, pickB, availableMonster), [])
+        return
+    if trie is None:
+        trie = TrieMonstres(tokenizer, availableMonster)
+    dispo = trie.disponibles(availableMonster)
+    attendus = nb_picks_attendus(pickA,pickB)
+    picks = []
+    for evenement, valeur in decoder_picks(model, tokenizer, construire_prompt(pickA,pickB), trie, dispo):
+        if evenement == "pick" and len(picks) < attendus:
+            picks.append(valeur)
+            yield "pick", valeur
+        elif evenement == "texte":
+            logger.debug("%s", valeur)
+    ids = choisir_picks(picks,pickA,pickB,availableMonster)
+    yield "fin", (ids, [id for id in ids if id not in picks])
 
-                
-        allowed_picks = [23711, 16811, 28312, 23712, 17411, 26113, 21811, 28613, 16111, 16613, 21115, 30512, 21415, 24511, 16815, 15712, 25011, 24712, 26813, 21214, 18314, 17012, 31112, 16114, 14034, 20512, 13812]
-        allowed_picks = [str(i) for i in allowed_picks]
-        pick_token_ids = {
-            pick: tokenizer.encode(pick, add_special_tokens=False)
-            for pick in availableMonster
-        }
 
-        current_input_ids = inputs["input_ids"]
-        max_gen_len = 30  # longueur max de génération
+def predict_nexts_monsters_batch(model,tokenizer,requetes,trie=None):
+    #même chose que predict_nexts_monsters pour plusieurs drafts (pickA, pickB, availableMonster) à la fois :
+    #les prompts sont paddés à gauche et décodés ensemble, chaque ligne a son noeud dans le trie et son bitmap
+    #une ligne en erreur (draft incohérente, id mal formé...) a son exception à sa place dans les résultats,
+    #les autres lignes du lot sont servies (même contrat que MicroBatcher.traiter)
+    sampling = True
+    temperature = 0.1
+    max_gen_len = 30
+    resultats = [None] * len(requetes)
+    lignes = [i for i, (_, _, dispo) in enumerate(requetes) if dispo]
+    for i in range(len(requetes)):
+        if i not in lignes:
+            resultats[i] = par_ligne(predict_nexts_monsters, model, tokenizer, *requetes[i])
+    if len(lignes) <= 1:
+        #une seule ligne : le chemin simple profite du KV cache du préfixe
+        for i in lignes:
+            resultats[i] = par_ligne(predict_nexts_monsters, model, tokenizer, *requetes[i], trie=trie)
+        return resultats
+    if trie is None:
+        trie = TrieMonstres(tokenizer, [m for i in lignes for m in requetes[i][2]])
 
-        forced_pick_ids = [] # tokens du pick en cours
-        forced_step = 0      # Combien de token à forcer encore
-        for _ in range(max_gen_len):
-            with torch.no_grad():
-                outputs = model(input_ids=current_input_ids)
-                logits = outputs.logits[:, -1, :]
-                probs = torch.softmax(logits, dim=-1)
-
-
-            new_token_ids = torch.argmax(probs, dim=-1).item()
-            if "M" in tokenizer.decode(torch.tensor([new_token_ids])) : 
-                #si on voit un M on passe en génération forcé
-                forced_step= 2
-                # Ajouter le token
-                current_input_ids = torch.cat(
-                    [current_input_ids, torch.tensor([[new_token_ids]])],
-                    dim=1
-                )
-                forced_pick_ids=[]
-                continue
-            
-            if forced_step>0:
-                # On force le token suivant du pick
-                
-                ls_ok = [token[-forced_step+2] for token in pick_token_ids.values()]#vaut 1 quand forced_step=1 et 0 quand forced_step = 2
-                mask = torch.full_like(logits, float('-inf'))  # tout à -inf
-                mask[0, ls_ok] = logits[0, ls_ok]  # ne garder que les autorisés
-                #pour l'instant on essaye avec du greedy
-                probs = torch.softmax(mask, dim=-1)
-                probs_allowed = probs[0, ls_ok]
-                #print(probs_allowed)
-                if sampling and forced_step==2 : 
-                    # Sampling
-                    new_token_ids = torch.multinomial(torch.softmax(mask/temperature, dim=-1), num_samples=1).item()
-                else : 
-                    probs = torch.softmax(mask, dim=-1)
-                    new_token_ids = torch.argmax(probs, dim=-1).item()
-                current_input_ids = torch.cat(
-                    [current_input_ids, torch.tensor([[new_token_ids]])],
-                    dim=1
-                )
-                forced_pick_ids.append(new_token_ids)
-                forced_step-=1
-                if forced_step==0:
-                    #on vient de finir une inférence, donc on supprime le monstre de la liste possible
-                    for k in list(pick_token_ids.keys()) : 
-                        if pick_token_ids[k] == forced_pick_ids:
-                            del pick_token_ids[k]
-                continue
-
-
-            if new_token_ids==0 : 
-                #on est sur le token de fin, on stop
-                break 
+    prompts, dispo = [], []
+    for i in list(lignes):
+        try:
+            prompt = tokenizer(construire_prompt(requetes[i][0], requetes[i][1]))["input_ids"]
+            dispo_ligne = trie.disponibles(requetes[i][2])
+        except Exception as erreur:
+            resultats[i] = erreur
+            lignes.remove(i)
+            continue
+        prompts.append(prompt)
+        dispo.append(dispo_ligne)
+    if not lignes:
+        return resultats
+    longueur = max(len(p) for p in prompts)
+    input_ids = torch.tensor([[0] * (longueur - len(p)) + p for p in prompts])
+    attention_mask = torch.tensor([[0] * (longueur - len(p)) + [1] * len(p) for p in prompts])
+    position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+    noeuds = [None] * len(lignes)
+    generes = [[] for _ in lignes]
+    picks = [[] for _ in lignes]
+    finis = [False] * len(lignes)
+
+    model.eval()
+    past = None
+    debut = time.perf_counter()
+    pas = 0
+    for pas in range(1, max_gen_len + 1):
+        with torch.no_grad():
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                            past_key_values=past, use_cache=True)
+        past = outputs.past_key_values
+        logits = outputs.logits[:, -1, :]
+        nouveaux = []
+        for r in range(len(lignes)):
+            token = None
+            noeud_avant = noeuds[r]
+            if not finis[r]:
+                token, noeuds[r] = pas_decodage(trie, logits[r:r+1], noeuds[r], dispo[r], sampling, temperature)
+            if token is not None and noeud_avant is not None and noeuds[r] is None:
+                #le token vient de terminer un monstre du trie
+                picks[r].append(trie.ids[trie.monstre[trie.enfants[noeud_avant][token]]])
+            if token is None:
+                #ligne finie : on continue à lui donner un token qui ne sera pas lu
+                finis[r] = True
+                token = 0
             else:
-                # Génération normale
-                current_input_ids = torch.cat(
-                    [current_input_ids, torch.tensor([[new_token_ids]])],
-                    dim=1
-                )
-        generated_text = tokenizer.decode(current_input_ids[0])
-        print(generated_text)
-        ls_monster = generated_text.split("Predict next picks for Player A:")[1].strip().replace("M","").split(' ')
+                generes[r].append(token)
+            nouveaux.append(token)
+        if all(finis):
+            break
+        input_ids = torch.tensor(nouveaux).unsqueeze(1)
+        attention_mask = torch.cat([attention_mask, torch.ones(len(lignes), 1, dtype=attention_mask.dtype)], dim=1)
+        position_ids = position_ids[:, -1:] + 1
+    DUREE_LLM.inc(time.perf_counter() - debut, chemin="batch")
+    PAS_LLM.observer(pas, chemin="batch")
+    TOKENS_LLM.inc(sum(len(g) for g in generes), chemin="batch")
+
+    for r, i in enumerate(lignes):
+        logger.debug("%s", tokenizer.decode(generes[r]))
+        resultats[i] = par_ligne(choisir_picks, picks[r], requetes[i][0], requetes[i][1], requetes[i][2])
+    return resultats
+
+
+def par_ligne(fonction, *args, **kwargs):
+    #résultat d'une ligne d'un lot, ou son exception
+    try:
+        return fonction(*args, **kwargs)
+    except Exception as erreur:
+        return erreur
+
+
+def nb_picks_attendus(pickA,pickB):
+    #1 seul pick au début et à la fin de la draft, 2 sinon (même règle que choisir_picks)
+    return 1 if (len(pickA)==len(pickB)==0 or (len(pickA)==4 and len(pickB)==5)) else 2
+
+
+def etendre(model,past,ids,derniers=1):
+    #ajoute des tokens (liste) au KV cache batch 1, renvoie (cache, log-probas des `derniers` positions (derniers, vocab))
+    #la tête du modèle (vocab entier) n'est appliquée qu'à ces positions
+    with torch.no_grad():
+        outputs = model.base_model(input_ids=torch.tensor([ids]), past_key_values=past, use_cache=True)
+        logits = model.get_output_embeddings()(outputs.last_hidden_state[0, -derniers:])
+    return outputs.past_key_values, torch.log_softmax(logits.float(), dim=-1)
+
+
+def etendre_contextes(model,past,longueur,contextes):
+    #écrit plusieurs contextes (listes de tokens de longueurs différentes) après le même cache past (batch 1, longueur
+    #tokens), en une passe : contextes paddés à droite, une ligne par contexte
+    #renvoie (cache des lignes, masque (lignes, longueur + T) des tokens réels, position du prochain token de chaque ligne,
+    #log-probas (lignes, T, vocab) après chaque token)
+    T = max(len(contexte) for contexte in contextes)
+    ids = torch.tensor([contexte + [0] * (T - len(contexte)) for contexte in contextes])
+    presents = torch.tensor([[1] * len(contexte) + [0] * (T - len(contexte)) for contexte in contextes])
+    masque = torch.cat([torch.ones(len(contextes), longueur, dtype=torch.long), presents], dim=1)
+    cache = copy.deepcopy(past)
+    cache.batch_repeat_interleave(len(contextes))
+    with torch.no_grad():
+        h = model.base_model(input_ids=ids, past_key_values=cache, use_cache=True, attention_mask=masque,
+                             position_ids=(longueur + torch.arange(T)).expand(len(contextes), T)).last_hidden_state
+        log = torch.log_softmax(model.get_output_embeddings()(h).float(), dim=-1)
+    return cache, masque, longueur + presents.sum(dim=1), log
+
+
+def log_probas_contextes(log_prompt,contextes,log):
+    #log-proba de chaque contexte après le prompt : premier token lu dans log_prompt (log-probas après le prompt),
+    #les suivants dans log (sortie d'etendre_contextes)
+    return [float(log_prompt[contexte[0]] + sum(log[c, j - 1, contexte[j]] for j in range(1, len(contexte))))
+            for c, contexte in enumerate(contextes)]
+
+
+def log_probas_ids(model,past,masque,positions,log_premier,suites,taille_bloc=128):
+    #somme des log-probas des tokens de chaque suite (tokens d'un id) écrite après le contexte d'une ligne du cache :
+    #past (une ligne par contexte), masque (lignes, taille du cache) des tokens réels, positions (lignes,) du prochain
+    #token, log_premier (lignes, vocab) log-probas du premier token ; suites[ligne] : suites écrites après cette ligne
+    #les tokens suivants ne dépendent que du préfixe qui les précède : une ligne par (contexte, préfixe) distinct
+    #(les ids d'une même famille partagent leur premier token), passe batchée sur les préfixes paddés à droite,
+    #et la tête du modèle n'est appliquée qu'aux positions utiles ; renvoie les scores de chaque ligne (liste de tenseurs)
+    scores = [log_premier[ligne][torch.tensor([suite[0] for suite in suites_ligne], dtype=torch.long)].clone()
+              for ligne, suites_ligne in enumerate(suites)]
+    prefixes = list(dict.fromkeys((ligne, tuple(suite[:-1])) for ligne, suites_ligne in enumerate(suites)
+                                  for suite in suites_ligne if len(suite) > 1))
+    lignes = {}     #(ligne, préfixe, position) -> ligne de log_suivants
+    blocs = []
+    for debut in range(0, len(prefixes), taille_bloc):
+        bloc = prefixes[debut:debut+taille_bloc]
+        T = max(len(prefixe) for _, prefixe in bloc)
+        origines = torch.tensor([ligne for ligne, _ in bloc])
+        ids = torch.tensor([list(prefixe) + [0] * (T - len(prefixe)) for _, prefixe in bloc])
+        presents = torch.tensor([[1] * len(prefixe) + [0] * (T - len(prefixe)) for _, prefixe in bloc])
+        cache = copy.deepcopy(past)
+        cache.reorder_cache(origines)
+        with torch.no_grad():
+            h = model.base_model(input_ids=ids, past_key_values=cache, use_cache=True,
+                                 attention_mask=torch.cat([masque[origines], presents], dim=1),
+                                 position_ids=positions[origines].unsqueeze(1) + torch.arange(T)).last_hidden_state
+            blocs.append(torch.log_softmax(model.get_output_embeddings()(h[presents.bool()]).float(), dim=-1))
+        for ligne, prefixe in bloc:
+            for position in range(len(prefixe)):
+                lignes[(ligne, prefixe, position)] = len(lignes)
+    if prefixes:
+        log_suivants = torch.cat(blocs)
+        for ligne, suites_ligne in enumerate(suites):
+            for i, suite in enumerate(suites_ligne):
+                prefixe = tuple(suite[:-1])
+                for j in range(1, len(suite)):
+                    scores[ligne][i] += log_suivants[lignes[(ligne, prefixe, j - 1)], suite[j]]
+    return scores
+
+
+def scorer_apres(model,past,longueur,log_prompt,contextes,suites):
+    #log-proba de " <contexte><suite>" après le prompt pour chaque contexte et chacune de ses suites :
+    #une passe pour tous les contextes, puis une (par bloc de préfixes) pour toutes les suites
+    cache, masque, positions, log = etendre_contextes(model, past, longueur, contextes)
+    log_contextes = log_probas_contextes(log_prompt, contextes, log)
+    log_premier = log[torch.arange(len(contextes)), torch.tensor([len(contexte) for contexte in contextes]) - 1]
+    scores = log_probas_ids(model, cache, masque, positions, log_premier, suites)
+    return [(log_contexte + score).tolist() for log_contexte, score in zip(log_contextes, scores)]
+
+
+def scorer_picks(model,tokenizer,pickA,pickB,availableMonster,k=5,largeur=5,kv_session=None,registre=None):
+    #alternative déterministe à predict_nexts_monsters : au lieu de générer token par token, on calcule la log-proba
+    #de chaque suite possible " M<id>" (ou " M<id1> M<id2>") après le prompt, en batch sur le KV cache du prompt
+    #paires : log-probas de tous les premiers picks en une passe, puis celles de tous les seconds picks derrière les
+    #`largeur` meilleurs premiers (tous si None), ces contextes batchés ensemble ; une paire vaut log(p(a,b) + p(b,a)) :
+    #pour les 2 x k meilleures paires, l'ordre qui manque (premier pick hors des `largeur`) est calculé aussi,
+    #toutes les paires renvoyées sont donc notées sur leurs deux ordres
+    #nombre de passes fixe (prompt, premiers picks, seconds picks, ordres manquants ; plus une par bloc de préfixes),
+    #renvoie les k meilleurs [(ids, log_proba)], jamais de complément au hasard
+    #registre : tokens des ids déjà calculés (registre_monstres.RegistreMonstres.tokeniser) au lieu d'un encode par id
+    deja = set(pickA + pickB)
+    dispo = [id for id in dict.fromkeys(availableMonster) if id not in deja]
+    if len(dispo) == 0:
+        return []
+    nb = min(nb_picks_attendus(pickA,pickB), len(dispo))
+    model.eval()
+    input_ids = tokenizer(construire_prompt(pickA,pickB), return_tensors="pt")["input_ids"]
+    past, ids_a_traiter = debut_decodage(model, input_ids, kv_session)
+    past, log_prompt = etendre(model, past, ids_a_traiter[0].tolist())
+    #les extensions suivantes partent de copies : past reste le cache du prompt
+    fin_decodage(kv_session, past, input_ids[0].tolist())
+    #" M23712" se tokenise en " M" + tokens de l'id, comme dans la génération forcée du trie
+    token_M = suite_M(tokenizer)
+    if registre is not None and registre.tokens is not None:
+        tokens = {id: registre.tokens_id(id) for id in dispo}
+    else:
+        tokens = {id: tokenizer.encode(str(id), add_special_tokens=False) for id in dispo}
+    longueur = input_ids.shape[1]
+    log_prompt = log_prompt[-1]
+
+    #log p(" M" | prompt) + log p(id | prompt " M") pour tous les premiers picks
+    scores_seuls, = scorer_apres(model, past, longueur, log_prompt, [token_M], [[tokens[id] for id in dispo]])
+    if nb == 1:
+        return sorted([([id], score) for id, score in zip(dispo, scores_seuls)], key=lambda c: -c[1])[:k]
+
+    #paires ordonnées (a, b) : contexte " M<a> M" pour chacun des meilleurs premiers picks, tous les seconds derrière
+    ordonnees = {}
+    premiers = [dispo[i] for i in sorted(range(len(dispo)), key=lambda i: -scores_seuls[i])[:largeur]]
+    seconds = [[b for b in dispo if b != a] for a in premiers]
+    contextes = [token_M + tokens[a] + token_M for a in premiers]
+    scores = scorer_apres(model, past, longueur, log_prompt, contextes, [[tokens[b] for b in bs] for bs in seconds])
+    for a, bs, scores_a in zip(premiers, seconds, scores):
+        ordonnees.update({(a, b): score for b, score in zip(bs, scores_a)})
+
+    def score_paire(a, b):
+        #log(p(a,b) + p(b,a)) avec les ordres connus
+        connus = [ordonnees[o] for o in ((a, b), (b, a)) if o in ordonnees]
+        return max(connus) + math.log1p(math.exp(-abs(connus[0] - connus[1]))) if len(connus) == 2 else connus[0]
 
+    paires = list(dict.fromkeys(tuple(sorted(paire)) for paire in ordonnees))
+    candidates = sorted(paires, key=lambda p: -score_paire(*p))[:2*k]
+    #ordres manquants des candidates : contexte " M<b> M" pour chaque b hors des premiers, suites = les a
+    manquants = {}
+    for a, b in candidates:
+        for premier, second in ((a, b), (b, a)):
+            if (premier, second) not in ordonnees:
+                manquants.setdefault(premier, []).append(second)
+    if manquants:
+        contextes = [token_M + tokens[b] + token_M for b in manquants]
+        scores = scorer_apres(model, past, longueur, log_prompt, contextes, [[tokens[a] for a in manquants[b]] for b in manquants])
+        for b, scores_b in zip(manquants, scores):
+            ordonnees.update({(b, a): score for a, score in zip(manquants[b], scores_b)})
+    classement = sorted(((list(paire), score_paire(*paire)) for paire in candidates), key=lambda c: -c[1])
+    return classement[:k]
 
 
+def choisir_picks(ls_monster,pickA,pickB,availableMonster):
+    #ls_monster : ids (int) générés ; on ne garde que ceux qui sont disponibles, au plus le nombre de picks attendus,
+    #et on complète au hasard si besoin
     monster_ok_playerA = []
     usable_monster = set(availableMonster)
     for id in ls_monster : 
-        if (id in usable_monster) or (int(id) in usable_monster )or (str(id) in usable_monster ): 
+        if id in usable_monster and len(monster_ok_playerA) < nb_picks_attendus(pickA,pickB) : 
             monster_ok_playerA.append(id)
             usable_monster.discard(id)
-            usable_monster.discard(int(id))
-            usable_monster.discard(str(id))
     
     #on vérifie maintenant que on a les bons monstres 
     if len(monster_ok_playerA)==2 : 
+        RECOMMANDATIONS_LLM.inc(hasard="0")
         return monster_ok_playerA
     
     if len(monster_ok_playerA)==1 and (len(pickA)==len(pickB)==0 or (len(pickA)==4 and len(pickB)==5)) : 
         #on vérifie que on a bien besoin que de 1 seul pick début de draft et fin de draft 
+        RECOMMANDATIONS_LLM.inc(hasard="0")
         return monster_ok_playerA
     
     #maintenant que ya un pb on va prendre des monstres au hasard pour compléter
     if len(monster_ok_playerA)==1 : 
-        print("------------Un monstre ajouté au hazard------------")
+        RECOMMANDATIONS_LLM.inc(hasard="1")
+        logger.info("Un monstre ajouté au hasard")
         return (random.sample(list(usable_monster),1) + monster_ok_playerA)
 
     else : 
-        print("------------Tous les monstres ajoutés au hazard------------")
-        print("Monstres initiaux " + str(ls_monster))
-        return random.sample(list(usable_monster),2)
\ No newline at end of file
+        RECOMMANDATIONS_LLM.inc(hasard="2")
+        logger.info("Tous les monstres ajoutés au hasard, monstres initiaux %s", ls_monster)
+        return random.sample(list(usable_monster),2)
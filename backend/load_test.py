@@ -0,0 +1,84 @@
+# backend/load_test.py
+#test de charge des endpoints /neural-net et /llm-predict, pour régler FENETRE_BATCH_MS et TAILLE_MAX_BATCH
+#usage : python load_test.py [--url http://localhost:8000] [--requetes 64] [--endpoints neural-net llm-predict]
+#pour chaque niveau de concurrence : débit (req/s) et latences p50 / p99
+import argparse
+import json
+import os
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CONCURRENCES = [1, 2, 4, 8, 16, 32]
+MONSTRES_DEFAUT = [23711, 16811, 28312, 23712, 17411, 26113, 21811, 28613, 16111, 16613, 21115, 30512,
+                   14514, 17612, 22011, 24013, 19411, 15111, 25814, 20512]
+PHASES = [(0, 0), (1, 0), (1, 2), (3, 2), (3, 4), (5, 4)]
+
+
+def charger_monstres():
+    if os.path.exists("monsters_rta.json"):
+        with open("monsters_rta.json") as f:
+            return [int(m["id"]) for m in json.load(f)]
+    return MONSTRES_DEFAUT
+
+
+def generer_drafts(monstres, n, graine=0):
+    #drafts aléatoires à tous les tours de la phase de picks
+    rng = random.Random(graine)
+    drafts = []
+    for _ in range(n):
+        nb_A, nb_B = rng.choice(PHASES)
+        tires = rng.sample(monstres, nb_A + nb_B)
+        reste = [m for m in monstres if m not in tires]
+        drafts.append({
+            "playerAPicks": tires[:nb_A],
+            "playerBPicks": tires[nb_A:],
+            "currentPhase": "picking",
+            "playerAAvailableIds": rng.sample(reste, min(len(reste), 15)),
+            "playerBPossibleCounter": [],
+        })
+    return drafts
+
+
+def envoyer(url, draft):
+    requete = urllib.request.Request(url, data=json.dumps(draft).encode(), headers={"Content-Type": "application/json"})
+    debut = time.perf_counter()
+    with urllib.request.urlopen(requete) as reponse:
+        reponse.read()
+    return (time.perf_counter() - debut) * 1000
+
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(p / 100 * len(valeurs)))]
+
+
+def mesurer(url, drafts, concurrence):
+    with ThreadPoolExecutor(max_workers=concurrence) as pool:
+        debut = time.perf_counter()
+        latences = list(pool.map(lambda d: envoyer(url, d), drafts))
+        duree = time.perf_counter() - debut
+    return len(drafts) / duree, percentile(latences, 50), percentile(latences, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requetes", type=int, default=64)
+    parser.add_argument("--endpoints", nargs="+", default=["neural-net", "llm-predict"])
+    args = parser.parse_args()
+
+    drafts = generer_drafts(charger_monstres(), args.requetes)
+    for endpoint in args.endpoints:
+        url = args.url.rstrip("/") + "/" + endpoint
+        envoyer(url, drafts[0])     #échauffement
+        print("/" + endpoint)
+        print("  concurrence    req/s   p50 (ms)   p99 (ms)")
+        for concurrence in CONCURRENCES:
+            debit, p50, p99 = mesurer(url, drafts, concurrence)
+            print("  {:>11} {:>8.1f} {:>10.1f} {:>10.1f}".format(concurrence, debit, p50, p99))
+
+
+if __name__ == "__main__":
+    main()
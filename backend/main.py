@@ -1,28 +1,74 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from pydantic import Field
-from typing import List
-from torch import load, nn, sigmoid, no_grad, tensor, zeros, cat
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from torch import load, nn, sigmoid, no_grad, tensor, zeros, cat, ones_like, float32
+import torch.nn.functional as F
 from my_model import *
-from lll_fine_tuned import predict_nexts_monsters
-from itertools import combinations
+import my_model
+from contexte_nn import DraftState, contexte_neural_net
+from lll_fine_tuned import predict_nexts_monsters, predict_nexts_monsters_batch, predict_nexts_monsters_stream, scorer_picks, preparer_prefixe, appliquer_precision, taille_cache, TrieMonstres
+from sessions_draft import DeltaDraft, GestionnaireSessions
+import synergies
+import registre_monstres
+from versions_modeles import GestionnaireVersions
+from empreintes import empreinte_fichiers, empreinte_dossier
+from draft_search import rechercher_draft
+from nn_cache import CacheEvaluations, cumuler
+import livre_ouvertures
+from scheduler import MicroBatcher, executer_avec_fusion
+from worker_pool import PoolWorkers, partager
+from functools import partial
+import copy
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
 import json
-import random
-from fastapi import Response
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import logging
+import os
+import re
+import threading
+import time
+import metriques
+from fastapi.responses import JSONResponse, StreamingResponse
 
+metriques.configurer_logs()
+logger = logging.getLogger("main")
 
 app = FastAPI(title="SWARM-LLM Python API")
+app.middleware("http")(metriques.middleware_http)
+#profileur par échantillonnage (PROFILEUR_MS > 0), piles sur /debug/profil
+profileur = metriques.demarrer_profileur()
 
-class DraftState(BaseModel):
-    playerAPicks: List[int]
-    playerBPicks: List[int]
-    playerABans: List[int] = Field(default_factory=list)
-    playerBBans: List[int] = Field(default_factory=list)
-    currentPhase: str
-    playerAAvailableIds: List[int]
-    playerBPossibleCounter : List[int]
-
+#micro-batching : fenêtre de regroupement des requêtes et taille max d'un lot
+FENETRE_BATCH_MS = float(os.environ.get("FENETRE_BATCH_MS", 10))
+TAILLE_MAX_BATCH = int(os.environ.get("TAILLE_MAX_BATCH", 16))
+#mode superviseur : NB_WORKERS > 0 fork autant de workers d'inférence qui partagent les poids chargés une fois
+#THREADS_PAR_WORKER par défaut = nombre de coeurs / NB_WORKERS
+NB_WORKERS = int(os.environ.get("NB_WORKERS", 0))
+THREADS_PAR_WORKER = int(os.environ.get("THREADS_PAR_WORKER", 0)) or None
+#précision du LLM : fp32, bf16 ou int8 (voir eval_precision.py pour choisir)
+PRECISION_LLM = os.environ.get("PRECISION_LLM", "fp32")
+#caches compilés (livre d'ouvertures, synergies, registre) : hors des sources, l'image docker le met hors du volume ./backend
+DOSSIER_CACHE = os.environ.get("DOSSIER_CACHE", "cache")
+#livre d'ouvertures (voir livre_ouvertures.py, construit hors ligne) : chemin de la table ("" pour le désactiver)
+LIVRE_OUVERTURES = os.environ.get("LIVRE_OUVERTURES", os.path.join(DOSSIER_CACHE, "livre_ouvertures.npy"))
+#sessions de draft (voir sessions_draft.py) : durée de vie sans activité, budget des KV caches du LLM, nombre max
+SESSIONS_TTL_S = float(os.environ.get("SESSIONS_TTL_S", 900))
+SESSIONS_BUDGET_MO = float(os.environ.get("SESSIONS_BUDGET_MO", 512))
+SESSIONS_MAX = int(os.environ.get("SESSIONS_MAX", 10_000))
+#synergies et contres (voir synergies.py) : json du webapp (cherchés aussi dans ../webapp) et cache compilé ("" : pas de cache)
+SYNERGIES_PAIRES = os.environ.get("SYNERGIES_PAIRES", "monsters_pairs_id.json")
+SYNERGIES_STATS = os.environ.get("SYNERGIES_STATS", "average_monster_stats_id.json")
+SYNERGIES_CACHE = os.environ.get("SYNERGIES_CACHE", os.path.join(DOSSIER_CACHE, "synergies.npz"))
+#registre compact des monstres (voir registre_monstres.py) : cache compilé ("" : pas de cache)
+REGISTRE_CACHE = os.environ.get("REGISTRE_CACHE", os.path.join(DOSSIER_CACHE, "registre_monstres.npz"))
+#rechargement à chaud (voir versions_modeles.py) : poids du MLP, période de vérification des fichiers (0 : désactivé),
+#fraction des requêtes rejouées en ombre sur la nouvelle version (0 : promotion dès l'échauffement),
+#comparaisons avant la promotion automatique et accord minimal (en dessous : POST /models/{nom}/promouvoir) ;
+#sans OMBRE_ACCORD_MIN, pas de promotion automatique : la candidate attend toujours /models/{nom}/promouvoir
+MODELE_MLP = os.environ.get("MODELE_MLP", "modele_predic_2.pt")
+RECHARGEMENT_S = float(os.environ.get("RECHARGEMENT_S", 30))
+OMBRE_FRACTION = float(os.environ.get("OMBRE_FRACTION", 0))
+OMBRE_REQUETES = int(os.environ.get("OMBRE_REQUETES", 50))
+OMBRE_ACCORD_MIN = float(os.environ["OMBRE_ACCORD_MIN"]) if os.environ.get("OMBRE_ACCORD_MIN") else None
 
 class SimpleDraftModel_one_hot(nn.Module):
     def __init__(self, input_dim, hidden_dims=[64, 32],dropout_p = 0.2):
@@ -46,108 +92,543 @@ class SimpleDraftModel_one_hot(nn.Module):
         return y.squeeze(1)
 
 
-@app.on_event("startup")
-def load_model():
-    global model
-    global model_infos
-    global monsters
-    global model_llm
-    global tokenizer_lmm
-    print("Chargement du modèle PyTorch...")
-    model_infos = load("modele_predic_2.pt", map_location="cpu")
+class SimpleDraftModel_sparse(SimpleDraftModel_one_hot):
+    #même réseau et même state dict que SimpleDraftModel_one_hot, seulement pour l'inférence
+    #la première couche est faite à partir des indices : on somme les colonnes des 8 monstres actifs
+    #au lieu d'allouer et de multiplier le one-hot de taille 2*input_dim
+    def __init__(self, input_dim, hidden_dims=[64, 32],dropout_p = 0.2):
+        super().__init__(input_dim, hidden_dims, dropout_p)
+        self.input_dim = input_dim
+
+    def preparer(self):
+        #à appeler après load_state_dict
+        #les poids quasi nuls (~1e-38, restes du weight decay) donnent des produits sous-normaux
+        #qui rendent les matmul CPU ~25x plus lentes, on les met à 0 (aucun effet sur les probas)
+        with no_grad():
+            for p in self.parameters():
+                p[p.abs() < 1e-30] = 0.
+        #colonnes de la première couche pour chaque joueur, taille (input_dim, h)
+        poids = self.mlp[0].weight.detach()
+        self.colonnes_A = poids[:, :self.input_dim].t().contiguous()
+        self.colonnes_B = poids[:, self.input_dim:].t().contiguous()
+
+    @staticmethod
+    def poids_uniques(idx):
+        #le one-hot ne compte qu'une fois un monstre en double (le padding 0 par exemple)
+        #on trie les indices de chaque ligne et on met un poids nul aux répétitions
+        idx, _ = idx.sort(dim=1)
+        poids = ones_like(idx, dtype=float32)
+        poids[:, 1:] = (idx[:, 1:] != idx[:, :-1]).float()
+        return idx, poids
+
+    def forward_indices(self, idx_A, idx_B):
+        # idx_A, idx_B shape: (batch_size, 4), indices du dict_mapp_index de chaque joueur
+        return self.tete(self.premiere_couche(idx_A, idx_B))
+
+    def premiere_couche(self, idx_A, idx_B):
+        #somme des colonnes des monstres actifs, sans le biais (même chose que h dans my_model)
+        idx_A, poids_A = self.poids_uniques(idx_A)
+        idx_B, poids_B = self.poids_uniques(idx_B)
+        return (F.embedding_bag(idx_A, self.colonnes_A, mode="sum", per_sample_weights=poids_A)
+                + F.embedding_bag(idx_B, self.colonnes_B, mode="sum", per_sample_weights=poids_B))
+
+    def tete(self, h):
+        # h shape: (batch_size, hidden), somme des colonnes de la première couche sans le biais
+        #permet à my_model de construire h par ajout/soustraction de colonnes
+        y = self.mlp[1:](h + self.mlp[0].bias)
+        return y.squeeze(1)
+
+
+#état de chaque modèle pour /health : "attente", "chargement", "pret" ou "erreur", et numéro de la version active
+etat_modeles = {nom: {"etat": "attente", "erreur": None, "duree_s": None, "version": None} for nom in ("mlp", "llm")}
+DOSSIER_LLM = os.environ.get("DOSSIER_LLM", "/app/full_model_finetuned")
+#les modèles chargés ne sont pas des globals : chaque requête prend la version active (versions.utiliser)
+versions = GestionnaireVersions(OMBRE_FRACTION, OMBRE_REQUETES, OMBRE_ACCORD_MIN)
+#draft d'échauffement : première passe des modèles avant de se déclarer prêt
+DRAFT_ECHAUFFEMENT = ([23711], [16811, 28312], [23712, 17411, 26113, 21811])
+
+
+def charger_etape(nom, charger):
+    #charge un modèle en mettant à jour son état, l'erreur est gardée pour /health puis relancée
+    etat_modeles[nom]["etat"] = "chargement"
+    debut = time.perf_counter()
+    try:
+        charger()
+    except Exception as erreur:
+        etat_modeles[nom].update(etat="erreur", erreur=repr(erreur))
+        raise
+    etat_modeles[nom].update(etat="pret", duree_s=round(time.perf_counter() - debut, 2))
+
+
+metriques.registre.collecteur(lambda: metriques.stats_modele(getattr(versions.active("mlp"), "model", None), stats_cache()))
+sessions = GestionnaireSessions(SESSIONS_TTL_S, SESSIONS_BUDGET_MO * 2**20, SESSIONS_MAX, taille_cache)
+metriques.registre.collecteur(sessions.metriques)
+metriques.registre.collecteur(versions.metriques)
+
+
+def charger_mlp():
+    #-> objets d'une version du MLP (versions_modeles.Version), chargée et échauffée
+    logger.info("Chargement du modèle PyTorch...")
+    model_infos = load(MODELE_MLP, map_location="cpu")
     input_dim,layers = model_infos["modele_name_and_param"]
-    model = SimpleDraftModel_one_hot(input_dim,layers)
+    model = SimpleDraftModel_sparse(input_dim,layers)
     model.load_state_dict(model_infos["modele_nn"])
     model.eval()
-    print(" Modèle chargé")
-    print("Chargement des monstres")
-    with open("monsters_rta.json") as f:
-        liste_data_rta = json.load(f)
-    monsters = {monster["id"]:monster for monster in liste_data_rta}
-    print("Monstres chargés ")
-    print("Chargement du modèle LLM...")
-    model_llm = AutoModelForCausalLM.from_pretrained("/app/full_model_finetuned")
-    print(" Modèle LLM chargé")
-    print("Chargement du tokenizer...")
-    tokenizer_lmm = AutoTokenizer.from_pretrained("/app/full_model_finetuned")
-    print("Tokenizer chargé")
+    model.preparer()
+    model.cache = CacheEvaluations(taille_max=100_000)
+    logger.info("Modèle chargé")
+    logger.info("Chargement des monstres")
+    registre = registre_monstres.charger("monsters_rta.json",model_infos["dict_mapp_index"],REGISTRE_CACHE)
+    #indices_monstres de my_model passe par le registre
+    model_infos["registre"] = registre
+    logger.info("Monstres chargés")
+    table_synergies = synergies.charger(SYNERGIES_PAIRES,SYNERGIES_STATS,model_infos["dict_mapp_index"],input_dim,SYNERGIES_CACHE)
+    if table_synergies is None:
+        logger.warning("Json des synergies introuvables (%s, %s), /synergies désactivé", SYNERGIES_PAIRES, SYNERGIES_STATS)
+    if LIVRE_OUVERTURES:
+        livre_ouvertures.preparer(model,MODELE_MLP,LIVRE_OUVERTURES)
+    pickA, pickB, dispo = DRAFT_ECHAUFFEMENT
+    predict_two_complete(model,model_infos,pickA,pickB,dispo)
+    model.cache.vider()
+    return {"model": model, "model_infos": model_infos, "registre": registre, "table_synergies": table_synergies}
+
+
+def charger_llm():
+    #-> objets d'une version du LLM ; le trie part du registre des monstres du MLP actif (copie : ses tokens
+    #sont ceux de ce tokenizer, une version suivante du LLM ne les remplace pas)
+    registre = copy.copy(versions.active("mlp").registre)
+    #transformers n'est importé qu'ici : le démarrage et /neural-net n'attendent pas son import
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    logger.info("Chargement du modèle LLM...")
+    #low_cpu_mem_usage : les poids safetensors sont lus en mmap sans copie intermédiaire
+    llm = AutoModelForCausalLM.from_pretrained(DOSSIER_LLM, low_cpu_mem_usage=True)
+    logger.info("Modèle LLM chargé")
+    logger.info("Chargement du tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(DOSSIER_LLM)
+    logger.info("Tokenizer chargé")
+    llm = appliquer_precision(llm,PRECISION_LLM)
+    logger.info("LLM en précision %s", PRECISION_LLM)
+    preparer_prefixe(llm,tokenizer)
+    logger.info("KV cache du préfixe du prompt calculé")
+    trie = TrieMonstres(tokenizer,registre=registre.tokeniser(tokenizer))
+    logger.info("Trie des tokens des monstres construit")
+    pickA, pickB, dispo = DRAFT_ECHAUFFEMENT
+    predict_nexts_monsters(llm,tokenizer,pickA,pickB,dispo,trie=trie)
+    return {"llm": llm, "tokenizer": tokenizer, "trie": trie}
+
+
+def charger_version(nom):
+    etat_modeles[nom]["version"] = versions.charger(nom).numero
+
+
+def modeles_actifs():
+    return [m for m in (getattr(versions.active("mlp"), "model", None), getattr(versions.active("llm"), "llm", None)) if m is not None]
+
+
+def apres_promotion(nom, version):
+    if pool_workers is not None:
+        #les workers ont gardé au fork la version d'avant : nouveau pool forké depuis les versions actives,
+        #les anciens workers finissent leurs lots en cours
+        partager(*modeles_actifs())
+        pool_workers.remplacer()
+    #après le remplacement des workers : aussi la première version d'un modèle en échec au démarrage (watcher),
+    #qui n'est déclaré prêt qu'une fois servi par les nouveaux workers
+    etat_modeles[nom].update(etat="pret", erreur=None, duree_s=version.duree_s, version=version.numero)
+
+
+def initialiser_worker():
+    #cache des évaluations neuf dans chaque worker : un thread du parent pouvait tenir son verrou au fork
+    version = versions.active("mlp")
+    if version is not None:
+        version.model.cache = CacheEvaluations(taille_max=100_000)
+
+
+def etat_worker():
+    #renvoyé au parent avec chaque lot (voir stats_cache)
+    return {"cache": versions.active("mlp").model.cache.stats()}
+
+
+def stats_cache():
+    #cache des évaluations du process principal (/draft-search, ombre...) et, en mode superviseur, ceux des workers
+    #(/neural-net y est servi, chacun a son cache) d'après le dernier état renvoyé avec leurs lots
+    version = versions.active("mlp")
+    if version is None:
+        return None
+    stats = [version.model.cache.stats()]
+    if pool_workers is not None:
+        stats += [etat["cache"] for etat in pool_workers.etats_workers()]
+    return dict(cumuler(stats), processus=len(stats))
+
+
+@app.on_event("startup")
+def load_model():
+    #le MLP et les monstres d'abord (bloquant, l'app ne sert rien sans eux), le LLM ensuite en arrière-plan
+    #en mode superviseur les workers sont forkés après le chargement : le LLM est alors chargé avant de servir
+    charger_etape("mlp", partial(charger_version, "mlp"))
+    if NB_WORKERS > 0:
+        try:
+            charger_etape("llm", partial(charger_version, "llm"))
+        except Exception as erreur:
+            #on sert quand même /neural-net, /llm-predict répondra 503 avec l'erreur
+            logger.error("Échec du chargement du LLM : %r", erreur)
+    else:
+        threading.Thread(target=charger_etape, args=("llm", partial(charger_version, "llm")), daemon=True, name="chargement-llm").start()
+    if RECHARGEMENT_S > 0:
+        #les nouvelles versions sont chargées à côté des actives, qui continuent de servir
+        versions.surveiller(RECHARGEMENT_S)
+
+
+def verifier_pret(nom):
+    #échec immédiat (503) si le modèle n'est pas encore chargé, plutôt que de faire attendre la requête
+    etat = etat_modeles[nom]
+    if etat["etat"] != "pret":
+        raise HTTPException(status_code=503, headers={"Retry-After": "10"},
+                            detail=f"modèle {nom} pas prêt ({etat['etat']})" + (f" : {etat['erreur']}" if etat["erreur"] else ""))
+
+
+def traiter_batch_nn(draft_states):
+    #les requêtes d'un lot tournent chacune dans un thread et partagent leurs passes du réseau
+    #une requête = (draft_state, format) ; tout le lot sur la même version du MLP
+    with versions.utiliser("mlp") as v:
+        return executer_avec_fusion(pool_nn, lambda requete: contexte_neural_net(my_model, v.model, v.model_infos, v.registre, *requete), draft_states)
+
+
+def traiter_batch_llm(requetes):
+    #une requête = (draft_state, mode)
+    #mode "generation" : un seul décodage paddé pour tout le lot, chaque ligne garde son masque de contraintes
+    #mode "score" : chaque requête classe ses candidats par log-proba (scorer_picks), sans sampling ni hasard
+    resultats = [None] * len(requetes)
+    a_generer = [i for i, (_, mode) in enumerate(requetes) if mode != "score"]
+    #les ids restent des int de bout en bout (tokens des ids lus dans le registre, voir TrieMonstres)
+    generations = [(requetes[i][0].playerAPicks, requetes[i][0].playerBPicks, requetes[i][0].playerAAvailableIds) for i in a_generer]
+    with versions.utiliser("llm") as v:
+        #une requête en erreur renvoie son exception à sa place (MicroBatcher), les autres du lot sont servies
+        for i, recommendated_monster in zip(a_generer, predict_nexts_monsters_batch(v.llm,v.tokenizer,generations,trie=v.trie) if generations else []):
+            logger.debug("%s", recommendated_monster)
+            if isinstance(recommendated_monster, Exception):
+                resultats[i] = recommendated_monster
+            else:
+                resultats[i] = {"ids":recommendated_monster,"names":noms_monstres(recommendated_monster)}
+        for i, (d, mode) in enumerate(requetes):
+            if mode == "score":
+                try:
+                    resultats[i] = reponse_score(scorer_picks(v.llm,v.tokenizer,d.playerAPicks,d.playerBPicks,d.playerAAvailableIds,
+                                                              registre=v.trie.registre))
+                except Exception as erreur:
+                    resultats[i] = erreur
+    return resultats
+
+
+def reponse_score(classement):
+    #meilleur candidat en ids / names comme le mode génération, plus le classement complet
+    classement = [{"ids": ids, "names": noms_monstres(ids), "log_proba": score}
+                  for ids, score in classement]
+    return {"ids": classement[0]["ids"] if classement else [], "names": classement[0]["names"] if classement else [],
+            "classement": classement}
+
+
+def noms_monstres(int_recommendated_monster):
+    registre = versions.active("mlp").registre
+    for int_monster in int_recommendated_monster : 
+        if int_monster not in registre : 
+            logger.warning("%s n'est pas dans la liste", int_monster)
+    return registre.noms_connus(int_recommendated_monster)
+
+
+# Ombre : une fraction des requêtes est rejouée sur la version active et la candidate (versions.ombre)
+
+def executer_nn(version, requete):
+    #sans le cache des évaluations : la requête vient d'y passer pour la version active
+    model = copy.copy(version.model)
+    model.cache = None
+    return contexte_neural_net(my_model, model, version.model_infos, version.registre, *requete)
+
+
+def comparer_nn(a, b):
+    #même texte aux probas près = même recommandation ; écart : moyenne des écarts de probas
+    if a is None or b is None:
+        return a is b, None
+    texte_a, texte_b = a.body.decode(), b.body.decode()
+    probas_a = [float(p) for p in re.findall(r"\d+\.\d+", texte_a)]
+    probas_b = [float(p) for p in re.findall(r"\d+\.\d+", texte_b)]
+    accord = re.sub(r"\d+\.\d+", "", texte_a) == re.sub(r"\d+\.\d+", "", texte_b)
+    ecart = sum(abs(p - q) for p, q in zip(probas_a, probas_b)) / len(probas_a) if accord and probas_a else None
+    return accord, ecart
+
+
+def executer_llm(version, requete):
+    draft_state, mode = requete
+    pickA, pickB, dispo = draft_state.playerAPicks, draft_state.playerBPicks, draft_state.playerAAvailableIds
+    if mode == "score":
+        return reponse_score(scorer_picks(version.llm,version.tokenizer,pickA,pickB,dispo,registre=version.trie.registre))
+    return {"ids": predict_nexts_monsters(version.llm,version.tokenizer,pickA,pickB,dispo,trie=version.trie)}
+
+
+def comparer_llm(a, b):
+    #mêmes picks dans n'importe quel ordre (en mode generation le sampling en fait une mesure bruitée) ;
+    #mode score : écart de log-proba entre les meilleurs candidats des deux versions
+    accord = sorted(a["ids"]) == sorted(b["ids"])
+    ecart = abs(a["classement"][0]["log_proba"] - b["classement"][0]["log_proba"]) if a.get("classement") and b.get("classement") else None
+    return accord, ecart
+
+
+versions.ajouter("mlp", charger_mlp, lambda: empreinte_fichiers(MODELE_MLP, "monsters_rta.json"), executer_nn, comparer_nn,
+                 lambda version: apres_promotion("mlp", version))
+versions.ajouter("llm", charger_llm, lambda: empreinte_dossier(DOSSIER_LLM), executer_llm, comparer_llm,
+                 lambda version: apres_promotion("llm", version))
+
+
+pool_nn = ThreadPoolExecutor(max_workers=TAILLE_MAX_BATCH, thread_name_prefix="neural-net")
+if NB_WORKERS > 0:
+    #les lots sont traités dans les workers (mêmes fonctions, héritées par le fork), un lot par worker à la fois
+    pool_workers = PoolWorkers({"neural-net": traiter_batch_nn, "llm-predict": traiter_batch_llm}, NB_WORKERS, THREADS_PAR_WORKER,
+                               initialiser_worker, etat_worker)
+    batch_nn = MicroBatcher(partial(pool_workers.executer, "neural-net"), FENETRE_BATCH_MS, TAILLE_MAX_BATCH, "neural-net", NB_WORKERS)
+    batch_llm = MicroBatcher(partial(pool_workers.executer, "llm-predict"), FENETRE_BATCH_MS, TAILLE_MAX_BATCH, "llm-predict", NB_WORKERS)
+else:
+    pool_workers = None
+    batch_nn = MicroBatcher(traiter_batch_nn, FENETRE_BATCH_MS, TAILLE_MAX_BATCH, "neural-net")
+    batch_llm = MicroBatcher(traiter_batch_llm, FENETRE_BATCH_MS, TAILLE_MAX_BATCH, "llm-predict")
+
+
+@app.on_event("startup")
+async def demarrer_batchers():
+    #après load_model : les workers doivent hériter des poids déjà chargés
+    if pool_workers is not None:
+        partager(*modeles_actifs())
+        pool_workers.demarrer()
+        logger.info("%s workers d'inférence démarrés (%s threads torch chacun)", NB_WORKERS, pool_workers.threads)
+    batch_nn.demarrer()
+    batch_llm.demarrer()
+
+
+@app.on_event("shutdown")
+def arreter_workers():
+    if pool_workers is not None:
+        pool_workers.arreter()
 
 
 @app.post("/neural-net")
-async def get_neural_net_context(draft_state: DraftState):
-    # TODO : remplacer par ton réseau de neurones
-    context = (f"Contexte généré pour picks {draft_state.playerAPicks} vs {draft_state.playerBPicks}\n"
-    f"le joueur A à comme choix : {draft_state.playerAAvailableIds} et le joueur B à comme counter possible : {draft_state.playerBPossibleCounter}" 
-    )
-    print(context)
-    #on utilise le model : 
-    all_pairs = list(combinations(draft_state.playerAAvailableIds, 2))
-    print(draft_state.playerBPossibleCounter)
-    if (1 in draft_state.playerBPossibleCounter): 
-        #on utilse le nn pour avoir les prochains picks
-        if len(draft_state.playerAPicks)==0 and len(draft_state.playerBPicks)==0:
-            id,proba = predict_one(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
-            print(proba)
-            string_response = f"Le réseau de Neurone recommande le monstre {monsters[id]['name']} pour une propabilité de victoire de {proba:.4f}%"
-            return Response(content=string_response, media_type="text/plain")
-        elif (len(draft_state.playerBPicks)==2 and len(draft_state.playerAPicks)==1) or(len(draft_state.playerBPicks)==1 and len(draft_state.playerAPicks)==0) or (len(draft_state.playerBPicks)==3 and len(draft_state.playerAPicks)==2):
-            id1,id2,proba = predict_two_complete(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
-            string_response = f"Le réseau de Neurone recommande le monstre {monsters[id1]['name']} et {monsters[id2]['name']} pour une propabilité de victoire de {proba:.4f}%"
-            return Response(content=string_response, media_type="text/plain")
-
-        elif len(draft_state.playerAPicks)==5 and len(draft_state.playerBPicks)==5: 
-            #phase de ban 
-            id,proba = predict_ban(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks)
-            string_response = f"Le réseau de Neurone recommande de bannir  {monsters[id]['name']}  pour une propabilité de victoire dans le pire cas {proba:.4f}%"
-            return Response(content=string_response, media_type="text/plain")
-
-        elif len(draft_state.playerAPicks)==4 and len(draft_state.playerBPicks)==5:
-            id,proba = predict_one_contrainte(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
-            string_response = f"Le réseau de Neurone recommande le monstre {monsters[id]['name']} pour une propabilité de victoire de {proba:.4f}%"
-            return Response(content=string_response, media_type="text/plain")
-
-        elif len(draft_state.playerAPicks)==3 and len(draft_state.playerBPicks)==4:
-            id1,id2,proba = predict_two_contrainte(model,model_infos,draft_state.playerAPicks,draft_state.playerBPicks,draft_state.playerAAvailableIds)
-            string_response = f"Le réseau de Neurone recommande le monstre {monsters[id1]['name']} et {monsters[id2]['name']} pour une propabilité de victoire de {proba:.4f}%"
-            return Response(content=string_response, media_type="text/plain")
-        else :
-            print("Le mode n'est pas supporté draftstate : ")
-            print(draft_state)
-    else : 
-        #mode conseil pour le llm online
-        num_to_take = len(draft_state.playerAAvailableIds)*3
-        num_returned = 5
-        # calculer les scores
-        scores = []
-        for a, b in random.sample(all_pairs, min(num_to_take, len(all_pairs))):
-            sortie = predict(model,model_infos,draft_state.playerAPicks+[a,b],draft_state.playerBPicks)
-            scores.append((a, b, sortie))
-
-        # trier par score croissant
-        scores.sort(key=lambda x: x[2])
-        scores = scores[-num_returned:]#on garde les num_returned meilleurs pour le llm
-        # construire la chaîne finale avec les scores affichés par ordre croissant
-        lines = ["Info neural network sur le choix des monstres pour JA : "] 
-        for a, b, sortie in scores:
-            print(a,b)
-            lines.append(f'Si JA pick : {monsters[a]["name"]} et {monsters[b]["name"]}, proba win : {sortie:.4f} ')
-        context_str = "\n".join(lines)
-        return Response(content=context_str, media_type="text/plain")
+async def get_neural_net_context(draft_state: DraftState, format: str = "texte"):
+    verifier_pret("mlp")
+    reponse = await batch_nn.soumettre((draft_state, format))
+    versions.ombre("mlp", (draft_state, format))
+    return reponse
+
+
+@app.post("/draft-search")
+def get_draft_search(draft_state: DraftState, profondeur: int = 2, largeur: int = 6, budget_ms: int = 200):
+    #recherche sur plusieurs tours de la draft (alpha-beta + table de transposition), le réseau sert de feuille
+    #B peut jouer tout le pool RTA connu du réseau ; def et non async def : la recherche (jusqu'à budget_ms)
+    #tourne dans le threadpool de Starlette sans bloquer la boucle d'événements
+    verifier_pret("mlp")
+    with versions.utiliser("mlp") as v:
+        dispo_B = v.registre.ids_nn
+        resultat = rechercher_draft(v.model,v.model_infos,draft_state.playerAPicks,draft_state.playerBPicks,
+                                    draft_state.playerAAvailableIds,dispo_B,profondeur,largeur,budget_ms)
+        ids = resultat["picks"] if "picks" in resultat else [resultat["ban"]]
+        resultat["names"] = v.registre.noms_connus(ids)
+    return resultat
+
+
+@app.post("/synergies")
+def get_synergies(draft_states: List[DraftState], k: int = 5):
+    #plusieurs drafts en un seul appel vectorisé : synergie et pression de chaque équipe, k meilleurs candidats de A
+    #(synergie avec A + contre de B) et le bloc texte compact pour le prompt
+    verifier_pret("mlp")
+    with versions.utiliser("mlp") as v:
+        if v.table_synergies is None:
+            raise HTTPException(status_code=503, detail="données de synergies absentes (SYNERGIES_PAIRES, SYNERGIES_STATS)")
+        return v.table_synergies.contexte(v.registre, draft_states, k)
+
+
+@app.get("/nn-cache")
+async def get_nn_cache_stats():
+    #compteurs du cache des évaluations du réseau (hits, misses, évictions), cumulés sur les workers
+    return stats_cache()
+
+
+@app.get("/health")
+async def get_health():
+    #vivant dès que le process répond, prêt quand tous les modèles sont chargés
+    return {"vivant": True, "pret": all(e["etat"] == "pret" for e in etat_modeles.values()), "modeles": etat_modeles}
+
+
+@app.get("/health/ready")
+async def get_readiness():
+    #sonde de readiness : 503 tant qu'un modèle n'est pas prêt
+    if not all(e["etat"] == "pret" for e in etat_modeles.values()):
+        return JSONResponse(status_code=503, content={"pret": False, "modeles": etat_modeles})
+    return {"pret": True, "modeles": etat_modeles}
+
+
+@app.get("/workers")
+async def get_workers_stats():
+    #état du pool de workers (mode superviseur) et taille moyenne des lots
+    return {"nb_workers": NB_WORKERS, "pool": pool_workers.stats() if pool_workers is not None else None,
+            "batch_nn": batch_nn.stats(), "batch_llm": batch_llm.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    #format Prometheus : latences par endpoint et par branche, passes du réseau, lots, LLM, caches
+    return PlainTextResponse(metriques.registre.exposer(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profil")
+async def get_profil(reinitialiser: bool = False):
+    #piles échantillonnées au format folded (flamegraph.pl, speedscope), process parent seulement
+    if profileur is None:
+        raise HTTPException(status_code=404, detail="profileur désactivé (PROFILEUR_MS)")
+    return PlainTextResponse(profileur.folded(reinitialiser))
+
+
+@app.get("/opening-book")
+async def get_opening_book_stats():
+    #état du livre d'ouvertures (hash du modèle, nombre d'états, hits / misses)
+    livre = getattr(versions.active("mlp").model, "livre", None)
+    return livre.stats() if livre is not None else {"etat": "absent ou construit pour un autre modèle"}
+
+
+@app.get("/models")
+async def get_models():
+    #versions actives, candidate en ombre (accord et latences par mode), versions en attente de libération
+    return versions.stats()
+
+
+def verifier_modele(nom):
+    if nom not in versions.chargeurs:
+        raise HTTPException(status_code=404, detail=f"modèle inconnu : {nom} (mlp ou llm)")
+
+
+@app.post("/models/{nom}/promouvoir")
+def promouvoir_modele(nom: str):
+    #promotion manuelle de la candidate en ombre (sans attendre OMBRE_REQUETES ou malgré OMBRE_ACCORD_MIN)
+    verifier_modele(nom)
+    if not versions.promouvoir(nom):
+        raise HTTPException(status_code=409, detail=f"pas de version candidate pour {nom}")
+    return versions.stats()["modeles"][nom]
+
+
+@app.post("/models/{nom}/rejeter")
+def rejeter_modele(nom: str):
+    #la candidate est libérée, ses fichiers ne sont pas rechargés tant qu'ils ne changent pas
+    verifier_modele(nom)
+    if not versions.rejeter(nom):
+        raise HTTPException(status_code=409, detail=f"pas de version candidate pour {nom}")
+    return versions.stats()["modeles"][nom]
 
 
 @app.post("/llm-predict")
-async def get_llm_recommendation(draft_state: DraftState) : 
-    ls_A = [str(m) for m in draft_state.playerAPicks]
-    ls_b = [str(m) for m in draft_state.playerBPicks]
-    ls_available = [str(m) for m in draft_state.playerAAvailableIds]
-    recommendated_monster = predict_nexts_monsters(model_llm,tokenizer_lmm,ls_A,ls_b,ls_available)
-    print(recommendated_monster)
-    int_recommendated_monster = [int(monster) for monster in recommendated_monster]
-    monster_name = []
-    for int_monster in int_recommendated_monster : 
-        if int_monster not in monsters.keys() : 
-            print(str(int_monster)+" n'est pas dans la liste ")
-        else : 
-            monster_name.append(monsters[int_monster]["name"])
+async def get_llm_recommendation(draft_state: DraftState, mode: str = "generation") : 
+    #mode=score : picks classés par log-proba du LLM (déterministe), avec le classement des meilleurs candidats
+    verifier_pret("llm")
+    if mode not in ("generation", "score"):
+        raise HTTPException(status_code=422, detail=f"mode inconnu : {mode} (generation ou score)")
+    reponse = await batch_llm.soumettre((draft_state, mode))
+    versions.ombre("llm", (draft_state, mode))
+    return reponse
+
+
+def evenement_sse(nom, donnees):
+    return f"event: {nom}\ndata: {json.dumps(donnees)}\n\n"
+
+
+@app.post("/llm-predict/stream")
+async def get_llm_recommendation_stream(draft_state: DraftState):
+    #même recommandation que /llm-predict en server-sent events : un évènement "pick" par monstre dès que ses tokens
+    #sont décodés, puis "fin" avec les picks retenus (complément au hasard compris) et les temps
+    #hors micro-batching : le premier pick d'une requête n'attend pas la fin des autres
+    verifier_pret("llm")
+    pickA, pickB, dispo = draft_state.playerAPicks, draft_state.playerBPicks, draft_state.playerAAvailableIds
+
+    def evenements():
+        #générateur synchrone : starlette le fait tourner dans son pool de threads
+        debut = time.perf_counter()
+        try:
+            with versions.utiliser("llm") as v:
+                for evenement, valeur in predict_nexts_monsters_stream(v.llm,v.tokenizer,pickA,pickB,dispo,trie=v.trie):
+                    duree_ms = round((time.perf_counter() - debut) * 1000, 1)
+                    if evenement == "pick":
+                        yield evenement_sse("pick", {"id": valeur, "names": noms_monstres([valeur]), "t_ms": duree_ms})
+                    else:
+                        ids, hasard = valeur
+                        yield evenement_sse("fin", {"ids": ids, "names": noms_monstres(ids), "hasard": hasard, "duree_ms": duree_ms})
+        except Exception as erreur:
+            #les en-têtes sont déjà partis : l'erreur est envoyée comme évènement
+            yield evenement_sse("erreur", {"detail": repr(erreur)})
+
+    return StreamingResponse(evenements(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Sessions de draft
+#le client ouvre une session avec le DraftState du début, puis n'envoie à chaque tour que les nouveaux picks / bans ;
+#le LLM reprend le KV cache du prompt du tour précédent (seuls les tokens qui ont changé sont recalculés)
+
+def obtenir_session(identifiant):
+    try:
+        return sessions.obtenir(identifiant)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"session {identifiant} inconnue ou expirée")
+
+
+@app.post("/draft-session")
+async def ouvrir_session(draft_state: DraftState):
+    session = sessions.ouvrir(draft_state)
+    return session.resume() | {"ttl_s": SESSIONS_TTL_S}
+
+
+@app.get("/draft-session/{identifiant}")
+async def get_session(identifiant: str):
+    return obtenir_session(identifiant).resume()
+
+
+@app.patch("/draft-session/{identifiant}")
+def appliquer_tour(identifiant: str, delta: DeltaDraft):
+    #def synchrone : attend le verrou de la session (un calcul du LLM en cours) dans le pool de threads
+    session = obtenir_session(identifiant)
+    with session.verrou:
+        session.appliquer(delta)
+        return session.resume()
+
+
+@app.delete("/draft-session/{identifiant}")
+async def fermer_session(identifiant: str):
+    if not sessions.fermer(identifiant):
+        raise HTTPException(status_code=404, detail=f"session {identifiant} inconnue ou expirée")
+    return {"session": identifiant, "fermee": True}
+
+
+@app.get("/draft-sessions")
+async def get_sessions_stats():
+    return sessions.stats()
+
+
+@app.post("/draft-session/{identifiant}/neural-net")
+async def get_session_neural_net(identifiant: str, format: str = "texte"):
+    #l'état courant de la session passe par le même micro-batcher que /neural-net
+    verifier_pret("mlp")
+    session = obtenir_session(identifiant)
+    return await batch_nn.soumettre((session.draft_state(), format))
+
 
-    return {"ids":int_recommendated_monster,"names":monster_name}
\ No newline at end of file
+@app.post("/draft-session/{identifiant}/llm-predict")
+def get_session_llm(identifiant: str, mode: str = "generation"):
+    #hors micro-batching (le décodage paddé du lot ne part pas du cache de la session), dans le process principal
+    verifier_pret("llm")
+    if mode not in ("generation", "score"):
+        raise HTTPException(status_code=422, detail=f"mode inconnu : {mode} (generation ou score)")
+    session = obtenir_session(identifiant)
+    with session.verrou, versions.utiliser("llm") as v:
+        if session.kv.get("version") != v.numero:
+            #KV cache calculé par une autre version du LLM (rechargée depuis) : on repart du préfixe
+            session.kv = {"ids": [], "cache": None, "version": v.numero}
+        pickA, pickB, dispo = session.etat.playerAPicks, session.etat.playerBPicks, session.etat.playerAAvailableIds
+        if mode == "score":
+            reponse = reponse_score(scorer_picks(v.llm,v.tokenizer,pickA,pickB,dispo,kv_session=session.kv,registre=v.trie.registre))
+        else:
+            ids = predict_nexts_monsters(v.llm,v.tokenizer,pickA,pickB,dispo,trie=v.trie,kv_session=session.kv)
+            reponse = {"ids": ids, "names": noms_monstres(ids)}
+    sessions.mesurer(session)
+    return reponse
@@ -0,0 +1,265 @@
+# backend/metriques.py
+#instrumentation légère du backend, sans dépendance : compteurs et histogrammes avec labels,
+#exposés au format texte de Prometheus sur /metrics
+#en mode superviseur, les workers renvoient leurs deltas avec chaque lot (extraire / fusionner)
+#et le process parent expose la somme
+#profileur par échantillonnage optionnel (PROFILEUR_MS) : piles de tous les threads au format "folded" (flamegraph)
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+#secondes
+BUCKETS_LATENCE = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+#lignes, requêtes, pas de décodage...
+BUCKETS_TAILLE = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, 262144)
+
+
+def configurer_logs():
+    #niveau global par NIVEAU_LOG (DEBUG pour retrouver les traces des boucles de prédiction, INFO par défaut)
+    logging.basicConfig(level=os.environ.get("NIVEAU_LOG", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s : %(message)s")
+
+
+class Metrique:
+    type = None
+
+    def __init__(self, nom, aide, labels=()):
+        self.nom = nom
+        self.aide = aide
+        self.labels = tuple(labels)
+        self.valeurs = {}       #valeurs des labels (tuple) -> valeur
+        self.verrou = threading.Lock()
+        registre.ajouter(self)
+
+    def cle(self, labels):
+        return tuple(str(labels[nom]) for nom in self.labels)
+
+    def extraire(self):
+        with self.verrou:
+            valeurs, self.valeurs = self.valeurs, {}
+        return valeurs
+
+
+class Compteur(Metrique):
+    type = "counter"
+
+    def inc(self, valeur=1, **labels):
+        cle = self.cle(labels)
+        with self.verrou:
+            self.valeurs[cle] = self.valeurs.get(cle, 0) + valeur
+
+    def fusionner(self, valeurs):
+        with self.verrou:
+            for cle, valeur in valeurs.items():
+                self.valeurs[cle] = self.valeurs.get(cle, 0) + valeur
+
+    def lignes(self):
+        with self.verrou:
+            return [(self.nom, cle, valeur) for cle, valeur in self.valeurs.items()]
+
+
+class Histogramme(Metrique):
+    type = "histogram"
+
+    def __init__(self, nom, aide, labels=(), buckets=BUCKETS_LATENCE):
+        super().__init__(nom, aide, labels)
+        self.buckets = tuple(buckets)
+
+    def observer(self, valeur, **labels):
+        cle = self.cle(labels)
+        with self.verrou:
+            #par bucket (non cumulé, le dernier est +Inf), puis somme et nombre d'observations
+            etat = self.valeurs.get(cle)
+            if etat is None:
+                etat = self.valeurs[cle] = [0] * (len(self.buckets) + 1) + [0., 0]
+            etat[bisect.bisect_left(self.buckets, valeur)] += 1
+            etat[-2] += valeur
+            etat[-1] += 1
+
+    @contextmanager
+    def mesurer(self, **labels):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer(time.perf_counter() - debut, **labels)
+
+    def fusionner(self, valeurs):
+        with self.verrou:
+            for cle, etat in valeurs.items():
+                actuel = self.valeurs.get(cle)
+                self.valeurs[cle] = etat if actuel is None else [a + b for a, b in zip(actuel, etat)]
+
+    def lignes(self):
+        with self.verrou:
+            valeurs = [(cle, list(etat)) for cle, etat in self.valeurs.items()]
+        lignes = []
+        for cle, etat in valeurs:
+            cumul = 0
+            for borne, nombre in zip(self.buckets + (float("inf"),), etat):
+                cumul += nombre
+                lignes.append((self.nom + "_bucket", cle, cumul, "+Inf" if borne == float("inf") else repr(borne)))
+            lignes.append((self.nom + "_sum", cle, etat[-2]))
+            lignes.append((self.nom + "_count", cle, etat[-1]))
+        return lignes
+
+
+class Registre:
+    def __init__(self):
+        self.metriques = {}
+        self.collecteurs = []
+
+    def ajouter(self, metrique):
+        self.metriques[metrique.nom] = metrique
+
+    def collecteur(self, fonction):
+        #fonction() -> liste de (nom, type, aide, valeur), lue à chaque /metrics (stats des caches, du livre...)
+        self.collecteurs.append(fonction)
+
+    def extraire(self):
+        #deltas depuis le dernier appel (côté worker), remis à zéro
+        return {nom: metrique.extraire() for nom, metrique in self.metriques.items()}
+
+    def fusionner(self, deltas):
+        #deltas d'un worker ajoutés aux valeurs du process parent
+        for nom, valeurs in deltas.items():
+            if valeurs and nom in self.metriques:
+                self.metriques[nom].fusionner(valeurs)
+
+    def exposer(self):
+        #format texte de Prometheus (version 0.0.4)
+        sortie = []
+        for metrique in self.metriques.values():
+            sortie.append(f"# HELP {metrique.nom} {metrique.aide}")
+            sortie.append(f"# TYPE {metrique.nom} {metrique.type}")
+            for nom, cle, valeur, *le in metrique.lignes():
+                labels = [f'{n}="{echapper(v)}"' for n, v in zip(metrique.labels, cle)]
+                if le:
+                    labels.append(f'le="{le[0]}"')
+                sortie.append(f"{nom}{{{','.join(labels)}}} {valeur}" if labels else f"{nom} {valeur}")
+        for fonction in self.collecteurs:
+            for nom, type, aide, valeur in fonction():
+                sortie += [f"# HELP {nom} {aide}", f"# TYPE {nom} {type}", f"{nom} {valeur}"]
+        return "\n".join(sortie) + "\n"
+
+
+def echapper(valeur):
+    return valeur.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registre = Registre()
+
+
+def apres_fork():
+    #dans un process forké (workers) : verrous neufs (un thread du parent pouvait en tenir un au fork)
+    #et valeurs à zéro, celles héritées sont déjà comptées par le parent
+    for metrique in registre.metriques.values():
+        metrique.verrou = threading.Lock()
+        metrique.valeurs = {}
+
+
+os.register_at_fork(after_in_child=apres_fork)
+
+DUREE_REQUETES = Histogramme("http_requete_duree_secondes", "Durée des requêtes par endpoint", ("endpoint", "methode", "statut"))
+DUREE_BRANCHES = Histogramme("nn_branche_duree_secondes", "Durée de /neural-net par branche de la draft", ("branche",))
+PASSES_RESEAU = Compteur("nn_passes_total", "Passes du réseau (après cache et fusion)", ("moteur",))
+LIGNES_PASSE = Histogramme("nn_lignes_par_passe", "Lignes évaluées par passe du réseau", ("moteur",), BUCKETS_TAILLE)
+TAILLE_LOTS = Histogramme("batch_taille_lot", "Requêtes par lot du micro-batcher", ("file",), BUCKETS_TAILLE)
+PAS_LLM = Histogramme("llm_pas_decodage", "Pas de décodage par génération", ("chemin",), BUCKETS_TAILLE)
+TOKENS_LLM = Compteur("llm_tokens_generes_total", "Tokens générés par le LLM", ("chemin",))
+DUREE_LLM = Compteur("llm_decodage_secondes_total", "Temps passé à décoder (tokens/s = rate tokens / rate secondes)", ("chemin",))
+RECOMMANDATIONS_LLM = Compteur("llm_recommandations_total", "Recommandations du LLM selon le nombre de picks complétés au hasard", ("hasard",))
+
+
+async def middleware_http(request, call_next):
+    #à brancher avec app.middleware("http")(middleware_http) : latence par route (chemin déclaré, pas l'url)
+    debut = time.perf_counter()
+    statut = 500
+    try:
+        reponse = await call_next(request)
+        statut = reponse.status_code
+        return reponse
+    finally:
+        route = request.scope.get("route")
+        DUREE_REQUETES.observer(time.perf_counter() - debut, endpoint=getattr(route, "path", "inconnu"),
+                                methode=request.method, statut=statut)
+
+
+def stats_modele(model, stats_cache=None):
+    #collecteur : cache des évaluations et livre d'ouvertures du modèle (process courant)
+    #stats_cache : stats du cache à publier à la place de celles du process (cumul des workers, voir nn_cache.cumuler)
+    if model is None:
+        return []
+    lignes = []
+    cache = getattr(model, "cache", None)
+    if stats_cache is not None or cache is not None:
+        stats = stats_cache or cache.stats()
+        lignes += [("nn_cache_hits_total", "counter", "Lignes servies par le cache du réseau", stats["hits"]),
+                   ("nn_cache_misses_total", "counter", "Lignes calculées par le réseau", stats["misses"]),
+                   ("nn_cache_evictions_total", "counter", "Évictions LRU du cache", stats["evictions"]),
+                   ("nn_cache_entrees", "gauge", "Entrées dans le cache", stats["taille"]),
+                   ("nn_cache_hit_rate", "gauge", "Taux de hits du cache", stats["hit_rate"])]
+    livre = getattr(model, "livre", None)
+    if livre is not None:
+        stats = livre.stats()
+        lignes += [("livre_hits_total", "counter", "Recommandations servies par le livre d'ouvertures", stats["hits"]),
+                   ("livre_misses_total", "counter", "États absents du livre (calcul live)", stats["misses"]),
+                   ("livre_hit_rate", "gauge", "Taux de hits du livre d'ouvertures", stats["hit_rate"])]
+    return lignes
+
+
+class Profileur:
+    #toutes les intervalle_ms, relève la pile de chaque thread (sauf ceux qui attendent) et compte les piles identiques
+    def __init__(self, intervalle_ms):
+        self.intervalle = intervalle_ms / 1000
+        self.piles = Counter()
+        self.echantillons = 0
+        self.verrou = threading.Lock()
+        self.thread = threading.Thread(target=self.boucle, daemon=True, name="profileur")
+
+    def demarrer(self):
+        self.thread.start()
+
+    def boucle(self):
+        moi = threading.get_ident()
+        while True:
+            time.sleep(self.intervalle)
+            piles = []
+            for ident, frame in sys._current_frames().items():
+                if ident == moi:
+                    continue
+                pile = []
+                while frame is not None:
+                    pile.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                #threads en attente (files, verrous, select) : ils ne coûtent rien, on ne les compte pas
+                if pile[0].split(":")[0] in ("threading.py", "queue.py", "selectors.py", "connection.py") or pile[0] == "thread.py:_worker":
+                    continue
+                piles.append(";".join(reversed(pile)))
+            with self.verrou:
+                self.piles.update(piles)
+                self.echantillons += 1
+
+    def folded(self, reinitialiser=False):
+        #une ligne "f1;f2;f3 nombre" par pile, à passer à flamegraph.pl ou speedscope
+        with self.verrou:
+            piles = self.piles
+            if reinitialiser:
+                self.piles = Counter()
+                self.echantillons = 0
+        return "".join(f"{pile} {nombre}\n" for pile, nombre in piles.most_common())
+
+
+def demarrer_profileur():
+    #PROFILEUR_MS > 0 : profileur actif (process courant seulement), None sinon
+    intervalle = float(os.environ.get("PROFILEUR_MS", 0))
+    if intervalle <= 0:
+        return None
+    profileur = Profileur(intervalle)
+    profileur.demarrer()
+    return profileur
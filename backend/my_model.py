@@ -1,196 +1,360 @@
 # backend/my_model.py
-from  torch import load, nn, sigmoid, no_grad, tensor, zeros, cat
-from itertools import permutations
+from  torch import load, nn, sigmoid, no_grad, tensor, zeros, cat, long, isin
+import torch
+from itertools import permutations, combinations
+import functools
+import logging
+import threading
+import time
+import numpy_model
+from livre_ouvertures import recommandation_livre
+from metriques import PASSES_RESEAU, LIGNES_PASSE
+
+logger = logging.getLogger(__name__)
 
 def pad_list(lst, target_length=4):
     return lst[:target_length] + [0] * (target_length - len(lst))#pour l'instant les drafts partielles ne sont pas généres, on met un monstre random à la place
 
-# Exemple : ton réseau de neurones
-def predict(model,model_infos,joueur_A,joueur_B):
-    #model est le model torch, model_info est les infos necessaire pour le model, en particulier le mapping id-> vecteur
-    joueur_A_pad = pad_list(joueur_A, 4)
-    joueur_B_pad = pad_list(joueur_B, 4)
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id_monstres = joueur_A_pad + joueur_B_pad
+# SANS_UN[i] = les positions d'une équipe de 5 quand on enlève le monstre i (ban)
+SANS_UN = tensor([[j for j in range(5) if j != i] for i in range(5)])
+
+
+def indices_monstres(model_infos, ids):
+    #id des monstres -> indices dans le one-hot (0 si le monstre est inconnu)
+    #avec le registre des monstres (registre_monstres.py, posé au chargement) : un seul accès vectorisé
+    registre = model_infos.get("registre")
+    if registre is not None:
+        return torch.from_numpy(registre.indices_nn(ids))
+    mapping = model_infos["dict_mapp_index"]
+    return tensor([mapping.get(id, 0) for id in ids], dtype=long)
+
+
+def one_hot_batch(input_dim, idx):
+    #idx de taille (N,4) -> one-hot de taille (N,input_dim), un monstre en double ne compte qu'une fois
+    x = zeros(idx.shape[0], input_dim)
+    x.scatter_(1, idx, 1.)
+    return x
+
+
+def probas_batch(model, model_infos, idx_A, idx_B, h=None):
+    #moteur de score : une seule passe du réseau pour toutes les lignes
+    #idx_A et idx_B sont de taille (N,4), on renvoie les probas calibrées de taille (N,)
+    #h (N,hidden) est la première couche déjà calculée de façon incrémentale (voir plus bas),
+    #on la passe sous forme de fonction pour ne la calculer que s'il reste des lignes à évaluer
+    #si le modèle a un cache (nn_cache.CacheEvaluations), seules les lignes jamais vues passent dans le réseau
+    cache = getattr(model, "cache", None)
+    if cache is None:
+        return probas_reseau(model, model_infos, idx_A, idx_B, None if h is None else h())
+
+    def calcul(lignes):
+        lignes = tensor(lignes, dtype=long)
+        return probas_reseau(model, model_infos, idx_A[lignes], idx_B[lignes], None if h is None else h()[lignes]).tolist()
+
+    return tensor(cache.evaluer(cles_cache(idx_A, idx_B), calcul))
+
+
+def cles_cache(idx_A, idx_B):
+    #clé canonique d'une ligne : multiset des indices de A et de B
+    cles_A = map(tuple, idx_A.sort(dim=1).values.tolist())
+    cles_B = map(tuple, idx_B.sort(dim=1).values.tolist())
+    return list(zip(cles_A, cles_B))
+
+
+def probas_reseau(model, model_infos, idx_A, idx_B, h=None):
+    #si plusieurs requêtes sont traitées ensemble (scheduler), la passe est mise en commun avec les autres threads
+    fusion = getattr(contexte, "fusion", None)
+    if fusion is not None:
+        return fusion.probas(model, model_infos, idx_A, idx_B, h)
+    return passe_reseau(model, model_infos, idx_A, idx_B, h)
+
+
+def passe_reseau(model, model_infos, idx_A, idx_B, h=None):
+    #si le modèle sait travailler directement sur les indices (SimpleDraftModel_sparse) on évite le one-hot
+    PASSES_RESEAU.inc(moteur="torch")
+    LIGNES_PASSE.observer(idx_A.shape[0], moteur="torch")
     with no_grad():
-        x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-        j1 = x[:4].detach().clone()
-        j2 = x[4:].detach().clone()
-        one_hot_j1 = zeros(input_dim)
-        one_hot_j1[j1] = 1
-        one_hot_j2 = zeros(input_dim)
-        one_hot_j2[j2] = 1
-        x = cat((one_hot_j1,one_hot_j2))
-        x = x.unsqueeze(0)
-        logits = model(x)
+        if h is not None:
+            logits = model.tete(h)
+        elif hasattr(model, "forward_indices"):
+            logits = model.forward_indices(idx_A, idx_B)
+        else:
+            input_dim,layers = model_infos["modele_name_and_param"]
+            x = cat((one_hot_batch(input_dim, idx_A), one_hot_batch(input_dim, idx_B)), dim=1)
+            logits = model(x)
         a,b = model_infos["calibration_proba"]
-        y_probs_calibrated = sigmoid(a * logits + b)
-        print("y_probs : " + str(float(y_probs_calibrated)))
-        return float(y_probs_calibrated)
+        return sigmoid(a * logits + b)
+
+
+# Passes communes entre requêtes
+# le scheduler traite les requêtes d'une même fenêtre chacune dans un thread, avec contexte.fusion pointant
+# sur la même FusionPasses : les appels à probas_reseau se donnent rendez-vous et ne font qu'une passe
+
+contexte = threading.local()
+
+
+class FusionPasses:
+    def __init__(self, participants, delai_ms=5):
+        #participants : nombre de threads qui peuvent encore appeler probas_reseau
+        #delai_ms : si un thread n'arrive pas (bloqué ailleurs), on lance sans lui au bout de ce délai
+        self.actifs = participants
+        self.delai = delai_ms / 1000
+        self.en_attente = []
+        self.debut_attente = None
+        self.condition = threading.Condition()
+        self.passes = 0
+        self.lignes = 0
+
+    def fin_participant(self):
+        with self.condition:
+            self.actifs -= 1
+            if self.en_attente and len(self.en_attente) >= self.actifs:
+                self.lancer()
+
+    def probas(self, model, model_infos, idx_A, idx_B, h):
+        demande = {"args": (model, model_infos, idx_A, idx_B, h)}
+        with self.condition:
+            if not self.en_attente:
+                self.debut_attente = time.perf_counter()
+            self.en_attente.append(demande)
+            while "resultat" not in demande and "erreur" not in demande:
+                if len(self.en_attente) >= self.actifs:
+                    self.lancer()
+                    continue
+                reste = self.debut_attente + self.delai - time.perf_counter()
+                if reste <= 0:
+                    self.lancer()
+                    continue
+                self.condition.wait(reste)
+        if "erreur" in demande:
+            raise demande["erreur"]
+        return demande["resultat"]
+
+    def lancer(self):
+        #appelé avec le verrou : une seule passe pour toutes les demandes en attente
+        lot, self.en_attente = self.en_attente, []
+        try:
+            resultats = passe_commune([demande["args"] for demande in lot])
+            for demande, resultat in zip(lot, resultats):
+                demande["resultat"] = resultat
+        except Exception as erreur:
+            for demande in lot:
+                demande["erreur"] = erreur
+        self.passes += 1
+        self.lignes += sum(demande["args"][2].shape[0] for demande in lot)
+        self.condition.notify_all()
+
+
+def passe_commune(demandes):
+    #concatène les lignes de plusieurs appels (même modèle) et découpe le résultat
+    model, model_infos = demandes[0][0], demandes[0][1]
+    tailles = [idx_A.shape[0] for _, _, idx_A, _, _ in demandes]
+    idx_A = cat([d[2] for d in demandes])
+    idx_B = cat([d[3] for d in demandes])
+    h = None
+    if hasattr(model, "premiere_couche"):
+        #on ramène tout le monde à la pré-activation pour ne faire qu'une passe dans la tête du réseau
+        with no_grad():
+            h = cat([d[4] if d[4] is not None else model.premiere_couche(d[2], d[3]) for d in demandes])
+    return passe_reseau(model, model_infos, idx_A, idx_B, h).split(tailles)
+
+
+def pad_indices(model_infos, idx, target_length=4):
+    #équivalent de pad_list sur un batch d'indices (N,k)
+    if idx.shape[1] >= target_length:
+        return idx[:, :target_length]
+    padding = indices_monstres(model_infos, [0]).expand(idx.shape[0], target_length - idx.shape[1])
+    return cat((idx, padding), dim=1)
 
 
+# Calcul incrémental de la première couche
+# elle est linéaire : la pré-activation d'une ligne est la somme des colonnes (colonnes_A / colonnes_B,
+# calculées une fois au chargement par SimpleDraftModel_sparse.preparer) de ses monstres.
+# On calcule donc une seule fois la somme de l'équipe fixe, on ajoute les colonnes des candidats,
+# et pour les grilles de ban on obtient les équipes "moins un monstre" par soustraction.
+
+def incremental(model):
+    return hasattr(model, "tete")
+
+
+def colonnes(model, cote):
+    return model.colonnes_A if cote == "A" else model.colonnes_B
+
+
+def sans_doublon(idx):
+    #vrai si aucune ligne de idx (N,k) ne contient deux fois le même monstre (condition pour soustraire)
+    idx = idx.reshape(-1, idx.shape[-1]).sort(dim=1).values
+    return bool((idx[:, 1:] != idx[:, :-1]).all())
+
+
+def somme_equipe(model, idx, cote):
+    #somme des colonnes d'une équipe fixe idx (k,), un monstre en double ne compte qu'une fois
+    return colonnes(model, cote)[idx.unique()].sum(dim=0)
+
+
+def somme_avec_candidats(model, fixe, idx_candidats, cote):
+    #équipe fixe (k,) + candidats (N,c) -> (N,hidden), en gardant la logique du one-hot :
+    #un candidat déjà présent dans l'équipe ou déjà vu dans la ligne n'est pas recompté
+    poids = ~isin(idx_candidats, fixe)
+    for j in range(1, idx_candidats.shape[1]):
+        poids[:, j] &= (idx_candidats[:, j:j+1] != idx_candidats[:, :j]).all(dim=1)
+    ajout = (colonnes(model, cote)[idx_candidats] * poids.unsqueeze(-1)).sum(dim=1)
+    return somme_equipe(model, fixe, cote) + ajout
+
+
+def sommes_sans_un(model, equipes, cote):
+    #equipes (...,5) sans doublon -> (...,5,hidden) : ligne i = somme de l'équipe sans le monstre i
+    col = colonnes(model, cote)[equipes]
+    return col.sum(dim=-2, keepdim=True) - col
+
+
+def selon_moteur(fonction):
+    #un modèle chargé depuis le .npz (numpy_model.ModeleNumpy) passe par le predict_* numpy du même nom
+    version_numpy = getattr(numpy_model, fonction.__name__)
+
+    @functools.wraps(fonction)
+    def predict_selon_moteur(model, *args):
+        if isinstance(model, numpy_model.ModeleNumpy):
+            return version_numpy(model, *args)
+        return fonction(model, *args)
+    return predict_selon_moteur
+
+
+@selon_moteur
+def predict(model,model_infos,joueur_A,joueur_B):
+    #model est le model torch, model_info est les infos necessaire pour le model, en particulier le mapping id-> vecteur
+    idx_A = indices_monstres(model_infos, pad_list(joueur_A, 4)).unsqueeze(0)
+    idx_B = indices_monstres(model_infos, pad_list(joueur_B, 4)).unsqueeze(0)
+    return float(probas_batch(model, model_infos, idx_A, idx_B)[0])
+
+
+@selon_moteur
 def predict_one(model,model_infos,joueur_A,joueur_B,joueurA_available):
     #on prédit le premier monstre pour jA
     #on renvoye le tuple id,proba
-    print("predict_one")
-    joueur_B_pad = pad_list(joueur_B, 4)
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id_choice,max_proba = 0,0.
-    for monster_id in joueurA_available:
-        joueur_A_pad = pad_list([monster_id], 4)
-        id_monstres = joueur_A_pad + joueur_B_pad
-        with no_grad():
-            x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-            j1 = x[:4].detach().clone()
-            j2 = x[4:].detach().clone()
-            one_hot_j1 = zeros(input_dim)
-            one_hot_j1[j1] = 1
-            one_hot_j2 = zeros(input_dim)
-            one_hot_j2[j2] = 1
-            x = cat((one_hot_j1,one_hot_j2))
-            x = x.unsqueeze(0)
-            logits = model(x)
-            a,b = model_infos["calibration_proba"]
-            y_probs_calibrated = sigmoid(a * logits + b)
-            if y_probs_calibrated>max_proba:
-                max_proba=y_probs_calibrated
-                id_choice=monster_id
-    return id_choice,float(max_proba)
+    logger.debug("predict_one")
+    if len(joueurA_available)==0:
+        return 0,0.
+    reco = recommandation_livre(model, model_infos, joueur_A, joueur_B, joueurA_available, False)
+    if reco is not None:
+        return reco
+    n = len(joueurA_available)
+    idx_candidats = indices_monstres(model_infos, joueurA_available).unsqueeze(1)
+    idx_A = pad_indices(model_infos, idx_candidats, 4)
+    idx_B = indices_monstres(model_infos, pad_list(joueur_B, 4))
+    h = None
+    if incremental(model):
+        #l'équipe fixe de A n'est que le padding
+        h = lambda: somme_avec_candidats(model, indices_monstres(model_infos, [0]), idx_candidats, "A") + somme_equipe(model, idx_B, "B")
+    probas = probas_batch(model, model_infos, idx_A, idx_B.expand(n, 4), h)
+    best = int(probas.argmax())
+    return joueurA_available[best],float(probas[best])
+
+def probas_avec_paires(model,model_infos,joueur_A,joueur_B,joueurA_available,all_pairs):
+    #probas de A + paire contre B pour chaque paire (positions dans joueurA_available), comme predict(A+[a,b],B)
+    idx_dispo = indices_monstres(model_infos, joueurA_available)
+    idx_paires = idx_dispo[tensor(all_pairs)]
+    idx_A = cat((indices_monstres(model_infos, joueur_A).expand(len(all_pairs), -1), idx_paires), dim=1)
+    idx_A = pad_indices(model_infos, idx_A, 4)
+    idx_B = indices_monstres(model_infos, pad_list(joueur_B, 4))
+    h = None
+    if incremental(model):
+        #partie fixe de A : ses picks (+ le padding s'il en reste), on n'ajoute que les candidats qui tiennent dans les 4 places
+        fixe = indices_monstres(model_infos, pad_list(joueur_A, 4) if len(joueur_A)+2<4 else joueur_A[:4])
+        h = lambda: somme_avec_candidats(model, fixe, idx_paires[:, :max(0, 4-len(joueur_A))], "A") + somme_equipe(model, idx_B, "B")
+    return probas_batch(model, model_infos, idx_A, idx_B.expand(len(all_pairs), 4), h)
 
+
+@selon_moteur
 def predict_two_complete(model,model_infos,joueur_A,joueur_B,joueurA_available):
-    print("predict_two_complete")
-
-    all_pairs = list(permutations(joueurA_available, 2))
-    joueur_B_pad = pad_list(joueur_B, 4)
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id_choice1,id_choice2,max_proba = 0,0,0.
-    for m1,m2 in all_pairs:
-        joueur_A_pad = pad_list(joueur_A+[m1,m2], 4)
-        id_monstres = joueur_A_pad + joueur_B_pad
-        with no_grad():
-            x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-            j1 = x[:4].detach().clone()
-            j2 = x[4:].detach().clone()
-            one_hot_j1 = zeros(input_dim)
-            one_hot_j1[j1] = 1
-            one_hot_j2 = zeros(input_dim)
-            one_hot_j2[j2] = 1
-            x = cat((one_hot_j1,one_hot_j2))
-            x = x.unsqueeze(0)
-            logits = model(x)
-            a,b = model_infos["calibration_proba"]
-            y_probs_calibrated = sigmoid(a * logits + b)
-            if y_probs_calibrated>max_proba:
-                max_proba=y_probs_calibrated
-                id_choice1,id_choice2=m1,m2
-    return id_choice1,id_choice2,float(max_proba)
+    logger.debug("predict_two_complete")
+    #tant que A+paire tient dans 4 places l'ordre de la paire ne change rien, on évalue chaque paire une seule fois
+    n = len(joueurA_available)
+    all_pairs = list(combinations(range(n), 2) if len(joueur_A)<=2 else permutations(range(n), 2))
+    if len(all_pairs)==0:
+        return 0,0,0.
+    reco = recommandation_livre(model, model_infos, joueur_A, joueur_B, joueurA_available, True) if len(joueur_A)<=2 else None
+    if reco is not None:
+        return reco
+    probas = probas_avec_paires(model, model_infos, joueur_A, joueur_B, joueurA_available, all_pairs)
+    best = int(probas.argmax())
+    i1,i2 = all_pairs[best]
+    return joueurA_available[i1],joueurA_available[i2],float(probas[best])
+
 
+@selon_moteur
+def predict_top_paires(model,model_infos,joueur_A,joueur_B,joueurA_available,k=5):
+    #mode conseil : toutes les paires de dispo ajoutées à A en une passe, on garde les k meilleures (topk partiel)
+    #on renvoye la liste de tuples id1,id2,proba par proba décroissante
+    logger.debug("predict_top_paires")
+    all_pairs = list(combinations(range(len(joueurA_available)), 2))
+    if len(all_pairs)==0:
+        return []
+    probas = probas_avec_paires(model, model_infos, joueur_A, joueur_B, joueurA_available, all_pairs)
+    top = probas.topk(min(k, len(all_pairs)))
+    return [(joueurA_available[all_pairs[i][0]],joueurA_available[all_pairs[i][1]],p) for p, i in zip(top.values.tolist(), top.indices.tolist())]
 
+
+@selon_moteur
 def predict_one_contrainte(model,model_infos,joueur_A,joueur_B,joueurA_available):
     #on prédit le dernier monstre pour jA
     #on renvoye le tuple id,proba
-    print("predict_one_contrainte")
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id_choice,max_proba = 0,0.
-    for new_id in joueurA_available:
-        proba_pire_cas = 0.
-        for indice_B in range(5):
-            joueur_B_pad = [ms_id for i,ms_id in enumerate(joueur_B) if i!=indice_B] #On enlève un monstre pour B
-            min_for_ban=1
-            for indice_A in range(5):
-                joueur_A_pad = [ms_id for i,ms_id in enumerate(joueur_A+[new_id]) if i!=indice_A] #On enlève un monstre pour A
-                id_monstres = joueur_A_pad + joueur_B_pad
-                with no_grad():
-                    x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-                    j1 = x[:4].detach().clone()
-                    j2 = x[4:].detach().clone()
-                    one_hot_j1 = zeros(input_dim)
-                    one_hot_j1[j1] = 1
-                    one_hot_j2 = zeros(input_dim)
-                    one_hot_j2[j2] = 1
-                    x = cat((one_hot_j1,one_hot_j2))
-                    x = x.unsqueeze(0)
-                    logits = model(x)
-                    a,b = model_infos["calibration_proba"]
-                    y_probs_calibrated = sigmoid(a * logits + b)
-                    if y_probs_calibrated<min_for_ban:
-                        min_for_ban=y_probs_calibrated
-            #on a la proba min pour le ban, 
-            if min_for_ban>proba_pire_cas:
-                proba_pire_cas = min_for_ban
-        if proba_pire_cas>max_proba:
-            max_proba = proba_pire_cas
-            id_choice = new_id
-    return id_choice,float(max_proba)
- 
+    #grille (candidat, ban de B, ban de A) : A choisit le ban sur B, B choisit le pire ban sur A
+    logger.debug("predict_one_contrainte")
+    n = len(joueurA_available)
+    if n==0:
+        return 0,0.
+    equipes_A = cat((indices_monstres(model_infos, joueur_A).expand(n, -1), indices_monstres(model_infos, joueurA_available).unsqueeze(1)), dim=1)
+    equipe_B = indices_monstres(model_infos, joueur_B)
+    idx_A = equipes_A[:, SANS_UN]                                   #(n,5,4) : on enlève un monstre pour A
+    idx_B = equipe_B[SANS_UN]                                       #(5,4) : on enlève un monstre pour B
+    idx_A = idx_A.unsqueeze(1).expand(n, 5, 5, 4).reshape(-1, 4)
+    idx_B = idx_B.view(1, 5, 1, 4).expand(n, 5, 5, 4).reshape(-1, 4)
+    h = None
+    if incremental(model) and sans_doublon(equipes_A) and sans_doublon(equipe_B):
+        #(n,5,hidden) pour A, (5,hidden) pour B
+        h = lambda: (sommes_sans_un(model, equipes_A, "A").unsqueeze(1) + sommes_sans_un(model, equipe_B, "B").view(1, 5, 1, -1)).reshape(n*25, -1)
+    probas = probas_batch(model, model_infos, idx_A, idx_B, h).view(n, 5, 5)
+    proba_pire_cas = probas.amin(dim=2).amax(dim=1)
+    best = int(proba_pire_cas.argmax())
+    return joueurA_available[best],float(proba_pire_cas[best])
+
+@selon_moteur
 def predict_two_contrainte(model,model_infos,joueur_A,joueur_B,joueurA_available):
     #on prédit les deux derniers monstre pour jA
-    #on renvoye le tuple id,proba
-    all_pairs = list(permutations(joueurA_available, 2))
-    print("predict_two_contrainte")
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id1,id2,max_proba = 0,0,0.
-    joueur_B_pad = pad_list(joueur_B, 4) 
-    for m1,m2 in all_pairs:
-        proba_pire_cas = 0.
-        min_for_ban=1
-        for indice_A in range(5):
-            joueur_A_pad = [ms_id for i,ms_id in enumerate(joueur_A+[m1,m2]) if i!=indice_A] #On enlève un monstre pour A
-            id_monstres = joueur_A_pad + joueur_B_pad
-            with no_grad():
-                x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-                j1 = x[:4].detach().clone()
-                j2 = x[4:].detach().clone()
-                one_hot_j1 = zeros(input_dim)
-                one_hot_j1[j1] = 1
-                one_hot_j2 = zeros(input_dim)
-                one_hot_j2[j2] = 1
-                x = cat((one_hot_j1,one_hot_j2))
-                x = x.unsqueeze(0)
-                logits = model(x)
-                a,b = model_infos["calibration_proba"]
-                y_probs_calibrated = sigmoid(a * logits + b)
-                if y_probs_calibrated<min_for_ban:
-                    min_for_ban=y_probs_calibrated
-        #on a la proba min pour le ban, 
-        if min_for_ban>proba_pire_cas:
-            proba_pire_cas = min_for_ban
-    if proba_pire_cas>max_proba:
-        max_proba = proba_pire_cas
-        id1,id2 = m1,m2
-    return id1,id2,float(max_proba)
+    #on renvoye le tuple id1,id2,proba
+    #l'équipe finale de A fait 5, l'ordre de la paire ne change rien
+    logger.debug("predict_two_contrainte")
+    all_pairs = list(combinations(range(len(joueurA_available)), 2))
+    if len(all_pairs)==0:
+        return 0,0,0.
+    n = len(all_pairs)
+    idx_dispo = indices_monstres(model_infos, joueurA_available)
+    equipes_A = cat((indices_monstres(model_infos, joueur_A).expand(n, -1), idx_dispo[tensor(all_pairs)]), dim=1)
+    idx_A = equipes_A[:, SANS_UN].reshape(-1, 4)                    #(n*5,4) : on enlève un monstre pour A
+    idx_B = indices_monstres(model_infos, pad_list(joueur_B, 4))
+    h = None
+    if incremental(model) and sans_doublon(equipes_A):
+        h = lambda: (sommes_sans_un(model, equipes_A, "A") + somme_equipe(model, idx_B, "B")).reshape(n*5, -1)
+    probas = probas_batch(model, model_infos, idx_A, idx_B.expand(n*5, 4), h).view(n, 5)
+    proba_pire_cas = probas.amin(dim=1)
+    best = int(proba_pire_cas.argmax())
+    i1,i2 = all_pairs[best]
+    return joueurA_available[i1],joueurA_available[i2],float(proba_pire_cas[best])
 
 
+@selon_moteur
 def predict_ban(model,model_infos,joueur_A,joueur_B):
-    #on prédit le ban pour jA JA et JB font 5 en taille 
+    #on prédit le ban pour jA JA et JB font 5 en taille
     #on renvoye le tuple id,proba
-    print("predict_ban")
-    input_dim,layers = model_infos["modele_name_and_param"]
-    id_choice,max_proba = 0,0.
-    for indice_B in range(5):
-        joueur_B_pad = [ms_id for i,ms_id in enumerate(joueur_B) if i!=indice_B] #On enlève un monstre pour B
-        min_for_ban=1
-        for indice_A in range(5):
-            joueur_A_pad = [ms_id for i,ms_id in enumerate(joueur_A) if i!=indice_A] #On enlève un monstre pour A
-
-            id_monstres = joueur_A_pad + joueur_B_pad
-            with no_grad():
-                x = tensor([model_infos["dict_mapp_index"].get(id,0) for id in id_monstres])
-                j1 = x[:4].detach().clone()
-                j2 = x[4:].detach().clone()
-                one_hot_j1 = zeros(input_dim)
-                one_hot_j1[j1] = 1
-                one_hot_j2 = zeros(input_dim)
-                one_hot_j2[j2] = 1
-                x = cat((one_hot_j1,one_hot_j2))
-                x = x.unsqueeze(0)
-                logits = model(x)
-                a,b = model_infos["calibration_proba"]
-                y_probs_calibrated = sigmoid(a * logits + b)
-                if y_probs_calibrated<min_for_ban:
-                    min_for_ban=y_probs_calibrated
-        #on a la proba min pour le ban, 
-        if min_for_ban>max_proba:
-            max_proba = min_for_ban
-            id_choice = joueur_B[indice_B]
-    return id_choice,float(max_proba)
+    logger.debug("predict_ban")
+    equipe_A = indices_monstres(model_infos, joueur_A)
+    equipe_B = indices_monstres(model_infos, joueur_B)
+    idx_A = equipe_A[SANS_UN].unsqueeze(0).expand(5, 5, 4).reshape(-1, 4)   #on enlève un monstre pour A
+    idx_B = equipe_B[SANS_UN].unsqueeze(1).expand(5, 5, 4).reshape(-1, 4)   #on enlève un monstre pour B
+    h = None
+    if incremental(model) and sans_doublon(equipe_A) and sans_doublon(equipe_B):
+        h = lambda: (sommes_sans_un(model, equipe_A, "A").unsqueeze(0) + sommes_sans_un(model, equipe_B, "B").unsqueeze(1)).reshape(25, -1)
+    probas = probas_batch(model, model_infos, idx_A, idx_B, h).view(5, 5)
+    proba_pire_cas = probas.amin(dim=1)
+    best = int(proba_pire_cas.argmax())
+    return joueur_B[best],float(proba_pire_cas[best])
@@ -0,0 +1,101 @@
+# backend/nn_cache.py
+#cache partagé entre les requêtes pour les probas du réseau : beaucoup de drafts ont les mêmes ouvertures
+#et le front redemande à chaque tour, les grilles de ban et les paires se recoupent aussi beaucoup
+import threading
+from collections import OrderedDict
+
+
+class CacheEvaluations:
+    #clé = (indices triés de A, indices triés de B), valeur = proba calibrée
+    #éviction LRU au-delà de taille_max, et une seule évaluation à la fois pour une même clé (single-flight) :
+    #un thread qui demande une clé en cours de calcul attend le résultat au lieu de la recalculer
+    def __init__(self, taille_max=100_000):
+        self.taille_max = taille_max
+        self.valeurs = OrderedDict()
+        self.en_cours = {}          #clé -> Event posé quand le calcul est fini
+        self.verrou = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.attentes = 0
+
+    def evaluer(self, cles, calcul):
+        #cles : une clé par ligne, calcul(lignes) renvoie les valeurs des lignes demandées (liste de positions)
+        resultats = [None] * len(cles)
+        a_calculer = {}             #clé -> première position qui la calcule
+        a_attendre = []
+        with self.verrou:
+            for i, cle in enumerate(cles):
+                valeur = self.valeurs.get(cle)
+                if valeur is not None:
+                    self.valeurs.move_to_end(cle)
+                    resultats[i] = valeur
+                    self.hits += 1
+                elif cle in a_calculer:
+                    self.hits += 1
+                elif cle in self.en_cours:
+                    a_attendre.append((cle, self.en_cours[cle]))
+                    self.attentes += 1
+                else:
+                    a_calculer[cle] = i
+                    self.en_cours[cle] = threading.Event()
+                    self.misses += 1
+
+        calcules = {}
+        if a_calculer:
+            try:
+                valeurs = calcul(list(a_calculer.values()))
+                calcules = dict(zip(a_calculer, valeurs))
+            finally:
+                with self.verrou:
+                    for cle, valeur in calcules.items():
+                        self.valeurs[cle] = valeur
+                    while len(self.valeurs) > self.taille_max:
+                        self.valeurs.popitem(last=False)
+                        self.evictions += 1
+                    evenements = [self.en_cours.pop(cle) for cle in a_calculer]
+                for evenement in evenements:
+                    evenement.set()
+
+        #clés calculées par une autre requête : on attend, et si elle a échoué ou si la valeur est déjà évincée on calcule
+        manquantes = {}
+        for cle, evenement in a_attendre:
+            evenement.wait()
+            with self.verrou:
+                valeur = self.valeurs.get(cle)
+            if valeur is None:
+                manquantes.setdefault(cle, cles.index(cle))
+            else:
+                calcules[cle] = valeur
+        if manquantes:
+            calcules.update(zip(manquantes, calcul(list(manquantes.values()))))
+
+        for i, cle in enumerate(cles):
+            if resultats[i] is None:
+                resultats[i] = calcules[cle]
+        return resultats
+
+    def stats(self):
+        with self.verrou:
+            total = self.hits + self.misses
+            return {
+                "taille": len(self.valeurs),
+                "taille_max": self.taille_max,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "attentes": self.attentes,
+                "hit_rate": self.hits / total if total else 0.,
+            }
+
+    def vider(self):
+        with self.verrou:
+            self.valeurs.clear()
+
+
+def cumuler(stats):
+    #stats de plusieurs caches (process principal et workers du mode superviseur) -> un seul dict, hit_rate recalculé
+    total = {cle: sum(s[cle] for s in stats) for cle in ("taille", "taille_max", "hits", "misses", "evictions", "attentes")}
+    vus = total["hits"] + total["misses"]
+    total["hit_rate"] = total["hits"] / vus if vus else 0.
+    return total
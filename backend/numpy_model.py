@@ -0,0 +1,256 @@
+# backend/numpy_model.py
+#moteur numpy du réseau de draft, sans torch : pour les déploiements qui ne servent que /neural-net (api_nn.py)
+#exporter convertit modele_predic_2.pt en .npz (poids, dict_mapp_index, modele_name_and_param, calibration)
+#les predict_* ont les mêmes signatures et les mêmes résultats que ceux de my_model, qui les choisit
+#automatiquement quand le modèle est un ModeleNumpy
+#usage : python numpy_model.py [--pt modele_predic_2.pt] [--npz modele_predic_2.npz]  (seule étape qui importe torch)
+import argparse
+import logging
+from itertools import permutations, combinations
+import numpy as np
+from livre_ouvertures import recommandation_livre
+from metriques import PASSES_RESEAU, LIGNES_PASSE
+
+logger = logging.getLogger(__name__)
+
+# SANS_UN[i] = les positions d'une équipe de 5 quand on enlève le monstre i (ban)
+SANS_UN = np.array([[j for j in range(5) if j != i] for i in range(5)])
+
+
+def exporter(chemin_pt, chemin_npz):
+    import torch
+    infos = torch.load(chemin_pt, map_location="cpu")
+    input_dim,layers = infos["modele_name_and_param"]
+    etat = infos["modele_nn"]
+    #les Linear du mlp dans l'ordre (mlp.0, mlp.3, ...)
+    numeros = sorted({int(cle.split(".")[1]) for cle in etat})
+    poids = [etat[f"mlp.{i}.weight"].float().numpy().copy() for i in numeros]
+    biais = [etat[f"mlp.{i}.bias"].float().numpy().copy() for i in numeros]
+    #comme SimpleDraftModel_sparse.preparer : les poids quasi nuls (sous-normaux) sont mis à 0
+    for p in poids + biais:
+        p[np.abs(p) < 1e-30] = 0.
+    a,b = infos["calibration_proba"]
+    mapping = infos["dict_mapp_index"]
+    tableaux = {
+        "input_dim": np.array(input_dim),
+        "layers": np.array(layers),
+        "calibration": np.array([float(a), float(b)], dtype=np.float32),
+        "ids": np.array(list(mapping.keys()), dtype=np.int64),
+        "index": np.array(list(mapping.values()), dtype=np.int64),
+        "nb_couches": np.array(len(poids)),
+        #première couche découpée en colonnes par joueur, taille (input_dim, h)
+        "colonnes_A": np.ascontiguousarray(poids[0][:, :input_dim].T),
+        "colonnes_B": np.ascontiguousarray(poids[0][:, input_dim:].T),
+    }
+    for i in range(len(poids)):
+        if i > 0:
+            tableaux[f"poids_{i}"] = poids[i]
+        tableaux[f"biais_{i}"] = biais[i]
+    np.savez_compressed(chemin_npz, **tableaux)
+
+
+class ModeleNumpy:
+    #même réseau que SimpleDraftModel_sparse (main.py) : première couche par somme de colonnes, puis Linear/ReLU
+    def __init__(self, chemin_npz):
+        with np.load(chemin_npz) as z:
+            self.input_dim = int(z["input_dim"])
+            self.colonnes_A = z["colonnes_A"]
+            self.colonnes_B = z["colonnes_B"]
+            self.biais = z["biais_0"]
+            #poids transposés une fois pour faire x @ W
+            self.couches = [(np.ascontiguousarray(z[f"poids_{i}"].T), z[f"biais_{i}"]) for i in range(1, int(z["nb_couches"]))]
+            a,b = z["calibration"].tolist()
+            self.model_infos = {
+                "modele_name_and_param": (self.input_dim, z["layers"].tolist()),
+                "calibration_proba": (np.float32(a), np.float32(b)),
+                "dict_mapp_index": dict(zip(z["ids"].tolist(), z["index"].tolist())),
+            }
+
+    @staticmethod
+    def poids_uniques(idx):
+        #le one-hot ne compte qu'une fois un monstre en double (le padding 0 par exemple)
+        idx = np.sort(idx, axis=1)
+        poids = np.ones(idx.shape, dtype=np.float32)
+        poids[:, 1:] = idx[:, 1:] != idx[:, :-1]
+        return idx, poids
+
+    def premiere_couche(self, idx_A, idx_B):
+        idx_A, poids_A = self.poids_uniques(idx_A)
+        idx_B, poids_B = self.poids_uniques(idx_B)
+        return ((self.colonnes_A[idx_A] * poids_A[..., None]).sum(axis=1)
+                + (self.colonnes_B[idx_B] * poids_B[..., None]).sum(axis=1))
+
+    def tete(self, h):
+        x = np.maximum(h + self.biais, 0.)
+        for W, b in self.couches[:-1]:
+            x = np.maximum(x @ W + b, 0.)
+        W, b = self.couches[-1]
+        return (x @ W + b)[:, 0]
+
+    def forward_indices(self, idx_A, idx_B):
+        return self.tete(self.premiere_couche(idx_A, idx_B))
+
+
+def charger_npz(chemin_npz):
+    #renvoie (model, model_infos) comme le chargement du .pt dans main.py
+    model = ModeleNumpy(chemin_npz)
+    return model, model.model_infos
+
+
+def pad_list(lst, target_length=4):
+    #même chose que my_model.pad_list
+    return lst[:target_length] + [0] * (target_length - len(lst))
+
+
+def indices_monstres(model_infos, ids):
+    registre = model_infos.get("registre")
+    if registre is not None:
+        return registre.indices_nn(ids)
+    mapping = model_infos["dict_mapp_index"]
+    return np.array([mapping.get(id, 0) for id in ids], dtype=np.int64)
+
+
+def pad_indices(model_infos, idx, target_length=4):
+    if idx.shape[1] >= target_length:
+        return idx[:, :target_length]
+    padding = np.broadcast_to(indices_monstres(model_infos, [0]), (idx.shape[0], target_length - idx.shape[1]))
+    return np.concatenate((idx, padding), axis=1)
+
+
+def repeter(idx, n):
+    #équipe (k,) -> (n,k), l'équivalent de expand
+    return np.broadcast_to(idx, (n,) + idx.shape)
+
+
+def probas_batch(model, model_infos, idx_A, idx_B):
+    #une seule passe pour toutes les lignes, avec le même cache (nn_cache.CacheEvaluations) et les mêmes clés que my_model
+    cache = getattr(model, "cache", None)
+    if cache is None:
+        return probas_reseau(model, model_infos, idx_A, idx_B)
+
+    def calcul(lignes):
+        return probas_reseau(model, model_infos, idx_A[lignes], idx_B[lignes]).tolist()
+
+    return np.array(cache.evaluer(cles_cache(idx_A, idx_B), calcul), dtype=np.float32)
+
+
+def cles_cache(idx_A, idx_B):
+    return list(zip(map(tuple, np.sort(idx_A, axis=1).tolist()), map(tuple, np.sort(idx_B, axis=1).tolist())))
+
+
+def probas_reseau(model, model_infos, idx_A, idx_B):
+    PASSES_RESEAU.inc(moteur="numpy")
+    LIGNES_PASSE.observer(idx_A.shape[0], moteur="numpy")
+    logits = model.forward_indices(idx_A, idx_B)
+    a,b = model_infos["calibration_proba"]
+    return 1. / (1. + np.exp(-(a * logits + b)))
+
+
+def predict(model,model_infos,joueur_A,joueur_B):
+    idx_A = indices_monstres(model_infos, pad_list(joueur_A, 4))[None]
+    idx_B = indices_monstres(model_infos, pad_list(joueur_B, 4))[None]
+    return float(probas_batch(model, model_infos, idx_A, idx_B)[0])
+
+
+def predict_one(model,model_infos,joueur_A,joueur_B,joueurA_available):
+    logger.debug("predict_one")
+    if len(joueurA_available)==0:
+        return 0,0.
+    reco = recommandation_livre(model, model_infos, joueur_A, joueur_B, joueurA_available, False)
+    if reco is not None:
+        return reco
+    n = len(joueurA_available)
+    idx_A = pad_indices(model_infos, indices_monstres(model_infos, joueurA_available)[:, None], 4)
+    idx_B = repeter(indices_monstres(model_infos, pad_list(joueur_B, 4)), n)
+    probas = probas_batch(model, model_infos, idx_A, idx_B)
+    best = int(probas.argmax())
+    return joueurA_available[best],float(probas[best])
+
+
+def probas_avec_paires(model,model_infos,joueur_A,joueur_B,joueurA_available,all_pairs):
+    idx_paires = indices_monstres(model_infos, joueurA_available)[np.array(all_pairs)]
+    idx_A = np.concatenate((repeter(indices_monstres(model_infos, joueur_A), len(all_pairs)), idx_paires), axis=1)
+    idx_A = pad_indices(model_infos, idx_A, 4)
+    idx_B = repeter(indices_monstres(model_infos, pad_list(joueur_B, 4)), len(all_pairs))
+    return probas_batch(model, model_infos, idx_A, idx_B)
+
+
+def predict_two_complete(model,model_infos,joueur_A,joueur_B,joueurA_available):
+    logger.debug("predict_two_complete")
+    n = len(joueurA_available)
+    all_pairs = list(combinations(range(n), 2) if len(joueur_A)<=2 else permutations(range(n), 2))
+    if len(all_pairs)==0:
+        return 0,0,0.
+    reco = recommandation_livre(model, model_infos, joueur_A, joueur_B, joueurA_available, True) if len(joueur_A)<=2 else None
+    if reco is not None:
+        return reco
+    probas = probas_avec_paires(model, model_infos, joueur_A, joueur_B, joueurA_available, all_pairs)
+    best = int(probas.argmax())
+    i1,i2 = all_pairs[best]
+    return joueurA_available[i1],joueurA_available[i2],float(probas[best])
+
+
+def predict_top_paires(model,model_infos,joueur_A,joueur_B,joueurA_available,k=5):
+    logger.debug("predict_top_paires")
+    all_pairs = list(combinations(range(len(joueurA_available)), 2))
+    if len(all_pairs)==0:
+        return []
+    probas = probas_avec_paires(model, model_infos, joueur_A, joueur_B, joueurA_available, all_pairs)
+    k = min(k, len(all_pairs))
+    top = np.argpartition(-probas, k-1)[:k]
+    top = top[np.argsort(-probas[top], kind="stable")]
+    return [(joueurA_available[all_pairs[i][0]],joueurA_available[all_pairs[i][1]],float(probas[i])) for i in top]
+
+
+def predict_one_contrainte(model,model_infos,joueur_A,joueur_B,joueurA_available):
+    #grille (candidat, ban de B, ban de A) : A choisit le ban sur B, B choisit le pire ban sur A
+    logger.debug("predict_one_contrainte")
+    n = len(joueurA_available)
+    if n==0:
+        return 0,0.
+    equipes_A = np.concatenate((repeter(indices_monstres(model_infos, joueur_A), n), indices_monstres(model_infos, joueurA_available)[:, None]), axis=1)
+    equipe_B = indices_monstres(model_infos, joueur_B)
+    idx_A = np.broadcast_to(equipes_A[:, SANS_UN][:, None], (n, 5, 5, 4)).reshape(-1, 4)
+    idx_B = np.broadcast_to(equipe_B[SANS_UN].reshape(1, 5, 1, 4), (n, 5, 5, 4)).reshape(-1, 4)
+    probas = probas_batch(model, model_infos, idx_A, idx_B).reshape(n, 5, 5)
+    proba_pire_cas = probas.min(axis=2).max(axis=1)
+    best = int(proba_pire_cas.argmax())
+    return joueurA_available[best],float(proba_pire_cas[best])
+
+
+def predict_two_contrainte(model,model_infos,joueur_A,joueur_B,joueurA_available):
+    logger.debug("predict_two_contrainte")
+    all_pairs = list(combinations(range(len(joueurA_available)), 2))
+    if len(all_pairs)==0:
+        return 0,0,0.
+    n = len(all_pairs)
+    idx_paires = indices_monstres(model_infos, joueurA_available)[np.array(all_pairs)]
+    equipes_A = np.concatenate((repeter(indices_monstres(model_infos, joueur_A), n), idx_paires), axis=1)
+    idx_A = equipes_A[:, SANS_UN].reshape(-1, 4)
+    idx_B = repeter(indices_monstres(model_infos, pad_list(joueur_B, 4)), n*5)
+    probas = probas_batch(model, model_infos, idx_A, idx_B).reshape(n, 5)
+    proba_pire_cas = probas.min(axis=1)
+    best = int(proba_pire_cas.argmax())
+    i1,i2 = all_pairs[best]
+    return joueurA_available[i1],joueurA_available[i2],float(proba_pire_cas[best])
+
+
+def predict_ban(model,model_infos,joueur_A,joueur_B):
+    logger.debug("predict_ban")
+    equipe_A = indices_monstres(model_infos, joueur_A)
+    equipe_B = indices_monstres(model_infos, joueur_B)
+    idx_A = np.broadcast_to(equipe_A[SANS_UN][None], (5, 5, 4)).reshape(-1, 4)
+    idx_B = np.broadcast_to(equipe_B[SANS_UN][:, None], (5, 5, 4)).reshape(-1, 4)
+    probas = probas_batch(model, model_infos, idx_A, idx_B).reshape(5, 5)
+    proba_pire_cas = probas.min(axis=1)
+    best = int(proba_pire_cas.argmax())
+    return joueur_B[best],float(proba_pire_cas[best])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pt", default="modele_predic_2.pt")
+    parser.add_argument("--npz", default="modele_predic_2.npz")
+    args = parser.parse_args()
+    exporter(args.pt, args.npz)
+    print("Modèle exporté dans " + args.npz)
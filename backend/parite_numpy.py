@@ -0,0 +1,85 @@
+# backend/parite_numpy.py
+#vérifie que le moteur numpy donne les mêmes résultats que le réseau torch
+#usage : python parite_numpy.py [--pt modele_predic_2.pt] [--npz modele_predic_2.npz] [--drafts 50]
+#exporte le .npz s'il n'existe pas, compare les probas sur des lots d'indices au hasard (doublons compris)
+#puis chaque predict_* sur des drafts au hasard, et donne le temps de démarrage du moteur numpy
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import numpy as np
+import numpy_model
+
+TOLERANCE = 1e-5
+
+
+def separer(resultat):
+    #(ids..., proba), proba seule, ou liste de (id1, id2, proba) -> (ids, probas)
+    if isinstance(resultat, list):
+        return [r[:-1] for r in resultat], [r[-1] for r in resultat]
+    if isinstance(resultat, tuple):
+        return resultat[:-1], [resultat[-1]]
+    return (), [resultat]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pt", default="modele_predic_2.pt")
+    parser.add_argument("--npz", default="modele_predic_2.npz")
+    parser.add_argument("--drafts", type=int, default=50)
+    args = parser.parse_args()
+    if not os.path.exists(args.npz):
+        numpy_model.exporter(args.pt, args.npz)
+    debut = time.perf_counter()
+    model_np, infos_np = numpy_model.charger_npz(args.npz)
+    print(f"chargement numpy : {(time.perf_counter() - debut) * 1000:.1f} ms, .npz {os.path.getsize(args.npz) / 1e6:.2f} Mo")
+
+    import torch
+    import my_model
+    from main import SimpleDraftModel_sparse
+    model_infos = torch.load(args.pt, map_location="cpu")
+    input_dim,layers = model_infos["modele_name_and_param"]
+    model = SimpleDraftModel_sparse(input_dim,layers)
+    model.load_state_dict(model_infos["modele_nn"])
+    model.eval()
+    model.preparer()
+
+    rng = random.Random(0)
+    idx_A = np.array([[rng.randrange(input_dim) for _ in range(4)] for _ in range(2000)])
+    idx_B = np.array([[rng.choice([0, rng.randrange(input_dim)]) for _ in range(4)] for _ in range(2000)])
+    p_torch = my_model.passe_reseau(model, model_infos, torch.from_numpy(idx_A), torch.from_numpy(idx_B)).numpy()
+    p_numpy = numpy_model.probas_reseau(model_np, infos_np, idx_A, idx_B)
+    ecart = float(np.abs(p_torch - p_numpy).max())
+    print(f"probas : écart max {ecart:.2e} sur {len(idx_A)} lignes")
+
+    ids = [id for id in model_infos["dict_mapp_index"] if id != 0]
+    erreurs = 0
+    egalites = 0
+    for _ in range(args.drafts):
+        pool = rng.sample(ids, 30)
+        dispo, A, B = pool[:12], pool[12:17], pool[17:22]
+        cas = [("predict", (A[:2], B[:3])), ("predict_one", ([], [], dispo)), ("predict_two_complete", (A[:1], B[:2], dispo)),
+               ("predict_two_complete", (A[:3], B[:3], dispo)), ("predict_one_contrainte", (A[:4], B, dispo)),
+               ("predict_two_contrainte", (A[:3], B[:4], dispo)), ("predict_ban", (A, B)),
+               ("predict_top_paires", (A[:1], B[:2], dispo))]
+        for nom, arguments in cas:
+            with contextlib.redirect_stdout(io.StringIO()):
+                r_torch = getattr(my_model, nom)(model, model_infos, *arguments)
+                r_numpy = getattr(my_model, nom)(model_np, infos_np, *arguments)  #passe par selon_moteur
+            ids_torch, probas_torch = separer(r_torch)
+            ids_numpy, probas_numpy = separer(r_numpy)
+            if len(probas_torch) != len(probas_numpy) or np.abs(np.subtract(probas_torch, probas_numpy)).max() > TOLERANCE:
+                erreurs += 1
+                print("différence", nom, r_torch, r_numpy)
+            elif ids_torch != ids_numpy:
+                #même proba, autre monstre : candidats à égalité (ex. le pire ban de B retire le candidat lui-même)
+                egalites += 1
+    print(f"predict_* : {erreurs} différence(s) sur {args.drafts * len(cas)} appels ({egalites} égalité(s) départagée(s) autrement)")
+    sys.exit(1 if erreurs or ecart > TOLERANCE else 0)
+
+
+if __name__ == "__main__":
+    main()
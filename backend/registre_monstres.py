@@ -0,0 +1,137 @@
+# backend/registre_monstres.py
+#registre compact des monstres partagé par le réseau, le LLM et l'API : tableaux numpy à la place du json complet
+#(monsters_rta.json : skills, descriptions...) gardé en dict juste pour lire les noms
+#- position d'un id : table dense id -> position + 1 (0 = inconnu), sans dict ni conversion str/int par requête
+#- index du réseau (dict_mapp_index) : table dense id -> index, et nom par position
+#les tables denses finissent par un 0 : np.take(..., mode="clip") envoie les ids hors table (négatifs ou trop grands)
+#sur une case nulle, une seule opération numpy par liste d'ids
+#- tokens de chaque id (ceux forcés après " M" par le trie du LLM), calculés une fois au chargement du LLM
+#- bitsets de disponibilité (tableau bool par position)
+#la partie tirée du json et du mapping est gardée dans un .npz, reconstruite quand le hash de l'un des deux change
+#usage : python registre_monstres.py [--monstres monsters_rta.json] [--modele modele_predic_2.pt|.npz] [--sortie cache/registre_monstres.npz]
+import argparse
+import json
+import logging
+import os
+import time
+import numpy as np
+from empreintes import hash_fichier, hash_mapping
+
+logger = logging.getLogger(__name__)
+
+
+def compiler(liste, mapping):
+    #liste : contenu de monsters_rta.json
+    #un id en double dans le json : la dernière entrée gagne, comme le dict {id: monstre} d'avant
+    monstres = {monstre["id"]: monstre.get("name", str(monstre["id"])) for monstre in liste}
+    #les ids du réseau absents du json sont gardés (sans nom) : indices_nn doit rester identique à dict_mapp_index
+    hors_json = [id for id in mapping if id != 0 and id not in monstres]
+    ids = np.array(list(monstres) + hors_json, dtype=np.int64)
+    return {"ids": ids, "noms": np.array(list(monstres.values()) + [str(id) for id in hors_json], dtype=str),
+            "index_nn": np.array([mapping.get(id, 0) for id in ids.tolist()], dtype=np.int32),
+            "json": np.arange(len(ids)) < len(monstres)}
+
+
+class RegistreMonstres:
+    def __init__(self, tableaux, meta=None):
+        self.ids = tableaux["ids"]
+        self.noms = tableaux["noms"]
+        self.index_nn = tableaux["index_nn"]
+        self.json = tableaux["json"]           #monstre présent dans monsters_rta.json (avec un nom)
+        self.meta = meta or {}
+        taille = int(self.ids.max()) + 2 if len(self.ids) else 1
+        self.position = np.zeros(taille, dtype=np.int32)
+        self.position[self.ids] = np.arange(1, len(self.ids) + 1, dtype=np.int32)
+        self.index_par_id = np.zeros(taille, dtype=np.int64)
+        self.index_par_id[self.ids] = self.index_nn
+        #monstres du json connus du réseau (pool de B pour /draft-search)
+        self.ids_nn = self.ids[(self.index_nn != 0) & self.json].tolist()
+        self.tokens = None          #tokens de chaque id, liste de listes par position (tokeniser)
+        self.tokenizer = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        #comme `id in monsters` : monstre du json
+        return 0 < id < len(self.position) and self.position[id] != 0 and bool(self.json[self.position[id] - 1])
+
+    def positions(self, ids):
+        #ids (int) -> positions dans le registre, -1 si inconnu
+        return np.take(self.position, np.asarray(ids, dtype=np.int64), mode="clip") - 1
+
+    def nom(self, id):
+        return str(self.noms[self.position[id] - 1]) if id in self else str(id)
+
+    def noms_connus(self, ids):
+        #noms des ids connus, les inconnus sont ignorés (comme noms_monstres d'avant)
+        return [str(self.noms[p]) for p in self.positions(ids).tolist() if p >= 0 and self.json[p]]
+
+    def indices_nn(self, ids):
+        #même chose que [dict_mapp_index.get(id, 0) for id in ids], en un seul accès vectorisé
+        return np.take(self.index_par_id, np.asarray(ids, dtype=np.int64), mode="clip")
+
+    def disponibles(self, ids):
+        #bitset des ids disponibles (tableau bool par position)
+        dispo = np.zeros(len(self.ids), dtype=bool)
+        positions = self.positions(ids)
+        dispo[positions[positions >= 0]] = True
+        return dispo
+
+    def tokeniser(self, tokenizer):
+        #tokens de chaque id, en un seul appel batch du tokenizer ; on ne les garde pas sur disque :
+        #vérifier le hash du vocabulaire coûterait autant que les recalculer
+        self.tokens = tokenizer([str(id) for id in self.ids.tolist()], add_special_tokens=False)["input_ids"]
+        self.tokenizer = tokenizer
+        return self
+
+    def tokens_id(self, id):
+        #tokens d'un id (int ou str), tokenisé à la volée s'il n'est pas dans le registre
+        id = int(id)
+        position = self.position[id] - 1 if 0 < id < len(self.position) else -1
+        if position < 0:
+            return self.tokenizer.encode(str(id), add_special_tokens=False)
+        return self.tokens[position]
+
+
+def charger(chemin_monstres, mapping, chemin_cache="registre_monstres.npz", recompiler=False):
+    #registre depuis le cache .npz s'il a été construit avec le même json et le même mapping, sinon compilé et sauvé
+    meta = {"hash_monstres": hash_fichier(chemin_monstres), "hash_mapping": hash_mapping(mapping)}
+    if chemin_cache and not recompiler:
+        try:
+            with open(chemin_cache + ".json") as f:
+                meta_cache = json.load(f)
+            if {cle: meta_cache.get(cle) for cle in meta} == meta:
+                with np.load(chemin_cache) as npz:
+                    return RegistreMonstres({nom: npz[nom] for nom in npz.files}, meta_cache)
+        except (OSError, ValueError):
+            pass
+    debut = time.perf_counter()
+    with open(chemin_monstres) as f:
+        tableaux = compiler(json.load(f), mapping)
+    meta["duree_s"] = round(time.perf_counter() - debut, 3)
+    if chemin_cache:
+        os.makedirs(os.path.dirname(chemin_cache) or ".", exist_ok=True)
+        temporaire = chemin_cache + ".tmp.npz"
+        np.savez(temporaire, **tableaux)
+        os.replace(temporaire, chemin_cache)
+        with open(chemin_cache + ".json", "w") as f:
+            json.dump(meta, f)
+    logger.info("Registre des monstres compilé en %s s (%s monstres)", meta["duree_s"], len(tableaux["ids"]))
+    return RegistreMonstres(tableaux, meta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--monstres", default="monsters_rta.json")
+    parser.add_argument("--modele", default="modele_predic_2.pt")
+    parser.add_argument("--sortie", default=os.path.join(os.environ.get("DOSSIER_CACHE", "cache"), "registre_monstres.npz"))
+    args = parser.parse_args()
+    if args.modele.endswith(".npz"):
+        import numpy_model
+        _, model_infos = numpy_model.charger_npz(args.modele)
+    else:
+        import torch
+        model_infos = torch.load(args.modele, map_location="cpu")
+    registre = charger(args.monstres, model_infos["dict_mapp_index"], args.sortie, True)
+    print(f"Registre écrit dans {args.sortie} : {len(registre)} monstres, {len(registre.ids_nn)} connus du réseau, {registre.meta}")
@@ -0,0 +1,96 @@
+# backend/scheduler.py
+#micro-batching des requêtes : les endpoints ne font plus tourner torch sur la boucle asyncio,
+#ils déposent leur DraftState dans une file et attendent leur résultat
+#la boucle du batcher regroupe les requêtes arrivées pendant une courte fenêtre (ou jusqu'à taille_max)
+#et traite le lot d'un coup dans un thread dédié (ou plusieurs lots en parallèle avec le pool de workers)
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from my_model import contexte, FusionPasses
+from metriques import TAILLE_LOTS
+
+
+class MicroBatcher:
+    def __init__(self, traiter, fenetre_ms=10, taille_max=16, nom="batch", paralleles=1):
+        #traiter(liste de requêtes) -> liste de résultats (ou d'exceptions) dans le même ordre, appelé dans un thread
+        #paralleles : nombre de lots traités en même temps (1 en process unique, le nombre de workers en mode superviseur)
+        self.traiter = traiter
+        self.fenetre = fenetre_ms / 1000
+        self.taille_max = taille_max
+        self.nom = nom
+        self.paralleles = paralleles
+        self.executor = ThreadPoolExecutor(max_workers=paralleles, thread_name_prefix=nom)
+        self.file = None
+        self.places = None
+        self.lots_en_cours = set()
+        self.tache = None
+        self.lots = 0
+        self.requetes = 0
+
+    def demarrer(self):
+        #à appeler depuis la boucle asyncio (startup de l'app)
+        self.file = asyncio.Queue()
+        self.places = asyncio.Semaphore(self.paralleles)
+        self.tache = asyncio.create_task(self.boucle())
+
+    async def soumettre(self, requete):
+        future = asyncio.get_running_loop().create_future()
+        await self.file.put((requete, future))
+        return await future
+
+    async def boucle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            #tant que tous les lots en cours ne sont pas finis, les requêtes s'accumulent dans la file
+            await self.places.acquire()
+            lot = [await self.file.get()]
+            fin = loop.time() + self.fenetre
+            while len(lot) < self.taille_max:
+                reste = fin - loop.time()
+                if reste <= 0:
+                    break
+                try:
+                    lot.append(await asyncio.wait_for(self.file.get(), reste))
+                except asyncio.TimeoutError:
+                    break
+            self.lots += 1
+            self.requetes += len(lot)
+            TAILLE_LOTS.observer(len(lot), file=self.nom)
+            tache = asyncio.create_task(self.executer_lot(lot))
+            self.lots_en_cours.add(tache)
+            tache.add_done_callback(self.lots_en_cours.discard)
+
+    async def executer_lot(self, lot):
+        try:
+            resultats = await asyncio.get_running_loop().run_in_executor(self.executor, self.traiter, [r for r, _ in lot])
+        except Exception as erreur:
+            resultats = [erreur] * len(lot)
+        finally:
+            self.places.release()
+        for (_, future), resultat in zip(lot, resultats):
+            if future.done():
+                continue
+            if isinstance(resultat, BaseException):
+                future.set_exception(resultat)
+            else:
+                future.set_result(resultat)
+
+    def stats(self):
+        return {"lots": self.lots, "requetes": self.requetes,
+                "taille_moyenne": self.requetes / self.lots if self.lots else 0.}
+
+
+def executer_avec_fusion(pool, fonction, requetes):
+    #chaque requête dans son thread, leurs passes du réseau sont fusionnées (voir my_model.FusionPasses)
+    fusion = FusionPasses(len(requetes))
+
+    def executer(requete):
+        contexte.fusion = fusion
+        try:
+            return fonction(requete)
+        except Exception as erreur:
+            return erreur
+        finally:
+            contexte.fusion = None
+            fusion.fin_participant()
+
+    return list(pool.map(executer, requetes))
@@ -0,0 +1,153 @@
+# backend/sessions_draft.py
+#sessions de draft côté serveur : le client ouvre une session avec le DraftState initial, puis n'envoie à chaque tour
+#que les nouveaux picks et bans (DeltaDraft) ; la session garde l'état complet, les candidats restants de A
+#et le KV cache du dernier prompt du LLM, repris au tour suivant au plus long préfixe commun (voir debut_decodage)
+#éviction : une session inactive depuis plus de ttl_s est supprimée ; au-delà du budget mémoire, les KV caches
+#des sessions les moins récemment utilisées sont libérés (la session reste valide, son prochain tour repart du préfixe)
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class DeltaDraft(BaseModel):
+    #ajouts du tour, les champs absents ne changent rien
+    playerAPicks: List[int] = Field(default_factory=list)
+    playerBPicks: List[int] = Field(default_factory=list)
+    playerABans: List[int] = Field(default_factory=list)
+    playerBBans: List[int] = Field(default_factory=list)
+    currentPhase: Optional[str] = None
+    playerBPossibleCounter: Optional[List[int]] = None
+
+
+def sans_joues(dispo, etat):
+    #un monstre pické (par A ou B) ou banni ne peut plus être proposé à A
+    joues = set(etat.playerAPicks + etat.playerBPicks + etat.playerABans + etat.playerBBans)
+    return [id for id in dispo if id not in joues]
+
+
+class SessionDraft:
+    def __init__(self, identifiant, draft_state):
+        self.id = identifiant
+        self.etat = draft_state.model_copy(deep=True)
+        self.etat.playerAAvailableIds = sans_joues(self.etat.playerAAvailableIds, self.etat)
+        self.kv = {"ids": [], "cache": None}    #KV cache du dernier prompt du LLM (lll_fine_tuned.debut_decodage)
+        self.taille_kv = 0
+        self.tours = 0
+        self.dernier_acces = time.monotonic()
+        #un seul calcul à la fois par session : le KV cache est modifié sur place
+        self.verrou = threading.Lock()
+
+    def appliquer(self, delta):
+        for champ in ("playerAPicks", "playerBPicks", "playerABans", "playerBBans"):
+            getattr(self.etat, champ).extend(id for id in getattr(delta, champ) if id not in getattr(self.etat, champ))
+        if delta.currentPhase is not None:
+            self.etat.currentPhase = delta.currentPhase
+        if delta.playerBPossibleCounter is not None:
+            self.etat.playerBPossibleCounter = list(delta.playerBPossibleCounter)
+        self.etat.playerAAvailableIds = sans_joues(self.etat.playerAAvailableIds, self.etat)
+        self.tours += 1
+
+    def draft_state(self):
+        #copie de l'état pour les calculs hors du verrou (micro-batcher, workers)
+        return self.etat.model_copy(deep=True)
+
+    def resume(self):
+        return {"session": self.id, "tours": self.tours, "kv_tokens": len(self.kv["ids"]) if self.kv["cache"] is not None else 0,
+                "kv_octets": self.taille_kv, "etat": self.etat.model_dump()}
+
+
+class GestionnaireSessions:
+    #sessions par ordre d'utilisation (la moins récente en premier), comme le LRU de nn_cache
+    #taille_kv(cache) -> octets, fournie par l'appelant (lll_fine_tuned.taille_cache) : ce module n'importe pas torch
+    def __init__(self, ttl_s=900, budget_octets=512 * 2**20, taille_max=10_000, taille_kv=None):
+        self.ttl = ttl_s
+        self.budget = budget_octets
+        self.taille_max = taille_max
+        self.taille_kv = taille_kv or (lambda cache: 0)
+        self.sessions = OrderedDict()
+        self.verrou = threading.Lock()
+        self.ouvertes = 0
+        self.expirees = 0
+        self.evictions = 0          #sessions supprimées au-delà de taille_max
+        self.kv_liberes = 0         #KV caches libérés pour tenir le budget
+
+    def ouvrir(self, draft_state):
+        session = SessionDraft(secrets.token_urlsafe(12), draft_state)
+        with self.verrou:
+            self.purger()
+            self.sessions[session.id] = session
+            self.ouvertes += 1
+            while len(self.sessions) > self.taille_max:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+        return session
+
+    def obtenir(self, identifiant):
+        #KeyError si la session n'existe pas ou a expiré
+        with self.verrou:
+            self.purger()
+            session = self.sessions[identifiant]
+            self.sessions.move_to_end(identifiant)
+            session.dernier_acces = time.monotonic()
+            return session
+
+    def fermer(self, identifiant):
+        with self.verrou:
+            return self.sessions.pop(identifiant, None) is not None
+
+    def purger(self):
+        #appelé avec le verrou : les sessions expirées sont toutes en tête
+        limite = time.monotonic() - self.ttl
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.dernier_acces > limite:
+                break
+            self.sessions.popitem(last=False)
+            self.expirees += 1
+
+    def mesurer(self, session):
+        #après un calcul du LLM (verrou de la session relâché) : taille du KV cache de la session, puis budget
+        session.taille_kv = self.taille_kv(session.kv["cache"])
+        with self.verrou:
+            total = sum(s.taille_kv for s in self.sessions.values())
+            for autre in list(self.sessions.values()):
+                if total <= self.budget:
+                    break
+                #une session en plein calcul garde son cache
+                if autre.taille_kv == 0 or not autre.verrou.acquire(blocking=False):
+                    continue
+                try:
+                    total -= autre.taille_kv
+                    autre.kv = {"ids": [], "cache": None}
+                    autre.taille_kv = 0
+                    self.kv_liberes += 1
+                finally:
+                    autre.verrou.release()
+
+    def stats(self):
+        with self.verrou:
+            self.purger()
+            return {
+                "sessions": len(self.sessions),
+                "taille_max": self.taille_max,
+                "ttl_s": self.ttl,
+                "kv_octets": sum(s.taille_kv for s in self.sessions.values()),
+                "budget_octets": self.budget,
+                "ouvertes": self.ouvertes,
+                "expirees": self.expirees,
+                "evictions": self.evictions,
+                "kv_liberes": self.kv_liberes,
+            }
+
+    def metriques(self):
+        #collecteur de metriques.registre
+        stats = self.stats()
+        return [("sessions_draft", "gauge", "Sessions de draft ouvertes", stats["sessions"]),
+                ("sessions_draft_kv_octets", "gauge", "Octets des KV caches gardés par les sessions", stats["kv_octets"]),
+                ("sessions_draft_ouvertes_total", "counter", "Sessions de draft ouvertes", stats["ouvertes"]),
+                ("sessions_draft_expirees_total", "counter", "Sessions supprimées après ttl_s d'inactivité", stats["expirees"]),
+                ("sessions_draft_evictions_total", "counter", "Sessions supprimées au-delà du nombre max", stats["evictions"]),
+                ("sessions_draft_kv_liberes_total", "counter", "KV caches libérés pour tenir le budget mémoire", stats["kv_liberes"])]
@@ -0,0 +1,207 @@
+# backend/synergies.py
+#synergies et contres entre monstres (win rates RTA de webapp/monsters_pairs_id.json) et stats moyennes
+#(webapp/average_monster_stats_id.json), compilées en matrices numpy denses indexées comme dict_mapp_index
+#synergie[i, j] : win rate ensemble - 50 (symétrique), contre[i, j] : win rate de i contre j - 50 (antisymétrique)
+#0 pour une paire inconnue ; la ligne et la colonne 0 (padding, monstre inconnu du réseau) restent nulles,
+#les sommes sur des équipes paddées n'ont donc pas besoin de masque
+#la compilation est gardée dans un .npz, recompilée quand le hash des deux json ou du mapping change
+#usage : python synergies.py [--paires monsters_pairs_id.json] [--stats average_monster_stats_id.json]
+#                            [--modele modele_predic_2.pt] [--sortie cache/synergies.npz]
+import argparse
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+from empreintes import hash_fichier, hash_mapping
+
+logger = logging.getLogger(__name__)
+
+STATS = ("HP", "ATK", "DEF", "SPD", "CRate", "CDmg", "RES", "ACC")
+
+
+def trouver(chemin):
+    #comme loadJsonFile du webapp : le chemin tel quel, sinon le fichier du même nom dans ../webapp
+    if os.path.exists(chemin):
+        return chemin
+    autre = os.path.join("..", "webapp", os.path.basename(chemin))
+    return autre if os.path.exists(autre) else None
+
+
+def valeur_stat(texte):
+    #"11040 + 20838" -> 31878 (base + runes, comme sumStats du webapp), "27 %" -> 27
+    nombres = re.findall(r"-?\d+(?:\.\d+)?", str(texte))
+    return sum(float(n) for n in nombres) if nombres else np.nan
+
+
+def compiler(chemin_paires, chemin_stats, mapping, taille):
+    #-> dict de tableaux numpy (synergie, contre, connu, stats, runes)
+    with open(chemin_paires) as f:
+        paires = json.load(f)
+    with open(chemin_stats) as f:
+        stats_moyennes = json.load(f)
+    synergie = np.zeros((taille, taille), dtype=np.float32)
+    contre = np.zeros((taille, taille), dtype=np.float32)
+    #nombre de fois qu'une paire est donnée (elle peut l'être dans la liste de chacun des deux monstres)
+    vus_synergie = np.zeros((taille, taille), dtype=np.int8)
+    vus_contre = np.zeros((taille, taille), dtype=np.int8)
+    for id, infos in paires.items():
+        i = mapping.get(int(id), 0)
+        if i == 0:
+            continue
+        for paire in infos.get("best_with") or []:
+            j = mapping.get(paire["b_monster_id"], 0)
+            if j != 0 and j != i:
+                synergie[[i, j], [j, i]] += paire["win_together_rate"] - 50
+                vus_synergie[[i, j], [j, i]] += 1
+        for paire in infos.get("bad_against") or []:
+            j = mapping.get(paire["b_monster_id"], 0)
+            if j != 0 and j != i:
+                ecart = paire["win_against_rate"] - 50
+                contre[[i, j], [j, i]] += (ecart, -ecart)
+                vus_contre[[i, j], [j, i]] += 1
+    np.divide(synergie, vus_synergie, out=synergie, where=vus_synergie > 0)
+    np.divide(contre, vus_contre, out=contre, where=vus_contre > 0)
+
+    stats = np.full((taille, len(STATS)), np.nan, dtype=np.float32)
+    runes = np.full(taille, "", dtype=object)
+    for id, infos in stats_moyennes.items():
+        i = mapping.get(int(id), 0)
+        if i != 0:
+            stats[i] = [valeur_stat(infos.get(nom)) for nom in STATS]
+            runes[i] = infos.get("Set1", "")
+    return {"synergie": synergie, "contre": contre, "connu_synergie": vus_synergie > 0, "connu_contre": vus_contre > 0,
+            "stats": stats, "runes": runes.astype(str)}
+
+
+class TableSynergies:
+    def __init__(self, tableaux, mapping, meta):
+        self.synergie = tableaux["synergie"]
+        self.contre = tableaux["contre"]
+        self.connu_synergie = tableaux["connu_synergie"]
+        self.connu_contre = tableaux["connu_contre"]
+        self.stats = tableaux["stats"]
+        self.runes = tableaux["runes"]
+        self.mapping = mapping
+        self.meta = meta
+
+    def indices(self, listes, longueur=None):
+        #listes d'ids (longueurs différentes) -> indices (D, longueur) paddés avec 0
+        longueur = longueur or max([len(l) for l in listes] + [1])
+        idx = np.zeros((len(listes), longueur), dtype=np.int64)
+        for d, ids in enumerate(listes):
+            idx[d, :len(ids)] = [self.mapping.get(id, 0) for id in ids[:longueur]]
+        return idx
+
+    def scorer(self, equipes_A, equipes_B, candidats):
+        #tout le lot en une fois : D drafts, équipes et candidats paddés avec l'indice 0 (lignes nulles)
+        #équipes : synergie interne (somme sur les paires) et pression sur l'adversaire (somme des contres)
+        #candidats de A : synergie avec l'équipe de A, contre sur l'équipe de B, score = somme des deux
+        A, B, C = self.indices(equipes_A, 5), self.indices(equipes_B, 5), self.indices(candidats)
+        haut = np.triu(np.ones((5, 5), dtype=bool), 1)
+        resultats = {
+            "synergie_A": (self.synergie[A[:, :, None], A[:, None, :]] * haut).sum(axis=(1, 2)),
+            "paires_A": (self.connu_synergie[A[:, :, None], A[:, None, :]] & haut).sum(axis=(1, 2)),
+            "synergie_B": (self.synergie[B[:, :, None], B[:, None, :]] * haut).sum(axis=(1, 2)),
+            "paires_B": (self.connu_synergie[B[:, :, None], B[:, None, :]] & haut).sum(axis=(1, 2)),
+            "pression_A": self.contre[A[:, :, None], B[:, None, :]].sum(axis=(1, 2)),
+            "contres_AB": self.connu_contre[A[:, :, None], B[:, None, :]].sum(axis=(1, 2)),
+            "synergie_candidats": self.synergie[C[:, :, None], A[:, None, :]].sum(axis=2),
+            "contre_candidats": self.contre[C[:, :, None], B[:, None, :]].sum(axis=2),
+        }
+        resultats["score_candidats"] = resultats["synergie_candidats"] + resultats["contre_candidats"]
+        return resultats
+
+    def contexte(self, registre, draft_states, k=5):
+        #une réponse par draft : scores des équipes, k meilleurs candidats et le bloc texte compact pour le prompt
+        scores = self.scorer([d.playerAPicks for d in draft_states], [d.playerBPicks for d in draft_states],
+                             [d.playerAAvailableIds for d in draft_states])
+        reponses = []
+        for r, d in enumerate(draft_states):
+            n = len(d.playerAAvailableIds)
+            ordre = np.argsort(-scores["score_candidats"][r, :n], kind="stable")[:k]
+            candidats = []
+            for c in ordre.tolist():
+                id = d.playerAAvailableIds[c]
+                index = self.mapping.get(id, 0)
+                stats = self.stats[index]
+                candidats.append({"id": id, "name": registre.nom(id), "score": round(float(scores["score_candidats"][r, c]), 2),
+                                  "synergie": round(float(scores["synergie_candidats"][r, c]), 2),
+                                  "contre": round(float(scores["contre_candidats"][r, c]), 2),
+                                  "stats": {s: float(v) for s, v in zip(STATS, stats) if not np.isnan(v)},
+                                  "runes": str(self.runes[index])})
+            equipes = {
+                "A": {"synergie": round(float(scores["synergie_A"][r]), 2), "paires_connues": int(scores["paires_A"][r]),
+                      "pression": round(float(scores["pression_A"][r]), 2)},
+                "B": {"synergie": round(float(scores["synergie_B"][r]), 2), "paires_connues": int(scores["paires_B"][r]),
+                      "pression": round(-float(scores["pression_A"][r]), 2) + 0.},
+                "contres_connus": int(scores["contres_AB"][r]),
+            }
+            reponses.append({"equipes": equipes, "candidats": candidats, "texte": texte_contexte(equipes, candidats)})
+        return reponses
+
+
+def texte_contexte(equipes, candidats):
+    #bloc compact pour le prompt (écarts de win rate à 50 %, en points)
+    lignes = ["Synergies et contres (win rates RTA, écart à 50 %) :"]
+    for joueur, adverse in (("A", "B"), ("B", "A")):
+        e = equipes[joueur]
+        lignes.append(f"Équipe {joueur} : synergie {e['synergie']:+.1f} ({e['paires_connues']} paires connues), "
+                      f"pression sur {adverse} {e['pression']:+.1f}")
+    if candidats:
+        lignes.append("Candidats pour A (synergie avec A + contre de B) :")
+        for c in candidats:
+            stats = c["stats"]
+            vitesse = f", SPD {stats['SPD']:.0f}" if "SPD" in stats else ""
+            lignes.append(f"- {c['name']} : {c['score']:+.1f} (synergie {c['synergie']:+.1f}, contre {c['contre']:+.1f}{vitesse})")
+    return "\n".join(lignes)
+
+
+def charger(chemin_paires, chemin_stats, mapping, taille, chemin_cache="synergies.npz", recompiler=False):
+    #None si un des deux json est absent ; sinon la table, depuis le cache .npz s'il correspond aux mêmes sources
+    chemin_paires, chemin_stats = trouver(chemin_paires), trouver(chemin_stats)
+    if chemin_paires is None or chemin_stats is None:
+        return None
+    meta = {"hash_paires": hash_fichier(chemin_paires), "hash_stats": hash_fichier(chemin_stats),
+            "hash_mapping": hash_mapping(mapping), "taille": taille}
+    if chemin_cache and not recompiler:
+        try:
+            with open(chemin_cache + ".json") as f:
+                meta_cache = json.load(f)
+            if {cle: meta_cache.get(cle) for cle in meta} == meta:
+                with np.load(chemin_cache) as npz:
+                    return TableSynergies({nom: npz[nom] for nom in npz.files}, mapping, meta_cache)
+        except (OSError, ValueError):
+            pass
+    debut = time.perf_counter()
+    tableaux = compiler(chemin_paires, chemin_stats, mapping, taille)
+    meta["duree_s"] = round(time.perf_counter() - debut, 3)
+    if chemin_cache:
+        os.makedirs(os.path.dirname(chemin_cache) or ".", exist_ok=True)
+        temporaire = chemin_cache + ".tmp.npz"
+        np.savez(temporaire, **tableaux)
+        os.replace(temporaire, chemin_cache)
+        with open(chemin_cache + ".json", "w") as f:
+            json.dump(meta, f)
+    logger.info("Synergies compilées en %s s", meta["duree_s"])
+    return TableSynergies(tableaux, mapping, meta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paires", default="monsters_pairs_id.json")
+    parser.add_argument("--stats", default="average_monster_stats_id.json")
+    parser.add_argument("--modele", default="modele_predic_2.pt")
+    parser.add_argument("--sortie", default=os.path.join(os.environ.get("DOSSIER_CACHE", "cache"), "synergies.npz"))
+    args = parser.parse_args()
+    if args.modele.endswith(".npz"):
+        import numpy_model
+        _, model_infos = numpy_model.charger_npz(args.modele)
+    else:
+        import torch
+        model_infos = torch.load(args.modele, map_location="cpu")
+    table = charger(args.paires, args.stats, model_infos["dict_mapp_index"], model_infos["modele_name_and_param"][0], args.sortie, True)
+    if table is None:
+        raise SystemExit(f"{args.paires} ou {args.stats} introuvable")
+    print(f"Synergies écrites dans {args.sortie} : {table.meta}")
@@ -0,0 +1,393 @@
+# backend/versions_modeles.py
+#rechargement à chaud des modèles : chaque modèle ("mlp", "llm") a une version active, qui sert les requêtes,
+#et au plus une candidate, chargée en arrière-plan quand l'empreinte de ses fichiers change
+#- l'empreinte doit être la même sur deux vérifications de suite : un fichier en cours de copie n'est pas chargé
+#- la candidate est chargée et échauffée par le même chargeur qu'au démarrage, pendant que l'active continue de servir
+#- ombre (optionnelle) : une fraction des requêtes est rejouée dans un thread à part sur les deux versions,
+#  latences et accord des réponses sont gardés ; promotion automatique après requetes_ombre comparaisons
+#  si l'accord est d'au moins accord_min, sinon la candidate attend promouvoir() ou rejeter()
+#  (accord_min None : jamais de promotion automatique, seulement promouvoir())
+#- un modèle sans version active (échec au démarrage) est chargé dès que ses fichiers changent, et promu sans ombre
+#- promotion : la version active change sous le verrou, les requêtes déjà lancées gardent l'ancienne
+#  (utiliser() compte les requêtes en cours par version), libérée seulement quand son compteur retombe à 0
+import gc
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+ATTENTE_DRAIN_LOG = 60.     #secondes entre deux logs d'une version qui attend la fin de ses requêtes
+OMBRE_FILE_MAX = 4          #requêtes en attente d'être rejouées en ombre
+
+
+class Version:
+    def __init__(self, nom, numero, empreinte, objets, duree_s):
+        #objets : ce que renvoie le chargeur (model, model_infos... ), accessibles en attributs
+        vars(self).update(objets)
+        self.objets = list(objets)
+        self.nom = nom
+        self.numero = numero
+        self.empreinte = empreinte
+        self.duree_s = duree_s
+        self.chargee_le = time.time()
+        self.en_cours = 0           #requêtes qui utilisent cette version (compté sous le verrou du gestionnaire)
+
+    def liberer(self):
+        for nom in self.objets:
+            setattr(self, nom, None)
+
+    def resume(self):
+        return {"numero": self.numero, "empreinte": self.empreinte[:12], "chargee_le": self.chargee_le,
+                "duree_s": self.duree_s, "en_cours": self.en_cours}
+
+
+def centile(valeurs, q):
+    if not valeurs:
+        return None
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(q / 100 * len(valeurs)))]
+
+
+class Ombre:
+    #comparaisons active / candidate pour un modèle, par mode de requête
+    def __init__(self, numero_active, numero_candidate):
+        self.versions = (numero_active, numero_candidate)
+        self.modes = {}
+
+    def ajouter(self, mode, latence_active, latence_candidate, accord, ecart):
+        stats = self.modes.setdefault(mode, {"n": 0, "accords": 0, "ecarts": [], "active": deque(maxlen=1000),
+                                             "candidate": deque(maxlen=1000), "erreurs": 0})
+        stats["n"] += 1
+        stats["accords"] += bool(accord)
+        if ecart is not None:
+            stats["ecarts"].append(ecart)
+        stats["active"].append(latence_active)
+        stats["candidate"].append(latence_candidate)
+
+    def erreur(self, mode):
+        self.modes.setdefault(mode, {"n": 0, "accords": 0, "ecarts": [], "active": deque(maxlen=1000),
+                                     "candidate": deque(maxlen=1000), "erreurs": 0})["erreurs"] += 1
+
+    def total(self):
+        return sum(s["n"] for s in self.modes.values())
+
+    def accord(self):
+        n = self.total()
+        return sum(s["accords"] for s in self.modes.values()) / n if n else None
+
+    def resume(self):
+        modes = {}
+        for mode, s in self.modes.items():
+            p50_active, p50_candidate = centile(s["active"], 50), centile(s["candidate"], 50)
+            p99_active, p99_candidate = centile(s["active"], 99), centile(s["candidate"], 99)
+            modes[mode] = {
+                "comparaisons": s["n"], "erreurs_candidate": s["erreurs"],
+                "accord": s["accords"] / s["n"] if s["n"] else None,
+                "ecart_moyen": sum(s["ecarts"]) / len(s["ecarts"]) if s["ecarts"] else None,
+                "p50_ms": {"active": p50_active, "candidate": p50_candidate,
+                           "delta": p50_candidate - p50_active if s["n"] else None},
+                "p99_ms": {"active": p99_active, "candidate": p99_candidate,
+                           "delta": p99_candidate - p99_active if s["n"] else None},
+            }
+        return {"versions": {"active": self.versions[0], "candidate": self.versions[1]},
+                "comparaisons": self.total(), "accord": self.accord(), "modes": modes}
+
+
+class GestionnaireVersions:
+    def __init__(self, fraction_ombre=0., requetes_ombre=50, accord_min=None):
+        self.fraction_ombre = fraction_ombre
+        self.requetes_ombre = requetes_ombre
+        self.accord_min = accord_min
+        #par modèle, posés par ajouter()
+        self.chargeurs = {}         #nom -> fonction() -> dict d'objets, chargés et échauffés
+        self.empreintes = {}        #nom -> fonction() -> empreinte des fichiers du modèle
+        self.executeurs = {}        #nom -> fonction(version, requete) -> réponse (ombre)
+        self.comparateurs = {}      #nom -> fonction(réponse active, réponse candidate) -> (accord, écart ou None)
+        self.apres_promotion = {}   #nom -> fonction(version) appelée après le changement de version active
+        self.actives = {}
+        self.candidates = {}
+        self.ombres = {}            #nom -> Ombre de la candidate
+        self.en_chargement = {}     #nom -> empreinte en cours de chargement
+        self.vues = {}              #nom -> empreinte vue à la dernière vérification
+        self.ecartees = {}          #nom -> empreinte en échec ou rejetée, pas rechargée tant qu'elle ne change pas
+        self.en_drain = []          #anciennes versions qui attendent la fin de leurs requêtes
+        self.erreurs = {}
+        self.compteurs = {"rechargements": 0, "echecs": 0, "promotions": 0, "rejets": 0, "liberees": 0}
+        self.numeros = {}
+        self.verrou = threading.Lock()
+        self.termine = threading.Condition(self.verrou)     #une requête vient de rendre sa version
+        self.pool_ombre = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ombre")
+        self.ombres_en_attente = 0
+        os.register_at_fork(after_in_child=self.apres_fork)
+
+    def apres_fork(self):
+        #dans un worker forké : un thread du parent pouvait tenir le verrou au moment du fork
+        self.verrou = threading.Lock()
+        self.termine = threading.Condition(self.verrou)
+
+    def ajouter(self, nom, charger, empreinte, executer=None, comparer=None, apres_promotion=None):
+        self.chargeurs[nom] = charger
+        self.empreintes[nom] = empreinte
+        if executer is not None:
+            self.executeurs[nom] = executer
+            self.comparateurs[nom] = comparer
+        if apres_promotion is not None:
+            self.apres_promotion[nom] = apres_promotion
+
+    def creer(self, nom, empreinte):
+        debut = time.perf_counter()
+        objets = self.chargeurs[nom]()
+        with self.verrou:
+            self.numeros[nom] = self.numeros.get(nom, 0) + 1
+            numero = self.numeros[nom]
+        return Version(nom, numero, empreinte, objets, round(time.perf_counter() - debut, 2))
+
+    def charger(self, nom):
+        #chargement de démarrage (bloquant), la version devient active tout de suite
+        #en échec, l'empreinte est écartée : le watcher recharge le modèle quand ses fichiers changent
+        empreinte = self.empreintes[nom]()
+        with self.verrou:
+            self.en_chargement[nom] = empreinte
+            self.vues[nom] = empreinte
+        try:
+            version = self.creer(nom, empreinte)
+        except Exception as erreur:
+            with self.verrou:
+                self.en_chargement.pop(nom, None)
+                self.ecartees[nom] = empreinte
+                self.erreurs[nom] = repr(erreur)
+            raise
+        with self.verrou:
+            self.en_chargement.pop(nom, None)
+            self.actives[nom] = version
+        return version
+
+    def installer(self, nom, objets, empreinte=""):
+        #version active posée directement, avec des objets déjà chargés (bench.py)
+        with self.verrou:
+            self.numeros[nom] = self.numeros.get(nom, 0) + 1
+            version = self.actives[nom] = Version(nom, self.numeros[nom], empreinte, objets, 0.)
+        return version
+
+    def active(self, nom):
+        #version active sans la réserver (lectures courtes : noms, stats)
+        return self.actives.get(nom)
+
+    @contextmanager
+    def utiliser(self, nom):
+        #version active réservée le temps du bloc : une promotion pendant le bloc ne la libère pas
+        with self.verrou:
+            version = self.actives.get(nom)
+            if version is None:
+                raise RuntimeError(f"modèle {nom} pas chargé")
+            version.en_cours += 1
+        try:
+            yield version
+        finally:
+            with self.verrou:
+                version.en_cours -= 1
+                if version.en_cours == 0:
+                    self.termine.notify_all()
+
+    def verifier(self):
+        #une passe du watcher : lance le chargement des modèles dont l'empreinte a changé et s'est stabilisée,
+        #y compris ceux qui n'ont pas de version active
+        for nom in list(self.chargeurs):
+            try:
+                empreinte = self.empreintes[nom]()
+            except OSError as erreur:
+                #fichier absent (en cours de remplacement) : on regarde à la prochaine passe
+                logger.debug("Empreinte de %s illisible : %r", nom, erreur)
+                continue
+            with self.verrou:
+                stable = self.vues.get(nom) == empreinte
+                self.vues[nom] = empreinte
+                active, candidate = self.actives.get(nom), self.candidates.get(nom)
+                if (not stable or (active is not None and empreinte == active.empreinte) or nom in self.en_chargement
+                        or empreinte == self.ecartees.get(nom) or (candidate is not None and candidate.empreinte == empreinte)):
+                    continue
+                self.en_chargement[nom] = empreinte
+            threading.Thread(target=self.recharger, args=(nom, empreinte), daemon=True, name=f"rechargement-{nom}").start()
+
+    def recharger(self, nom, empreinte):
+        logger.info("Nouvelle version de %s (%s), chargement en arrière-plan", nom, empreinte[:12])
+        try:
+            version = self.creer(nom, empreinte)
+        except Exception as erreur:
+            logger.error("Échec du chargement de la nouvelle version de %s : %r, l'ancienne continue de servir", nom, erreur)
+            with self.verrou:
+                self.en_chargement.pop(nom, None)
+                self.ecartees[nom] = empreinte
+                self.erreurs[nom] = repr(erreur)
+                self.compteurs["echecs"] += 1
+            return
+        with self.verrou:
+            self.en_chargement.pop(nom, None)
+            self.erreurs.pop(nom, None)
+            self.compteurs["rechargements"] += 1
+            #sans version active, rien à comparer : promue directement
+            ombre = self.fraction_ombre > 0 and nom in self.executeurs and nom in self.actives
+            if ombre:
+                #une candidate plus ancienne encore en ombre est remplacée
+                ancienne = self.candidates.get(nom)
+                self.candidates[nom] = version
+                self.ombres[nom] = Ombre(self.actives[nom].numero, version.numero)
+        if not ombre:
+            self.promouvoir(nom, version)
+            return
+        logger.info("Version %s de %s chargée en %s s, en ombre sur %.0f %% des requêtes", version.numero, nom,
+                    version.duree_s, 100 * self.fraction_ombre)
+        if ancienne is not None:
+            self.drainer(ancienne)
+
+    def ombre(self, nom, requete):
+        #après une requête servie : rejouée sur les deux versions avec la probabilité fraction_ombre
+        #un seul thread pour l'ombre : au-delà de OMBRE_FILE_MAX requêtes en attente, les suivantes sont ignorées
+        if nom not in self.candidates or random.random() >= self.fraction_ombre:
+            return
+        with self.verrou:
+            if self.ombres_en_attente >= OMBRE_FILE_MAX:
+                return
+            self.ombres_en_attente += 1
+        self.pool_ombre.submit(self.comparer, nom, requete)
+
+    def comparer(self, nom, requete):
+        mode = requete[1] if isinstance(requete, tuple) and len(requete) > 1 else "defaut"
+        with self.verrou:
+            self.ombres_en_attente -= 1
+            candidate, ombre = self.candidates.get(nom), self.ombres.get(nom)
+            if candidate is None:
+                return
+            active = self.actives[nom]
+            active.en_cours += 1
+            candidate.en_cours += 1
+        try:
+            #même process, même thread, l'une après l'autre : les latences sont comparables
+            debut = time.perf_counter()
+            reponse_active = self.executeurs[nom](active, requete)
+            latence_active = (time.perf_counter() - debut) * 1000
+            debut = time.perf_counter()
+            try:
+                reponse_candidate = self.executeurs[nom](candidate, requete)
+            except Exception as erreur:
+                logger.warning("Ombre de %s : la version %s a échoué : %r", nom, candidate.numero, erreur)
+                with self.verrou:
+                    ombre.erreur(mode)
+                return
+            latence_candidate = (time.perf_counter() - debut) * 1000
+            accord, ecart = self.comparateurs[nom](reponse_active, reponse_candidate)
+        except Exception as erreur:
+            logger.warning("Ombre de %s : comparaison impossible : %r", nom, erreur)
+            return
+        finally:
+            with self.verrou:
+                active.en_cours -= 1
+                candidate.en_cours -= 1
+                self.termine.notify_all()
+        with self.verrou:
+            ombre.ajouter(mode, latence_active, latence_candidate, accord, ecart)
+            pret = (self.accord_min is not None and self.candidates.get(nom) is candidate
+                    and ombre.total() >= self.requetes_ombre and ombre.accord() >= self.accord_min)
+        if pret:
+            logger.info("Ombre de %s : %s comparaisons, accord %.3f, promotion de la version %s", nom, ombre.total(),
+                        ombre.accord(), candidate.numero)
+            self.promouvoir(nom, candidate)
+
+    def promouvoir(self, nom, version=None):
+        #version None : la candidate en ombre ; False si il n'y en a pas
+        with self.verrou:
+            version = version or self.candidates.get(nom)
+            if version is None or self.actives.get(nom) is version:
+                return False
+            if self.candidates.get(nom) is version:
+                del self.candidates[nom]
+            ancienne = self.actives.get(nom)
+            self.actives[nom] = version
+            self.compteurs["promotions"] += 1
+        if ancienne is None:
+            logger.info("Version %s de %s active", version.numero, nom)
+        else:
+            logger.info("Version %s de %s active (remplace la version %s)", version.numero, nom, ancienne.numero)
+        if nom in self.apres_promotion:
+            try:
+                self.apres_promotion[nom](version)
+            except Exception as erreur:
+                logger.error("Après la promotion de %s : %r", nom, erreur)
+        if ancienne is not None:
+            self.drainer(ancienne)
+        return True
+
+    def rejeter(self, nom):
+        #la candidate est libérée, son empreinte n'est plus rechargée tant que les fichiers ne changent pas
+        with self.verrou:
+            version = self.candidates.pop(nom, None)
+            if version is None:
+                return False
+            self.ecartees[nom] = version.empreinte
+            self.compteurs["rejets"] += 1
+        logger.info("Version %s de %s rejetée", version.numero, nom)
+        self.drainer(version)
+        return True
+
+    def drainer(self, version):
+        #libère la version quand plus aucune requête ne l'utilise, dans un thread (la requête qui promeut n'attend pas)
+        with self.verrou:
+            self.en_drain.append(version)
+
+        def attendre():
+            with self.verrou:
+                while version.en_cours > 0:
+                    if not self.termine.wait(ATTENTE_DRAIN_LOG):
+                        logger.warning("Version %s de %s : %s requêtes encore en cours", version.numero, version.nom, version.en_cours)
+                self.en_drain.remove(version)
+                self.compteurs["liberees"] += 1
+            version.liberer()
+            gc.collect()
+            logger.info("Version %s de %s libérée", version.numero, version.nom)
+
+        threading.Thread(target=attendre, daemon=True, name=f"drain-{version.nom}-{version.numero}").start()
+
+    def surveiller(self, intervalle_s):
+        def boucle():
+            while True:
+                time.sleep(intervalle_s)
+                try:
+                    self.verifier()
+                except Exception as erreur:
+                    logger.error("Vérification des modèles : %r", erreur)
+
+        threading.Thread(target=boucle, daemon=True, name="surveillance-modeles").start()
+
+    def stats(self):
+        with self.verrou:
+            return {
+                "modeles": {nom: {"active": self.actives[nom].resume() if nom in self.actives else None,
+                                  "candidate": self.candidates[nom].resume() if nom in self.candidates else None,
+                                  "ombre": self.ombres[nom].resume() if nom in self.candidates else None,
+                                  "en_chargement": self.en_chargement[nom][:12] if nom in self.en_chargement else None,
+                                  "erreur": self.erreurs.get(nom)}
+                            for nom in self.chargeurs},
+                "en_drain": [v.resume() | {"nom": v.nom} for v in self.en_drain],
+                "ombre": {"fraction": self.fraction_ombre, "requetes": self.requetes_ombre, "accord_min": self.accord_min},
+                **self.compteurs,
+            }
+
+    def metriques(self):
+        #collecteur de metriques.registre
+        stats = self.stats()
+        lignes = [("modele_rechargements_total", "counter", "Nouvelles versions chargées", stats["rechargements"]),
+                  ("modele_rechargements_echecs_total", "counter", "Chargements de nouvelles versions en échec", stats["echecs"]),
+                  ("modele_promotions_total", "counter", "Changements de version active", stats["promotions"]),
+                  ("modele_versions_en_drain", "gauge", "Anciennes versions qui attendent la fin de leurs requêtes", len(stats["en_drain"]))]
+        for nom, modele in stats["modeles"].items():
+            if modele["active"] is not None:
+                lignes.append((f"modele_version_{nom}", "gauge", f"Numéro de la version active de {nom}", modele["active"]["numero"]))
+            if modele["ombre"] is not None and modele["ombre"]["accord"] is not None:
+                lignes.append((f"modele_ombre_accord_{nom}", "gauge", f"Accord active / candidate de {nom} en ombre", modele["ombre"]["accord"]))
+        return lignes
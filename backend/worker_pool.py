@@ -0,0 +1,158 @@
+# backend/worker_pool.py
+#mode superviseur : le process uvicorn charge les poids une seule fois puis fork un pool fixe de workers d'inférence
+#les tenseurs sont mis en mémoire partagée avant le fork (share_memory), les workers les lisent sans les copier,
+#la mémoire reste donc ~constante avec le nombre de workers
+#chaque worker fixe son nombre de threads torch pour ne pas se battre avec les autres pour les coeurs
+#les lots du MicroBatcher sont envoyés au worker qui a le moins de lots en attente
+#chaque résultat revient avec les deltas des métriques du worker, ajoutés à celles du parent (/metrics),
+#et l'état du worker (etat(), ex. compteurs de ses caches) gardé par le parent pour /nn-cache
+#remplacer() forke un nouveau pool depuis l'état courant du parent (modèles rechargés à chaud, voir versions_modeles.py),
+#les anciens workers finissent les lots déjà dans leur file puis s'arrêtent
+import itertools
+import multiprocessing
+import os
+import threading
+import torch
+import metriques
+
+ATTENTE_VIVANT = 1.     #secondes entre deux vérifications qu'un worker n'est pas mort pendant un lot
+
+
+def partager(*modeles):
+    #met les poids (et buffers) en mémoire partagée, à faire après le chargement et avant le fork
+    for modele in modeles:
+        modele.share_memory()
+        for nom, valeur in vars(modele).items():
+            if isinstance(valeur, torch.Tensor):
+                valeur.share_memory_()
+
+
+def boucle_worker(numero, taches, threads, demandes, resultats, initialiser, etat):
+    torch.set_num_threads(threads)
+    if initialiser is not None:
+        initialiser()
+    while True:
+        demande = demandes.get()
+        if demande is None:
+            break
+        id_lot, nom, lot = demande
+        try:
+            ok, valeur = True, taches[nom](lot)
+        except Exception as erreur:
+            ok, valeur = False, erreur
+        resultats.put((numero, id_lot, ok, valeur, metriques.registre.extraire(), etat() if etat is not None else None))
+
+
+class PoolWorkers:
+    def __init__(self, taches, nb_workers, threads_par_worker=None, initialiser=None, etat=None):
+        #taches : nom -> fonction(lot) -> résultats, ce sont les fonctions du process parent (héritées par le fork)
+        #initialiser : appelée dans chaque worker au démarrage (état propre au process, ex. caches neufs)
+        #etat : appelée dans le worker après chaque lot, son résultat est lu par etats_workers() dans le parent
+        self.taches = taches
+        self.nb_workers = nb_workers
+        self.threads = threads_par_worker or max(1, (os.cpu_count() or 1) // nb_workers)
+        self.initialiser = initialiser
+        self.etat = etat
+        self.contexte = multiprocessing.get_context("fork")
+        self.workers = {}       #numéro -> (process, file des demandes), workers qui reçoivent les nouveaux lots
+        self.en_attente = {}
+        self.traites = {}
+        self.etats = {}         #numéro -> dernier etat() renvoyé par le worker
+        self.lots = {}          #id du lot -> [Event, ok, valeur]
+        self.verrou = threading.Lock()
+        self.ids = itertools.count()
+        self.numeros = itertools.count()
+        self.remplacements = 0
+
+    def demarrer(self):
+        self.resultats = self.contexte.Queue()
+        self.workers = self.forker()
+        threading.Thread(target=self.collecter, daemon=True, name="collecteur").start()
+
+    def forker(self):
+        workers = {}
+        for _ in range(self.nb_workers):
+            numero = next(self.numeros)
+            demandes = self.contexte.Queue()
+            process = self.contexte.Process(target=boucle_worker, daemon=True, name=f"inference-{numero}",
+                                            args=(numero, self.taches, self.threads, demandes, self.resultats, self.initialiser, self.etat))
+            process.start()
+            with self.verrou:
+                self.en_attente[numero] = 0
+                self.traites[numero] = 0
+            workers[numero] = (process, demandes)
+        return workers
+
+    def remplacer(self):
+        #nouveaux workers d'abord, puis bascule sous le verrou : aucun lot n'attend un worker pendant le remplacement
+        nouveaux = self.forker()
+        with self.verrou:
+            anciens, self.workers = self.workers, nouveaux
+            #sous le verrou : aucun lot ne peut plus être mis dans une ancienne file après le None
+            for process, demandes in anciens.values():
+                demandes.put(None)
+            self.remplacements += 1
+        threading.Thread(target=self.retirer, args=(anciens,), daemon=True, name="retrait-workers").start()
+
+    def retirer(self, anciens):
+        for numero, (process, _) in anciens.items():
+            process.join()
+            with self.verrou:
+                self.en_attente.pop(numero, None)
+                self.traites.pop(numero, None)
+                self.etats.pop(numero, None)
+
+    def collecter(self):
+        while True:
+            numero, id_lot, ok, valeur, deltas, etat = self.resultats.get()
+            metriques.registre.fusionner(deltas)
+            with self.verrou:
+                #un worker remplacé peut déjà être retiré quand son dernier résultat est lu
+                if numero in self.en_attente:
+                    self.en_attente[numero] -= 1
+                    self.traites[numero] += 1
+                    if etat is not None:
+                        self.etats[numero] = etat
+                attente = self.lots.pop(id_lot, None)
+            if attente is not None:
+                attente[1:] = [ok, valeur]
+                attente[0].set()
+
+    def executer(self, nom, lot):
+        #bloquant, appelé depuis le thread d'un MicroBatcher
+        with self.verrou:
+            numero = min(self.workers, key=self.en_attente.__getitem__)
+            self.en_attente[numero] += 1
+            id_lot = next(self.ids)
+            attente = self.lots[id_lot] = [threading.Event(), None, None]
+            process, demandes = self.workers[numero]
+            demandes.put((id_lot, nom, lot))
+        while not attente[0].wait(ATTENTE_VIVANT):
+            #un worker remplacé s'arrête juste après son dernier lot : on laisse au collecteur le temps de le lire
+            if not process.is_alive() and not attente[0].wait(ATTENTE_VIVANT):
+                with self.verrou:
+                    self.lots.pop(id_lot, None)
+                raise RuntimeError(f"le worker {process.name} s'est arrêté (code {process.exitcode})")
+        if not attente[1]:
+            raise attente[2]
+        return attente[2]
+
+    def arreter(self):
+        for process, demandes in self.workers.values():
+            demandes.put(None)
+        for process, _ in self.workers.values():
+            process.join(timeout=5)
+
+    def etats_workers(self):
+        #dernier état de chaque worker actif (ceux qui n'ont encore traité aucun lot n'en ont pas)
+        with self.verrou:
+            return [self.etats[numero] for numero in self.workers if numero in self.etats]
+
+    def stats(self):
+        with self.verrou:
+            return {
+                "threads_par_worker": self.threads,
+                "remplacements": self.remplacements,
+                "workers": [{"pid": process.pid, "vivant": process.is_alive(), "en_attente": self.en_attente[i],
+                             "traites": self.traites[i]} for i, (process, _) in self.workers.items()],
+            }
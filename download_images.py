@@ -1,11 +1,29 @@
 #!/usr/bin/env python3
 """
 Script pour télécharger les images des monstres depuis Swarfarm CDN
+
+Téléchargement asynchrone (httpx) : un seul client et son pool de connexions, au plus --concurrence
+requêtes en vol, réessais avec backoff exponentiel sur les erreurs réseau, les 429 et les 5xx.
+Le manifeste (images/manifest.json) garde l'ETag, le Last-Modified et la taille de chaque image :
+- une image déjà dans le manifeste n'est pas retéléchargée (--revalider : requête conditionnelle, 304 si inchangée)
+- un téléchargement interrompu reprend depuis son fichier .part (Range + If-Range)
+Post-traitement (Pillow, optionnel) : miniatures WebP et atlas de sprites, avec une carte JSON
+des coordonnées de chaque monstre (par id) pour n'avoir que quelques fichiers à servir.
+
+Usage : python download_images.py [--json monsters_rta.json] [--dossier images] [--base-url URL]
+        [--concurrence 16] [--tentatives 5] [--revalider] [--taille-miniature 64] [--colonnes-atlas 32]
+        [--sans-post-traitement]
+Test en local : python -m http.server 8001 -d <dossier d'icônes> puis --base-url http://localhost:8001/
+Dépendances : pip install httpx tqdm (et pillow pour les miniatures et l'atlas)
 """
 
+import argparse
+import asyncio
 import json
 import os
-import requests
+import random
+import time
+import httpx
 from tqdm import tqdm
 from pathlib import Path
 
@@ -13,18 +31,205 @@ from pathlib import Path
 JSON_FILE = "monsters_rta.json"
 IMAGES_DIR = "images"
 BASE_URL = "https://swarfarm.com/static/herders/images/monsters/"
+MANIFEST = "manifest.json"
+# Codes HTTP temporaires : on réessaie
+CODES_A_REESSAYER = {408, 425, 429, 500, 502, 503, 504}
+
+
+class Reessayer(Exception):
+    def __init__(self, message, attente=None):
+        super().__init__(message)
+        self.attente = attente
+
+
+def lire_manifeste(chemin):
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def ecrire_manifeste(chemin, manifeste):
+    # Écriture atomique : un arrêt en plein milieu ne laisse pas un manifeste tronqué
+    temporaire = chemin + ".tmp"
+    with open(temporaire, "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, indent=1, sort_keys=True)
+    os.replace(temporaire, chemin)
+
+
+def attente_retry_after(valeur):
+    # Retry-After en secondes (la forme date HTTP est ignorée)
+    try:
+        return max(0., float(valeur))
+    except (TypeError, ValueError):
+        return None
+
+
+async def telecharger(client, url, chemin, manifeste, nom, revalider=False, tentatives=5, backoff=0.5):
+    """Télécharge une image, renvoie "telechargee", "reprise" ou "inchangee" (304).
+    L'entrée du manifeste est mise à jour sur place (validateurs, taille, validateur du .part en cours)."""
+    part = chemin + ".part"
+    for tentative in range(tentatives):
+        entree = manifeste.get(nom, {})
+        headers = {}
+        if revalider and os.path.exists(chemin):
+            # Requête conditionnelle : le serveur répond 304 sans corps si l'image n'a pas changé
+            if entree.get("etag"):
+                headers["If-None-Match"] = entree["etag"]
+            if entree.get("last_modified"):
+                headers["If-Modified-Since"] = entree["last_modified"]
+        deja = os.path.getsize(part) if os.path.exists(part) else 0
+        if deja and entree.get("partiel"):
+            # Reprise : If-Range fait renvoyer l'image entière (200) si elle a changé depuis le début du .part
+            headers["Range"] = f"bytes={deja}-"
+            headers["If-Range"] = entree["partiel"]
+        try:
+            async with client.stream("GET", url, headers=headers) as reponse:
+                if reponse.status_code == 304:
+                    return "inchangee"
+                if reponse.status_code == 416:
+                    # .part déjà complet ou plus long que l'image : on repart de zéro
+                    os.remove(part)
+                    raise Reessayer("HTTP 416", 0.)
+                if reponse.status_code in CODES_A_REESSAYER:
+                    raise Reessayer(f"HTTP {reponse.status_code}", attente_retry_after(reponse.headers.get("retry-after")))
+                reponse.raise_for_status()
+                reprise = reponse.status_code == 206
+                etag = reponse.headers.get("etag")
+                last_modified = reponse.headers.get("last-modified")
+                # Validateur fort seulement (un ETag faible W/ ne peut pas servir à If-Range)
+                validateur = etag if etag and not etag.startswith("W/") else last_modified
+                manifeste[nom] = {**entree, "partiel": validateur}
+                with open(part, "ab" if reprise else "wb") as f:
+                    async for bloc in reponse.aiter_bytes(65536):
+                        f.write(bloc)
+            os.replace(part, chemin)
+            manifeste[nom] = {"etag": etag, "last_modified": last_modified, "taille": os.path.getsize(chemin),
+                              "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            return "reprise" if reprise else "telechargee"
+        except (httpx.TransportError, Reessayer) as e:
+            if tentative == tentatives - 1:
+                raise
+            # Backoff exponentiel avec jitter, ou le délai demandé par le serveur
+            attente = getattr(e, "attente", None)
+            if attente is None:
+                attente = backoff * 2 ** tentative * (0.5 + random.random())
+            await asyncio.sleep(attente)
+
+
+async def telecharger_tout(noms, dossier, base_url, manifeste, chemin_manifeste, concurrence=16,
+                           tentatives=5, revalider=False, timeout=30.):
+    """Télécharge toutes les images en parallèle (au plus `concurrence` en vol), renvoie (compteurs, erreurs)."""
+    limites = httpx.Limits(max_connections=concurrence, max_keepalive_connections=concurrence)
+    semaphore = asyncio.Semaphore(concurrence)
+    compteurs = {"telechargee": 0, "reprise": 0, "inchangee": 0}
+    erreurs = []
+    barre = tqdm(total=len(noms), desc="Téléchargement")
+
+    async def une(client, nom):
+        async with semaphore:
+            try:
+                statut = await telecharger(client, base_url + nom, os.path.join(dossier, nom), manifeste, nom,
+                                           revalider, tentatives)
+                compteurs[statut] += 1
+            except (httpx.HTTPError, Reessayer, OSError) as e:
+                message = str(e).splitlines()[0] if str(e) else type(e).__name__
+                erreurs.append((nom, message))
+                tqdm.write(f"Erreur pour {nom}: {message}")
+            barre.update(1)
+            # Le manifeste est réécrit régulièrement : un arrêt brutal ne perd que les dernières images
+            if barre.n % 100 == 0:
+                ecrire_manifeste(chemin_manifeste, manifeste)
+
+    try:
+        async with httpx.AsyncClient(limits=limites, timeout=timeout, follow_redirects=True) as client:
+            await asyncio.gather(*(une(client, nom) for nom in noms))
+    finally:
+        barre.close()
+        ecrire_manifeste(chemin_manifeste, manifeste)
+    return compteurs, erreurs
+
+
+def miniatures(dossier, noms, taille, sortie):
+    """Miniatures WebP carrées de `taille` px, refaites si l'image source est plus récente
+    ou si la miniature existante a une autre taille (run précédent avec un autre --taille-miniature)."""
+    from PIL import Image
+    os.makedirs(sortie, exist_ok=True)
+    chemins = {}
+    faites = 0
+    for nom in noms:
+        source = os.path.join(dossier, nom)
+        if not os.path.exists(source):
+            continue
+        cible = os.path.join(sortie, Path(nom).stem + ".webp")
+        chemins[nom] = cible
+        if os.path.exists(cible) and os.path.getmtime(cible) >= os.path.getmtime(source):
+            # Image.open ne lit que l'en-tête
+            with Image.open(cible) as miniature:
+                if miniature.size == (taille, taille):
+                    continue
+        with Image.open(source) as image:
+            image.convert("RGBA").resize((taille, taille), Image.LANCZOS).save(cible, "WEBP", quality=85, method=6)
+        faites += 1
+    return chemins, faites
+
+
+def atlas(monsters, chemins_miniatures, taille, colonnes, sortie):
+    """Atlas de sprites (colonnes x colonnes icônes par fichier) et atlas.json :
+    {"taille", "atlas": [fichiers], "monstres": {id: {"atlas", "x", "y", "w", "h"}}}.
+    Une image partagée par plusieurs monstres n'est placée qu'une fois."""
+    from PIL import Image
+    os.makedirs(sortie, exist_ok=True)
+    noms = sorted(chemins_miniatures)
+    par_atlas = colonnes * colonnes
+    fichiers = []
+    cases = {}
+    for debut in range(0, len(noms), par_atlas):
+        bloc = noms[debut:debut + par_atlas]
+        lignes = -(-len(bloc) // colonnes)
+        feuille = Image.new("RGBA", (colonnes * taille, lignes * taille), (0, 0, 0, 0))
+        for i, nom in enumerate(bloc):
+            x, y = (i % colonnes) * taille, (i // colonnes) * taille
+            with Image.open(chemins_miniatures[nom]) as miniature:
+                feuille.paste(miniature, (x, y))
+            cases[nom] = {"atlas": len(fichiers), "x": x, "y": y, "w": taille, "h": taille}
+        fichier = f"atlas_{len(fichiers)}.webp"
+        feuille.save(os.path.join(sortie, fichier), "WEBP", quality=85, method=6)
+        fichiers.append(fichier)
+    carte = {"taille": taille, "atlas": fichiers,
+             "monstres": {str(m["id"]): cases[m["image_filename"]] for m in monsters
+                          if m.get("image_filename") in cases and "id" in m}}
+    with open(os.path.join(sortie, "atlas.json"), "w", encoding="utf-8") as f:
+        json.dump(carte, f, separators=(",", ":"))
+    return carte
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Télécharge les icônes des monstres et prépare miniatures et atlas")
+    parser.add_argument("--json", default=JSON_FILE)
+    parser.add_argument("--dossier", default=IMAGES_DIR)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--concurrence", type=int, default=16)
+    parser.add_argument("--tentatives", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.)
+    parser.add_argument("--revalider", action="store_true", help="requêtes conditionnelles sur les images déjà téléchargées")
+    parser.add_argument("--taille-miniature", type=int, default=64)
+    parser.add_argument("--colonnes-atlas", type=int, default=32)
+    parser.add_argument("--sans-post-traitement", action="store_true")
+    args = parser.parse_args()
+    base_url = args.base_url if args.base_url.endswith("/") else args.base_url + "/"
+
     # Créer le dossier images s'il n'existe pas
-    os.makedirs(IMAGES_DIR, exist_ok=True)
+    os.makedirs(args.dossier, exist_ok=True)
 
     # Lire le fichier JSON
-    print(f"Lecture du fichier {JSON_FILE}...")
+    print(f"Lecture du fichier {args.json}...")
     try:
-        with open(JSON_FILE, "r", encoding="utf-8") as f:
+        with open(args.json, "r", encoding="utf-8") as f:
             monsters = json.load(f)
     except FileNotFoundError:
-        print(f"Erreur: Le fichier {JSON_FILE} n'existe pas.")
+        print(f"Erreur: Le fichier {args.json} n'existe pas.")
         return
     except json.JSONDecodeError as e:
         print(f"Erreur: Impossible de parser le JSON: {e}")
@@ -32,56 +237,40 @@ def main():
 
     # Extraire toutes les valeurs uniques de image_filename
     print("Extraction des noms d'images...")
-    image_filenames = set()
-    for monster in monsters:
-        if "image_filename" in monster and monster["image_filename"]:
-            image_filenames.add(monster["image_filename"])
-
+    image_filenames = sorted({monster["image_filename"] for monster in monsters if monster.get("image_filename")})
     total_images = len(image_filenames)
     print(f"Nombre d'images uniques trouvées: {total_images}")
 
-    # Filtrer les images déjà téléchargées
-    existing_files = set(os.listdir(IMAGES_DIR)) if os.path.exists(IMAGES_DIR) else set()
-    images_to_download = [img for img in image_filenames if img not in existing_files]
+    # Manifeste : les images déjà présentes sans entrée (anciennes versions du script) sont adoptées telles quelles
+    chemin_manifeste = os.path.join(args.dossier, MANIFEST)
+    manifeste = lire_manifeste(chemin_manifeste)
+    for nom in image_filenames:
+        chemin = os.path.join(args.dossier, nom)
+        if os.path.exists(chemin) and "taille" not in manifeste.get(nom, {}):
+            manifeste[nom] = {**manifeste.get(nom, {}), "taille": os.path.getsize(chemin)}
+    # Une image est à télécharger si elle manque, si sa taille ne correspond plus au manifeste, ou avec --revalider
+    def a_jour(nom):
+        chemin = os.path.join(args.dossier, nom)
+        return os.path.exists(chemin) and os.path.getsize(chemin) == manifeste.get(nom, {}).get("taille")
+    images_to_download = [nom for nom in image_filenames if args.revalider or not a_jour(nom)]
 
-    already_downloaded = total_images - len(images_to_download)
+    already_downloaded = sum(a_jour(nom) for nom in image_filenames)
     if already_downloaded > 0:
         print(f"Images déjà téléchargées: {already_downloaded}")
-    print(f"Images à télécharger: {len(images_to_download)}")
+    print(f"Images à {'vérifier ou ' if args.revalider else ''}télécharger: {len(images_to_download)}")
 
-    if not images_to_download:
+    compteurs, error_list = {"telechargee": 0, "reprise": 0, "inchangee": 0}, []
+    if images_to_download:
+        print(f"\nTéléchargement des images depuis {base_url} ({args.concurrence} en parallèle)...")
+        debut = time.perf_counter()
+        compteurs, error_list = asyncio.run(telecharger_tout(
+            images_to_download, args.dossier, base_url, manifeste, chemin_manifeste,
+            args.concurrence, args.tentatives, args.revalider, args.timeout))
+        duree = time.perf_counter() - debut
+    else:
         print("Toutes les images sont déjà téléchargées!")
-        return
-
-    # Télécharger les images
-    print(f"\nTéléchargement des images depuis {BASE_URL}...")
-    downloaded = 0
-    errors = 0
-    error_list = []
-
-    for image_filename in tqdm(images_to_download, desc="Téléchargement"):
-        image_url = BASE_URL + image_filename
-        image_path = os.path.join(IMAGES_DIR, image_filename)
-
-        try:
-            response = requests.get(image_url, timeout=30, stream=True)
-            response.raise_for_status()
-
-            # Sauvegarder l'image
-            with open(image_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            downloaded += 1
-
-        except requests.exceptions.RequestException as e:
-            errors += 1
-            error_list.append((image_filename, str(e)))
-            tqdm.write(f"Erreur pour {image_filename}: {e}")
-        except Exception as e:
-            errors += 1
-            error_list.append((image_filename, str(e)))
-            tqdm.write(f"Erreur inattendue pour {image_filename}: {e}")
+        ecrire_manifeste(chemin_manifeste, manifeste)
+        duree = 0.
 
     # Résumé final
     print("\n" + "="*60)
@@ -89,19 +278,37 @@ def main():
     print("="*60)
     print(f"Nombre total d'images trouvées: {total_images}")
     print(f"Images déjà téléchargées: {already_downloaded}")
-    print(f"Images téléchargées avec succès: {downloaded}")
-    print(f"Nombre d'erreurs: {errors}")
+    print(f"Images téléchargées avec succès: {compteurs['telechargee'] + compteurs['reprise']} "
+          f"(dont {compteurs['reprise']} reprises) en {duree:.1f} s")
+    if args.revalider:
+        print(f"Images inchangées (304): {compteurs['inchangee']}")
+    print(f"Nombre d'erreurs: {len(error_list)}")
 
-    if errors > 0 and error_list:
+    if error_list:
         print("\nErreurs rencontrées:")
         for filename, error in error_list[:10]:  # Afficher les 10 premières erreurs
             print(f"  - {filename}: {error}")
         if len(error_list) > 10:
             print(f"  ... et {len(error_list) - 10} autres erreurs")
 
-    print(f"\nDossier des images: {os.path.abspath(IMAGES_DIR)}")
+    print(f"\nDossier des images: {os.path.abspath(args.dossier)}")
     print("="*60)
 
+    # Post-traitement : miniatures WebP puis atlas à partir des miniatures
+    if args.sans_post_traitement:
+        return
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("Pillow n'est pas installé (pip install pillow) : miniatures et atlas ignorés")
+        return
+    chemins, faites = miniatures(args.dossier, image_filenames, args.taille_miniature,
+                                 os.path.join(args.dossier, "miniatures"))
+    print(f"Miniatures WebP {args.taille_miniature}px: {len(chemins)} ({faites} générées)")
+    carte = atlas(monsters, chemins, args.taille_miniature, args.colonnes_atlas, os.path.join(args.dossier, "atlas"))
+    print(f"Atlas: {len(carte['atlas'])} fichier(s), {len(carte['monstres'])} monstres dans "
+          f"{os.path.join(args.dossier, 'atlas', 'atlas.json')}")
+
+
 if __name__ == "__main__":
     main()
-